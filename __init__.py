@@ -58,6 +58,9 @@ import config         # General settings for server ports and autostarting.
 import server         # TiMBL and MBT servers.
 import client         # TiMBL and MBT clients.
 import mbsp           # The parser: part-of-speech tagger, chunker, lemmatizer, relation finder, PP-attachment.
+import metrics        # Time spent in each parser stage and server requests (config.metrics=True).
+import profiler       # Sampled call stacks of each parser stage (config.profile=True).
+import shared         # Parse cache shared between processes (config.shared_cache).
 import tokenizer      # The parser's sentence tokenizer.
 import relationfinder # The parser's relation finder.
 import prepositions   # The parser's PP-attacher.
@@ -73,7 +76,7 @@ from config import LEMMA, CHUNK, RELATION, PREPOSITION, ALL
 from config import events
 from server import active_servers, Server, Servers, TIMBL, MBT
 from client import Client, Timbl, Mbt, LOCALHOST, log
-from client import ClientError, ClientDisconnectedError, ClientTimeoutError, ServerConnectionError
+from client import ClientError, ClientDisconnectedError, ClientTimeoutError, ServerConnectionError, DeadlineError
 from client import CONNECTION_RESET_BY_PEER, CONNECTION_REFUSED, BROKEN_PIPE
 from mbsp   import TokenString, TokenList, TokenTags, TOKENS
 from tree   import Text, Sentence, Slice, Chunk, PNPChunk, Chink, Word, AND, OR
@@ -103,9 +106,43 @@ from config import SBJ, OBJ, PRD, CLR, DIR, EXT, LOC, PRP
 def clear_cache():
     """ Clears the parser cache, the client logs and all internal clients.
     """
-    for dict in (mbsp.cache, prepositions.cache, client.log, client._clients, ):
+    for dict in (mbsp.cache, mbsp.sentence_cache, mbsp.stage_cache, prepositions.cache, client.log, client.pools, client.classification_caches, ):
         dict.clear()
 
+def memory():
+    """ Returns a dictionary of cache name => dictionary with the number of entries and their memory usage, e.g.:
+        memory()["mbsp.sentence_cache"]["bytes"] is the estimated size of the tagged sentences in cache,
+        memory()["client.pools[chunk]"]["entries"] is the number of open connections to the chunk server.
+        Caches also report their budget (see config.cache_bytes), hits, misses and evictions.
+    """
+    m = {}
+    for name, cache in mbsp.caches():
+        m[name] = cache.stats()
+    for name, cache in client.log.items():
+        m["client.log[%s]" % name] = cache.stats()
+    for name, cache in client.classification_caches.items():
+        m["client.classifications[%s]" % name] = cache.stats()
+    pools = client.pools.items()
+    for (name, host, port), pool in pools:
+        # With replicas (see config.ports), a server has a pool for each host:port.
+        k = len([1 for (x, h, p), pool2 in pools if x == name]) > 1 and "%s@%s:%s" % (name, host, port) or name
+        m["client.pools[%s]" % k] = pool.stats()
+    if shared.shared() is not None:
+        m["shared"] = shared.shared().stats()
+    return m
+
+def stats():
+    """ Returns a dictionary of metrics recorded with config.metrics=True, e.g.:
+        stats()["stage_seconds"]["chunk"]["sum"] is the time spent in the chunker,
+        stats()["server_requests"]["chunk"] is the number of requests sent to the chunk server.
+    """
+    return metrics.stats()
+
+def reset_stats():
+    """ Sets all the metrics to zero.
+    """
+    metrics.reset()
+
 def started(name=ALL):
     """ Returns True when the TiMBL and MBT servers are up and running.
         The servers can also be checked individually by name (CHUNK/LEMMA/RELATION/PREPOSITION).
@@ -141,6 +178,30 @@ def parse(*args, **kwargs):
     """
     return mbsp.parse(*args, **kwargs)
 
+def parse_many(*args, **kwargs):
+    """ Takes an iterable of strings and returns a list of tagged Unicode strings, one for each string.
+        The sentences of all strings are sent to the servers together, see parse() for the options.
+    """
+    return mbsp.parse_many(*args, **kwargs)
+
+def parse_stream(*args, **kwargs):
+    """ Takes a file-like object and yields a tagged Unicode string for each sentence in the file.
+        The file is read incrementally, so memory usage does not depend on the size of the file.
+    """
+    return mbsp.parse_stream(*args, **kwargs)
+
+def parse_parallel(*args, **kwargs):
+    """ Takes a list of strings and returns a list of tagged Unicode strings, in the same order.
+        The strings are parsed in a pool of processes, one for each CPU core by default.
+    """
+    return mbsp.parse_parallel(*args, **kwargs)
+
+def parse_async(*args, **kwargs):
+    """ Takes a string and returns an AsynchronousParse, which is parsed while asyncore.loop() is running.
+        Once AsynchronousParse.done is True, AsynchronousParse.value is the tagged Unicode string.
+    """
+    return mbsp.parse_async(*args, **kwargs)
+
 ######################################################################################################
 
 def tokenize(*args, **kwargs):
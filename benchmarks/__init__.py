@@ -0,0 +1,188 @@
+#### MEMORY-BASED SHALLOW PARSER ######################################################################
+
+# Copyright (c) 2003-2010 University of Antwerp, Belgium and Tilburg University, The Netherlands
+# Vincent Van Asch <vincent.vanasch@ua.ac.be>, Tom De Smedt <tom@organisms.be>
+# License: GNU General Public License, see LICENSE.txt
+
+### BENCHMARKS #######################################################################################
+# Measures the throughput of the parser stages on a corpus of a given size (see corpus.py),
+# and returns a report that can be saved as JSON, so that changes to the parser can be compared.
+# Stages that work on tagged sentences run offline:
+# - tokenizer.split            : sentence splitting and tokenization,
+# - mbsp._find_prepositions    : PNP finder,
+# - relationfinder._lookup     : relation finder lookup instances,
+# - prepositions.PP_instances  : PP-attacher trees + lookup instances,
+# - tree.Text                  : parse tree construction.
+# Stages that need a server are skipped when the server is not running:
+# - relationfinder.tag_many, prepositions.pp_attachments_many, mbsp.parse.
+# Usage:
+# >>> from MBSP.benchmarks import corpus, run
+# >>> print run(corpus.generate(sentences=1000, mean=20))
+# From the command line:
+# > python benchmarks/run.py -n 1000 -o report.json
+
+import sys, time, socket
+
+try:
+    import resource
+except ImportError:
+    # Windows has no resource module (peak memory usage is then not reported).
+    resource = None
+
+try:
+    from MBSP import config, client, mbsp, metrics, tokenizer, relationfinder, prepositions, tree
+    from MBSP.config import WORD, POS, CHUNK, PNP, REL, ANCHOR, LEMMA
+    from MBSP.prepositions import classify
+except ImportError:
+    # We will end up here if the benchmarks are run from the command line (see run.py).
+    import config, client, mbsp, metrics, tokenizer, relationfinder, prepositions, tree
+    from config import WORD, POS, CHUNK, PNP, REL, ANCHOR, LEMMA
+    from prepositions import classify
+
+import corpus
+
+#--- HELPER FUNCTIONS --------------------------------------------------------------------------------
+
+def peak_rss():
+    """ Returns the peak memory usage of the process in kilobytes (or None).
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss = rss / 1024 # Mac OS X reports bytes instead of kilobytes.
+    return rss
+
+def online(name):
+    """ Returns True if the server with the given name (e.g. CHUNK) accepts connections.
+    """
+    if name not in mbsp.HOSTS:
+        return False
+    for host, port in client.endpoints(mbsp.HOSTS[name], mbsp.PORTS[name]):
+        # With replicas (see config.ports), one replica is enough.
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.settimeout(1.0)
+            s.connect((host, port))
+            s.close()
+            return True
+        except socket.error:
+            pass
+    return False
+
+def clear():
+    # Parse results are cached in several places, which would make every run after the first one faster.
+    for cache in (mbsp.cache, mbsp.sentence_cache, mbsp.stage_cache, prepositions.cache, client.classification_caches):
+        cache.clear()
+
+def measure(function, setup=None, repeat=3):
+    """ Returns the shortest time (in seconds) of the given number of calls to function(setup()).
+        The time spent in setup() (e.g. copying the input) is not measured.
+    """
+    best = None
+    for i in range(repeat):
+        clear()
+        x = setup is not None and setup() or None
+        t = time.time()
+        function(x)
+        t = time.time() - t
+        best = best is None and t or min(best, t)
+    return best
+
+#--- TAGGED INPUT ------------------------------------------------------------------------------------
+
+def _encode(s):
+    return mbsp.encode_entities(s).encode("utf-8")
+
+def tables(c):
+    """ Returns the token tables (see mbsp._table()) with WORD, POS and CHUNK tags for the given corpus.
+    """
+    return [{WORD: [_encode(w) for w, pos, ch in s],
+              POS: [pos for w, pos, ch in s],
+            CHUNK: [ch for w, pos, ch in s]} for s in c]
+
+def tagged(c):
+    """ Returns the slash-formatted WORD/POS/CHUNK/PNP/REL/ANCHOR/LEMMA sentences for the given corpus.
+        Relations and anchors are left empty (O), lemmata are the lowercase words.
+    """
+    T = mbsp._find_prepositions(tables(c))
+    for t in T:
+        t[REL] = t[ANCHOR] = ["O"] * len(t[WORD])
+        t[LEMMA] = [w.lower() for w in t[WORD]]
+    return [mbsp._render([t], [WORD, POS, CHUNK, PNP, REL, ANCHOR, LEMMA]).decode("utf-8") for t in T]
+
+#--- BENCHMARKS --------------------------------------------------------------------------------------
+
+def run(c, repeat=3, stages=None):
+    """ Runs the benchmarks on the given Corpus and returns a report (a dictionary).
+        For each stage, the report contains the time in seconds, sentences/sec, tokens/sec
+        and the peak memory usage of the process after the stage.
+        For mbsp.parse, the time spent in each parser stage is included (see metrics.py).
+        The given list of stage names can be used to run only some of the benchmarks.
+    """
+    n = len(c)
+    m = c.tokens
+    report = {
+           "corpus" : {"sentences": n, "tokens": m, "length": c.lengths()},
+           "python" : sys.version.split()[0],
+           "repeat" : repeat,
+           "stages" : {},
+          "skipped" : [],
+    }
+    B = []
+    B.append(("tokenizer.split", True,
+        lambda x: tokenizer.split(x), lambda: u" ".join(c.text.splitlines())))
+    if c.tagged:
+        T = tagged(c)
+        B.append(("mbsp._find_prepositions", True,
+            lambda x: mbsp._find_prepositions(x), lambda: tables(c)))
+        B.append(("relationfinder._lookup", True,
+            lambda x: [relationfinder._lookup(relationfinder._split(s)) for s in x],
+            lambda: [" ".join(["/".join(t.split("/")[:4]) for t in s.split(" ")]).encode("utf-8") for s in T]))
+        B.append(("prepositions.PP_instances", True,
+            lambda x: [classify._lookup(s, [WORD, POS, CHUNK, PNP, REL, ANCHOR, LEMMA]) for s in x], lambda: T))
+        B.append(("tree.Text", True,
+            lambda x: tree.Text(x, [WORD, POS, CHUNK, PNP, REL, ANCHOR, LEMMA]), lambda: u"\n".join(T)))
+        B.append(("relationfinder.tag_many", online(config.RELATION),
+            lambda x: relationfinder.tag_many(x),
+            lambda: [" ".join(["/".join(t.split("/")[:4]) for t in s.split(" ")]).encode("utf-8") for s in T]))
+        B.append(("prepositions.pp_attachments_many", online(config.PREPOSITION),
+            lambda x: prepositions.pp_attachments_many(x, [WORD, POS, CHUNK, PNP, REL, LEMMA]),
+            lambda: [" ".join(["/".join(t.split("/")[:5]+t.split("/")[6:]) for t in s.split(" ")]) for s in T]))
+    else:
+        report["skipped"].extend(["mbsp._find_prepositions", "relationfinder._lookup",
+            "prepositions.PP_instances", "tree.Text", "relationfinder.tag_many", "prepositions.pp_attachments_many"])
+    # A full parse with the servers that are running.
+    options = {
+        "relations" : online(config.RELATION),
+          "lemmata" : online(config.LEMMA),
+          "anchors" : online(config.PREPOSITION) and online(config.LEMMA)
+    }
+    B.append(("mbsp.parse", online(config.CHUNK),
+        lambda x: mbsp.parse(x, **options), lambda: u" ".join(c.text.splitlines())))
+    for name, available, function, setup in B:
+        if stages is not None and name not in stages:
+            continue
+        if not available:
+            report["skipped"].append(name); continue
+        if name == "mbsp.parse":
+            m1, config.metrics = config.metrics, True
+            metrics.reset()
+        t = measure(function, setup, repeat)
+        report["stages"][name] = {
+                "seconds" : t,
+          "sentences/sec" : t > 0 and n / t or None,
+             "tokens/sec" : t > 0 and m / t or None,
+            "peak_rss_kb" : peak_rss()
+        }
+        if name == "mbsp.parse":
+            # Time spent in each parser stage and server, averaged over the runs.
+            config.metrics = m1
+            s = metrics.stats()
+            report["stages"][name]["options"] = options
+            report["stages"][name]["breakdown"] = dict(
+                [(k, v["sum"] / repeat) for k, v in s.get("stage_seconds", {}).items()])
+            report["stages"][name]["servers"] = dict(
+                [(k, v["sum"] / repeat) for k, v in s.get("server_latency_seconds", {}).items()])
+    report["peak_rss_kb"] = peak_rss()
+    return report
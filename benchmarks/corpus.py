@@ -0,0 +1,120 @@
+#### MEMORY-BASED SHALLOW PARSER ######################################################################
+
+# Copyright (c) 2003-2010 University of Antwerp, Belgium and Tilburg University, The Netherlands
+# Vincent Van Asch <vincent.vanasch@ua.ac.be>, Tom De Smedt <tom@organisms.be>
+# License: GNU General Public License, see LICENSE.txt
+
+### CORPUS ###########################################################################################
+# Generates synthetic corpora of a given size and sentence length distribution for the benchmarks.
+# Sentences are built from noun phrases, verb phrases and prepositional phrases with a small vocabulary,
+# so each word comes with a part-of-speech tag and a chunk tag, and the stages that work on
+# tagged sentences (e.g. the PNP finder) can be measured without the MBT server.
+# Corpora can also be loaded from a text file (untagged) or from a slash-formatted file (tagged).
+
+import random, codecs
+
+# Part-of-speech tag => words.
+VOCABULARY = {
+    "DT" : ["the", "a", "this", "every", "some"],
+    "JJ" : ["red", "small", "old", "quick", "happy", "bright", "strange", "local"],
+    "NN" : ["cat", "pizza", "fork", "house", "river", "teacher", "city", "report", "garden", "market"],
+   "NNS" : ["cats", "forks", "houses", "teachers", "cities", "reports", "gardens"],
+   "NNP" : ["Alice", "Antwerp", "Tilburg", "Smith"],
+   "VBZ" : ["eats", "sees", "likes", "builds", "reads", "finds"],
+   "VBD" : ["ate", "saw", "liked", "built", "read", "found"],
+    "IN" : ["with", "in", "on", "under", "near", "of", "from"],
+    "CC" : ["and", "but"],
+}
+
+class Corpus(list):
+
+    def __init__(self, sentences=[]):
+        """ A list of sentences, where each sentence is a list of (word, part-of-speech, chunk)-tuples.
+            Tags are None for untagged corpora (see load()).
+        """
+        list.__init__(self, sentences)
+
+    @property
+    def tagged(self):
+        return len(self) > 0 and self[0][0][1] is not None
+
+    @property
+    def tokens(self):
+        return sum([len(s) for s in self])
+
+    @property
+    def text(self):
+        """ Returns the corpus as a plain unicode string (one sentence per line).
+        """
+        return u"\n".join([u" ".join([w for w, pos, ch in s]) for s in self])
+
+    def lengths(self):
+        """ Returns a dictionary with the minimum, maximum and mean sentence length (in tokens).
+        """
+        n = [len(s) for s in self] or [0]
+        return {"min": min(n), "max": max(n), "mean": float(sum(n)) / len(n)}
+
+def _np(r, adjectives=0):
+    # Returns a list of (word, tag, chunk)-tuples for a noun phrase.
+    if r.random() < 0.2:
+        return [(r.choice(VOCABULARY["NNP"]), "NNP", "NP")]
+    np = [(r.choice(VOCABULARY["DT"]), "DT", "NP")]
+    np.extend([(r.choice(VOCABULARY["JJ"]), "JJ", "NP") for i in range(adjectives)])
+    pos = r.choice(("NN", "NN", "NNS"))
+    np.append((r.choice(VOCABULARY[pos]), pos, "NP"))
+    return np
+
+def _sentence(r, length):
+    # Returns a list of chunks (each a list of tuples) with approximately the given number of tokens.
+    # A clause is: NP VP NP (PP NP)*, clauses are joined with a conjunction.
+    chunks = []
+    n = 0
+    while True:
+        if len(chunks) > 0:
+            chunks.append([(r.choice(VOCABULARY["CC"]), "CC", "O")])
+        pos = r.choice(("VBZ", "VBD"))
+        for ch in (_np(r, r.randint(0, 2)), [(r.choice(VOCABULARY[pos]), pos, "VP")], _np(r, r.randint(0, 1))):
+            chunks.append(ch)
+        while sum([len(ch) for ch in chunks]) < length - 4 and r.random() < 0.7:
+            chunks.append([(r.choice(VOCABULARY["IN"]), "IN", "PP")])
+            chunks.append(_np(r, r.randint(0, 2)))
+        if sum([len(ch) for ch in chunks]) >= length - 4:
+            break
+    chunks.append([(".", ".", "O")])
+    return chunks
+
+def generate(sentences=1000, mean=20, deviation=8, minimum=4, maximum=60, seed=0):
+    """ Returns a synthetic Corpus with the given number of sentences.
+        Sentence lengths are drawn from a normal distribution with the given mean and deviation,
+        clipped to the given minimum and maximum (the actual length can differ by a few tokens).
+        The same seed always yields the same corpus.
+    """
+    r = random.Random(seed)
+    corpus = Corpus()
+    for i in range(sentences):
+        n = int(r.gauss(mean, deviation))
+        n = max(minimum, min(maximum, n))
+        s = []
+        for ch in _sentence(r, n):
+            for j, (w, pos, tag) in enumerate(ch):
+                # Chunk tags are in IOB-format, B- marks a chunk that directly follows a chunk of the same type.
+                b = j == 0 and tag != "O" and len(s) > 0 and s[-1][2] == "I-"+tag
+                s.append((w, pos, tag != "O" and (b and "B-" or "I-") + tag or "O"))
+        s[0] = (s[0][0][0].upper() + s[0][0][1:], s[0][1], s[0][2])
+        corpus.append(s)
+    return corpus
+
+def load(path, tagged=False, encoding="utf-8"):
+    """ Returns a Corpus from the given text file, with one sentence on each line.
+        With tagged=True, each line contains slash-formatted word/part-of-speech/chunk tokens,
+        otherwise each line is a tokenized sentence (words separated by a space).
+    """
+    corpus = Corpus()
+    for s in codecs.open(path, "r", encoding).read().splitlines():
+        s = s.split()
+        if len(s) > 0:
+            if tagged:
+                corpus.append([tuple(token.rsplit("/", 2)) for token in s])
+            else:
+                corpus.append([(w, None, None) for w in s])
+    return corpus
@@ -0,0 +1,75 @@
+#### MEMORY-BASED SHALLOW PARSER ######################################################################
+
+# Copyright (c) 2003-2010 University of Antwerp, Belgium and Tilburg University, The Netherlands
+# Vincent Van Asch <vincent.vanasch@ua.ac.be>, Tom De Smedt <tom@organisms.be>
+# License: GNU General Public License, see LICENSE.txt
+
+### RUN BENCHMARKS ###################################################################################
+# Runs the benchmarks from the command line and prints (or saves) the report as JSON.
+# The servers are not started automatically, stages that need a server are skipped if it is not running.
+# Usage:
+# > python benchmarks/run.py -n 1000 -m 20 -d 8 -o report.json
+# > python benchmarks/run.py -f corpus.txt --tagged
+# -n --sentences : number of sentences in the synthetic corpus.
+# -m --mean      : mean sentence length (in tokens).
+# -d --deviation : standard deviation of the sentence length.
+# -s --seed      : random seed, the same seed generates the same corpus.
+# -f --file      : load the corpus from a file with one sentence per line.
+# -t --tagged    : the corpus file contains word/part-of-speech/chunk tokens.
+# -r --repeat    : number of runs of each stage (the fastest run is reported).
+# -o --output    : the JSON file to write the report to.
+# -l --standin   : start stand-in servers (see standin.py) with the given latency (in seconds),
+#                  so that the stages that need a server can be measured without TiMBL and MBT.
+
+import os, sys
+
+try: 
+    import json
+except ImportError:
+    # Python 2.5 has no json module.
+    import simplejson as json
+
+def main():
+
+    import optparse
+
+    p = optparse.OptionParser()
+    p.add_option("-n", "--sentences", dest="sentences", type="int", default=1000, help="number of sentences")
+    p.add_option("-m", "--mean", dest="mean", type="float", default=20, help="mean sentence length")
+    p.add_option("-d", "--deviation", dest="deviation", type="float", default=8, help="sentence length deviation")
+    p.add_option("-s", "--seed", dest="seed", type="int", default=0, help="random seed")
+    p.add_option("-f", "--file", dest="file", action="store", help="corpus file", metavar="FILE")
+    p.add_option("-t", "--tagged", dest="tagged", action="store_true", help="the corpus file is tagged")
+    p.add_option("-r", "--repeat", dest="repeat", type="int", default=3, help="number of runs per stage")
+    p.add_option("-o", "--output", dest="output", action="store", help="JSON report file", metavar="FILE")
+    p.add_option("-l", "--standin", dest="standin", type="float", default=None, help="stand-in server latency")
+    options, arguments = p.parse_args()
+
+    # Import the parser from the folder above, without starting the servers.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import config
+    config.autostart = False
+    import benchmarks
+    from benchmarks import corpus
+
+    if options.standin is not None:
+        # The lemmatizer is skipped: MBLEM is a local executable that only uses the server for unknown words.
+        import standin
+        for s in standin.standins(latency=options.standin):
+            if s.name != config.LEMMA:
+                s.start()
+
+    if options.file:
+        c = corpus.load(options.file, tagged=options.tagged)
+    else:
+        c = corpus.generate(options.sentences, options.mean, options.deviation, seed=options.seed)
+    report = benchmarks.run(c, repeat=options.repeat)
+    report["standin"] = options.standin
+    s = json.dumps(report, sort_keys=True, indent=2)
+    if options.output:
+        f = open(options.output, "w"); f.write(s); f.close()
+    else:
+        print s
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#### MEMORY-BASED SHALLOW PARSER ######################################################################
+
+# Copyright (c) 2003-2010 University of Antwerp, Belgium and Tilburg University, The Netherlands
+# Vincent Van Asch <vincent.vanasch@ua.ac.be>, Tom De Smedt <tom@organisms.be>
+# License: GNU General Public License, see LICENSE.txt
+
+### STREAM BENCHMARK #################################################################################
+# Measures the time between sending a request with Client.send() and receiving the full response,
+# for MBT responses of increasing length (e.g. a 1000-word sentence is a 20KB response).
+# A stand-in MBT server (see standin.py) answers the requests, so no network or model is involved:
+# the time is spent reading the response from the socket (see Client._stream()).
+# Usage:
+# > python benchmarks/stream.py -w 10,100,1000,5000 -r 100
+# -w --words  : comma-separated sentence lengths (in words).
+# -r --repeat : number of requests per sentence length.
+# -p --port   : the port for the stand-in server.
+# -o --output : the JSON file to write the report to.
+
+import os, sys, time
+
+try:
+    import json
+except ImportError:
+    # Python 2.5 has no json module.
+    import simplejson as json
+
+def run(client, words=(10, 100, 1000, 5000), repeat=100):
+    """ Returns a dictionary of sentence length => response size in bytes,
+        and the mean, median and maximum time (in milliseconds) per request.
+    """
+    report = {}
+    for n in words:
+        s = " ".join(["cat"] * n) + " ."
+        b = len(client.send(s))
+        t = []
+        for i in range(repeat):
+            t0 = time.time()
+            client.send(s)
+            t.append((time.time() - t0) * 1000)
+        t.sort()
+        report[n] = {
+              "bytes" : b,
+            "mean_ms" : sum(t) / len(t),
+          "median_ms" : t[len(t) / 2],
+             "max_ms" : t[-1]
+        }
+    return report
+
+def main():
+
+    import optparse
+
+    p = optparse.OptionParser()
+    p.add_option("-w", "--words", dest="words", default="10,100,1000,5000", help="sentence lengths")
+    p.add_option("-r", "--repeat", dest="repeat", type="int", default=100, help="requests per length")
+    p.add_option("-p", "--port", dest="port", type="int", default=6099, help="stand-in server port")
+    p.add_option("-o", "--output", dest="output", action="store", help="JSON report file", metavar="FILE")
+    options, arguments = p.parse_args()
+
+    # Import the parser from the folder above, without starting the servers.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import config
+    config.autostart = False
+    import client, standin
+
+    s = standin.StandIn(config.CHUNK, port=options.port, type=standin.MBT)
+    s.start()
+    try:
+        c = client.Mbt(port=options.port)
+        report = run(c, [int(n) for n in options.words.split(",")], options.repeat)
+        c.disconnect()
+    finally:
+        s.stop()
+    s = json.dumps(report, sort_keys=True, indent=2)
+    if options.output:
+        f = open(options.output, "w"); f.write(s); f.close()
+    else:
+        print s
+
+if __name__ == "__main__":
+    main()
@@ -5,25 +5,39 @@
 # License: GNU General Public License, see LICENSE.txt
 
 ### CACHE ############################################################################################
-# Implements an ordered dictionary with (optionally) hashed keys.
+# Implements an ordered dictionary, and an LRU cache with (optionally) hashed keys.
 # It is used in three ways:
 # - For the MBSP.parse() command, cache the given string and its tagged output for reuse.
 # - For MBSP.prepositions.pp_attachments(), cached the tagged string and its anchor tuples for reuse.
 # - Keep a log of all the lookup instances sent to TiMBL and MBT server, and their response.
+# The persistent cache keeps tagged sentences in a database on disk, across restarts.
 # This way, when we are testing with an example sentence, 
 # we don't need to parse it every time but we can reuse the tagged output from cache (see mbsp.py).
 # The lookup instances are available in server logs for inspection (see clients.Timbl).
 
+import os, sys, time, zlib, threading
+
 try:
     # If Python 2.6+ is used we can import hashlib, otherwise we revert to md5.
     import hashlib; encrypt = hashlib.md5
 except:
     import md5; encrypt = md5.new
 
+try:
+    import sqlite3
+except ImportError:
+    # Python 2.4 has no sqlite3 module (the persistent cache is then not available).
+    sqlite3 = None
+
 #--- ORDERED DICTIONARY ------------------------------------------------------------------------------
 # If we log server requests in a list, it takes more time to retrieve them (using the log as a cache).
 # If we log server requests in a dictionary, we lose the order in which they occured.
 # The ordered dictionary solves this, but it requires more memory overhead (keys are stored twice).
+# The keys are kept in a circular doubly linked list, oldest key first, 
+# so that a key can be added, moved to the end or removed in constant time.
+# Each link is a [previous link, next link, key]-list, the root link has no key.
+
+PREVIOUS, NEXT, KEY = 0, 1, 2
 
 class odict(dict):
     """ A dictionary with ordered keys.
@@ -31,21 +45,59 @@ class odict(dict):
     """
     def __init__(self, d=None, reversed=True):
         dict.__init__(self)
-        self._o = [] # The ordered keys.
-        self._f = reversed and self._insertkey or self._appendkey
+        self._reversed = reversed
+        self._lock = threading.Lock() # Changes to the linked list are not atomic.
+        self._root = root = []
+        self._root[:] = [root, root, None]
+        self._links = {} # Key => link.
         if d != None: self.update(dict(d))
     @property
     def reversed(self):
-        return self._f == self._insertkey
+        return self._reversed
     @classmethod
     def fromkeys(odict, k, v=None, reversed=True):
         d = odict(reversed=reversed)
         for k in k: d.__setitem__(k,v)
         return d
-    def _insertkey(self, k):
-        if k not in self: self._o.insert(0,k) # Sort newest-first with reversed=True.
-    def _appendkey(self, k):
-        if k not in self: self._o.append(k)   # Sort oldest-first with reversed=False.
+    def _link(self, k):
+        # Adds the given key to the end of the list (newest) and returns its link.
+        root = self._root
+        last = root[PREVIOUS]
+        last[NEXT] = root[PREVIOUS] = self._links[k] = link = [last, root, k]
+        return link
+    def _unlink(self, k):
+        # Removes the given key from the list.
+        link = self._links.pop(k)
+        previous, next = link[PREVIOUS], link[NEXT]
+        previous[NEXT] = next
+        next[PREVIOUS] = previous
+    def _touch(self, k):
+        # Moves the given key to the end of the list (newest).
+        link = self._links[k]
+        previous, next = link[PREVIOUS], link[NEXT]
+        previous[NEXT] = next
+        next[PREVIOUS] = previous
+        root = self._root
+        last = root[PREVIOUS]
+        link[PREVIOUS] = last
+        link[NEXT] = root
+        last[NEXT] = root[PREVIOUS] = link
+    def _ordered(self):
+        # Returns the list of keys, oldest-first.
+        a = []
+        root = self._root
+        link = root[NEXT]
+        while link is not root:
+            a.append(link[KEY]); link = link[NEXT]
+        return a
+    def _popitem(self):
+        # Removes the oldest key and returns its (key, value)-tuple.
+        link = self._root[NEXT]
+        if link is self._root:
+            raise KeyError, "dictionary is empty"
+        k = link[KEY]
+        self._unlink(k)
+        return k, dict.pop(self, k)
     def append(self, (k, v)):
         """ Takes a (key, value)-tuple. Sets the given key to the given value.
             If the key exists, pushes the updated item to the head (or tail) of the dict.
@@ -58,38 +110,130 @@ class odict(dict):
         if not k in self: self.__setitem__(k,v)
         return self[k]        
     def __setitem__(self, k, v): 
-        self._f(k); dict.__setitem__(self, k, v)
+        self._lock.acquire()
+        try:
+            if k not in self._links: self._link(k)
+            dict.__setitem__(self, k, v)
+        finally:
+            self._lock.release()
     def __delitem__(self, k):
-        dict.__delitem__(self, k); self._o.remove(k)
+        self._lock.acquire()
+        try:
+            dict.__delitem__(self, k); self._unlink(k)
+        finally:
+            self._lock.release()
     def pop(self, k):
-        self._o.remove(k); return dict.pop(self, k)
+        self._lock.acquire()
+        try:
+            v = dict.pop(self, k); self._unlink(k); return v
+        finally:
+            self._lock.release()
+    def popitem(self):
+        """ Removes the oldest item and returns it as a (key, value)-tuple.
+        """
+        self._lock.acquire()
+        try:
+            return self._popitem()
+        finally:
+            self._lock.release()
     def clear(self):
-        dict.clear(self); self._o=[]
+        self._lock.acquire()
+        try:
+            # Break the reference cycles in the linked list, so it can be freed without the garbage collector.
+            for link in self._links.itervalues(): del link[:]
+            dict.clear(self)
+            self._links.clear()
+            self._root[:] = [self._root, self._root, None]
+        finally:
+            self._lock.release()
     def keys(self): 
-        return self._o
+        self._lock.acquire()
+        try:
+            k = self._ordered()
+        finally:
+            self._lock.release()
+        if self._reversed: 
+            k.reverse() # Sort newest-first with reversed=True.
+        return k
     def values(self):
-        return map(self.get, self._o)
+        return [dict.__getitem__(self, k) for k in self.keys()]
     def items(self): 
-        return zip(self._o, self.values())
+        return [(k, dict.__getitem__(self, k)) for k in self.keys()]
     def __iter__(self):
-        return self._o.__iter__()
-    def copy(self):
-        d = self.__class__(reversed=self.reversed)
-        for k,v in (self.reversed and reversed(self.items()) or self.items()): d[k] = v
+        return iter(self.keys())
+    def _copy(self, d):
+        # Copies the items to the given (empty) odict, keys in the same order.
+        self._lock.acquire()
+        try:
+            for k in self._ordered():
+                d._link(k); dict.__setitem__(d, k, dict.__getitem__(self, k))
+        finally:
+            self._lock.release()
         return d
+    def copy(self):
+        return self._copy(self.__class__(reversed=self.reversed))
     def __repr__(self):
         return "{%s}" % ", ".join(["%s: %s" % (repr(k), repr(v)) for k, v in self.items()])
 
 #--- CACHE -------------------------------------------------------------------------------------------
+# A cache can be limited by the number of entries, and by their estimated memory usage.
+# The memory usage of an entry is estimated with sizeof(), which counts the strings, lists,
+# tuples and dictionaries it contains (e.g. a parsed string, or a sentence table in mbsp.stage_cache).
+
+# Cache links also store the estimated size of the entry and the time it was set.
+SIZE, TIME = 3, 4
+
+# The estimated memory usage (in bytes) of a cache entry besides its key and value:
+# the link, the dictionary slots and the size and time.
+ENTRY = 160
+
+def sizeof(v):
+    """ Returns the estimated memory usage (in bytes) of the given value,
+        including the items of lists, tuples and dictionaries.
+    """
+    if isinstance(v, (list, tuple)):
+        return _getsizeof(v) + sum([sizeof(x) for x in v])
+    if isinstance(v, dict):
+        return _getsizeof(v) + sum([sizeof(x) + sizeof(y) for x, y in v.iteritems()])
+    return _getsizeof(v)
+
+try: 
+    _getsizeof = sys.getsizeof
+except AttributeError:
+    # Python 2.5 has no sys.getsizeof(), estimate the size from the length of the value instead.
+    def _getsizeof(v):
+        if isinstance(v, str):
+            return 40 + len(v)
+        if isinstance(v, unicode):
+            return 56 + len(v) * 4
+        if isinstance(v, (list, tuple, dict)):
+            return 72 + len(v) * (isinstance(v, dict) and 24 or 8)
+        return 32
+
+def _sizeof(k, v):
+    return sizeof(k) + sizeof(v) + ENTRY
 
 class Cache(odict):
 
-    def __init__(self, d=None, size=100, hashed=False, reversed=False): 
+    def __init__(self, d=None, size=100, hashed=False, reversed=False, budget=None, sizeof=_sizeof, ttl=None): 
         """ An ordered dictionary with a size limit and (optionally) hashed keys.
             Hashed keys have the advantage of being relatively small in size.
             They can be used when the original keys are long strings, for example.
+            When the cache is full, the least recently used entry is removed:
+            Cache[k], Cache.get() and setting a key move it to the end.
+            - size   : the maximum number of entries.
+            - budget : the maximum memory usage in bytes (None = no limit),
+                       where sizeof(key, value) returns the estimated size of an entry.
+            - ttl    : the number of seconds after which an entry expires (None = never).
         """
         self.size = size
+        self.budget = budget
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.hits = 0      # Number of get() calls that found the key.
+        self.misses = 0    # Number of get() calls that did not find the key.
+        self.evictions = 0 # Number of entries removed because the cache was full, or expired.
+        self.bytes = 0     # Estimated memory usage of the entries.
         self._hashed = hashed
         odict.__init__(self, d, reversed)
     
@@ -103,16 +247,59 @@ class Cache(odict):
         if isinstance(k, unicode): k = k.encode("utf-8") # MD5 works on Python byte strings.
         return encrypt(k).hexdigest()
 
+    def _unlink(self, k):
+        self.bytes -= self._links[k][SIZE]
+        odict._unlink(self, k)
+
+    def _put(self, k, v):
+        # Sets the given (hashed) key to the given value, 
+        # and removes the least recently used entries while the cache exceeds its size or budget.
+        n = self.sizeof(k, v)
+        if self.budget is not None and n > self.budget:
+            # An entry larger than the budget is not cached (all other entries would be removed for it).
+            if k in self._links:
+                dict.__delitem__(self, k); self._unlink(k)
+            return
+        if k in self._links:
+            self._touch(k)
+            link = self._links[k]
+            self.bytes -= link[SIZE]
+            link[SIZE] = n
+            link[TIME] = time.time()
+        else:
+            self._link(k).extend((n, time.time()))
+        self.bytes += n
+        dict.__setitem__(self, k, v)
+        while dict.__len__(self) > self.size or self.budget is not None and self.bytes > self.budget:
+            self._popitem()
+            self.evictions += 1
+
+    def _expired(self, k):
+        # Returns True if the entry for the given (hashed) key has expired, and removes it.
+        if self.ttl is not None and time.time() - self._links[k][TIME] > self.ttl:
+            dict.__delitem__(self, k); self._unlink(k)
+            self.evictions += 1
+            return True
+        return False
+
     def __setitem__(self, k, v):
-        odict.__setitem__(self, self._hash(k), v)
-        if len(self) > self.size:
-            # If the cache exceeds the maximum size, remove the oldest entry.
-            odict.__delitem__(self, self.keys()[self.reversed and -1 or 0])
+        k = self._hash(k)
+        self._lock.acquire()
+        try:
+            self._put(k, v)
+        finally:
+            self._lock.release()
             
     def __getitem__(self, k):
-        try: return odict.__getitem__(self, self._hash(k))
-        except KeyError:
-            raise KeyError, k
+        h = self._hash(k)
+        self._lock.acquire()
+        try:
+            if h not in self._links or self._expired(h):
+                raise KeyError, k
+            self._touch(h)
+            return dict.__getitem__(self, h)
+        finally:
+            self._lock.release()
 
     def __delitem__(self, k):
         try: odict.__delitem__(self, self._hash(k))
@@ -120,11 +307,65 @@ class Cache(odict):
             raise KeyError, k
 
     def __contains__(self, k):
-        return odict.__contains__(self, self._hash(k))
+        k = self._hash(k)
+        if self.ttl is None:
+            return odict.__contains__(self, k)
+        self._lock.acquire()
+        try:
+            return k in self._links and not self._expired(k)
+        finally:
+            self._lock.release()
+
+    def get(self, k, default=None):
+        """ Returns the value for the given key, or the default value if the key is not in cache.
+            Each call updates the Cache.hits or Cache.misses counter.
+        """
+        k = self._hash(k)
+        self._lock.acquire()
+        try:
+            if k in self._links and not self._expired(k):
+                self.hits += 1
+                self._touch(k)
+                return dict.__getitem__(self, k)
+            self.misses += 1
+            return default
+        finally:
+            self._lock.release()
+
+    def purge(self):
+        """ Removes the expired entries and returns the number of entries removed.
+        """
+        self._lock.acquire()
+        try:
+            return len([k for k in self._ordered() if self._expired(k)])
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        odict.clear(self); self.bytes = 0; self.hits = 0; self.misses = 0; self.evictions = 0
+
+    def stats(self):
+        """ Returns a dictionary with the number of entries, their estimated memory usage in bytes,
+            the memory budget, and the number of hits, misses and evictions.
+        """
+        return {
+              "entries" : len(self),
+                "bytes" : self.bytes,
+               "budget" : self.budget,
+                 "hits" : self.hits,
+               "misses" : self.misses,
+            "evictions" : self.evictions
+        }
         
     def copy(self):
-        d = self.__class__(size=self.size, hashed=self._hashed, reversed=self.reversed)
-        for k,v in (self.reversed and reversed(self.items()) or self.items()): d[k] = v
+        d = self.__class__(size=self.size, hashed=self._hashed, reversed=self.reversed, 
+            budget=self.budget, sizeof=self.sizeof, ttl=self.ttl)
+        self._lock.acquire()
+        try:
+            for k in self._ordered():
+                d._put(k, dict.__getitem__(self, k))
+        finally:
+            self._lock.release()
         return d
 
 #--- LOG ---------------------------------------------------------------------------------------------
@@ -140,3 +381,114 @@ class Log(dict):
     def copy(self):
         return Log([(k,v.copy()) for k,v in self.items()])
 
+#--- PERSISTENT CACHE --------------------------------------------------------------------------------
+# A cache of unicode strings stored in an SQLite database, so that it survives a restart.
+# Each entry has a fingerprint (e.g. of the model files used to parse the string).
+# Entries with another fingerprint than the current one are removed when the database is opened.
+
+def fingerprint(*paths):
+    """ Returns a hash of the name, size and modification time of the files in the given folders.
+        The hash changes when a file is added, removed or modified.
+    """
+    h = encrypt()
+    for path in paths:
+        for root, folders, files in sorted(os.walk(path)):
+            for f in sorted(files):
+                f = os.path.join(root, f)
+                try: 
+                    st = os.stat(f)
+                except OSError:
+                    continue
+                h.update("%s %s %s\n" % (f, st.st_size, int(st.st_mtime)))
+    return h.hexdigest()
+
+class PersistentCache:
+
+    def __init__(self, path, fingerprint=""):
+        """ A dictionary of unicode strings stored in an SQLite database at the given path.
+            Keys are hashed, values are compressed with zlib.
+            Stale entries (with another fingerprint) are removed.
+        """
+        if sqlite3 is None:
+            raise ImportError, "PersistentCache requires the sqlite3 module (Python 2.5+)"
+        self.path = path
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._pid = None
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        # Each process opens its own connection (e.g. with mbsp.parse_parallel()).
+        # The connection is shared between threads (e.g. with config.pipeline).
+        if self._pid != os.getpid():
+            if not os.path.exists(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            db.execute("create table if not exists cache (key text primary key, fingerprint text, value blob)")
+            db.execute("delete from cache where fingerprint != ?", (self.fingerprint,))
+            db.commit()
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    def _hash(self, k):
+        if isinstance(k, unicode): k = k.encode("utf-8")
+        return encrypt(k).hexdigest()
+
+    def get(self, k, default=None):
+        """ Returns the value for the given key, or the default value if the key is not stored.
+        """
+        self._lock.acquire()
+        try:
+            r = self._connect().execute(
+                "select value from cache where key=? and fingerprint=?", (self._hash(k), self.fingerprint)).fetchone()
+        finally:
+            self._lock.release()
+        if r is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return zlib.decompress(str(r[0])).decode("utf-8")
+
+    def __getitem__(self, k):
+        v = self.get(k)
+        if v is None:
+            raise KeyError, k
+        return v
+
+    def __contains__(self, k):
+        return self.get(k) is not None
+
+    def __setitem__(self, k, v):
+        # The value is written to disk with commit().
+        v = sqlite3.Binary(zlib.compress(unicode(v).encode("utf-8")))
+        self._lock.acquire()
+        try:
+            self._connect().execute(
+                "insert or replace into cache values (?, ?, ?)", (self._hash(k), self.fingerprint, v))
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        self._lock.acquire()
+        try:
+            return self._connect().execute("select count(*) from cache").fetchone()[0]
+        finally:
+            self._lock.release()
+
+    def commit(self):
+        self._lock.acquire()
+        try:
+            self._connect().commit()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._connect().execute("delete from cache"); self._db.commit()
+        finally:
+            self._lock.release()
+        self.hits = 0
+        self.misses = 0
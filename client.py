@@ -30,10 +30,13 @@
 # To disconnect:
 # >>> client.disconnect()
 
-import re, socket, threading, time
+import os, sys, re, socket, threading, time, asyncore, Queue
 import config
 import cache
+import metrics
+import profiler
 
+from math   import ceil
 from config import LOCALHOST
 
 # Cache the lookup instances, for evaluation or reuse.
@@ -59,15 +62,20 @@ class ServerConnectionError(ClientError):
     pass
 class ServerBusyError(ClientError):
     pass
+class DeadlineError(ClientTimeoutError):
+    pass
 
 # Possible socket.error codes:
 CONNECTION_RESET_BY_PEER = (54, 'Connection reset by peer')
 CONNECTION_REFUSED = (61, 'Connection refused')
 BROKEN_PIPE = (32, 'Broken pipe')
 
+# Socket option to acknowledge received data at once (Linux only), see Client._readline().
+TCP_QUICKACK = getattr(socket, "TCP_QUICKACK", None)
+
 class Client:
     
-    def __init__(self, host=LOCALHOST, port=6060, name=None, log=False, request=lambda v:v.strip()+'\n', response=lambda v:v):
+    def __init__(self, host=LOCALHOST, port=6060, name=None, log=False, request=lambda v:v.strip()+'\n', response=lambda v:v, timeout=None):
         """ Creates a new client for communicating with a TiMBL/MBT server.
             - host     : the server address, localhost by default.
             - port     : the server tcp communicating port.
@@ -75,6 +83,7 @@ class Client:
             - log      : log requests sent and answers received from the server?
             - request  : a function used to prepare the request sent to the server.
             - response : a function used to format the response sent from the server.
+            - timeout  : the time (in seconds) to wait for the server to accept the connection, or None.
         """
         self.host = host
         self.port = port
@@ -82,25 +91,33 @@ class Client:
         self.log  = log
         self.format_request  = request
         self.format_response = response
-        self.packet_size = 1024
-        self._count = 0
-        self._reset = 100 # Reconnect every few tagging jobs.
+        self.packet_size = 65536 # Large enough for most responses in a single recv().
+        self._count = 0 # Number of requests sent on this connection (see Pool).
         self._socket = None
-        self.connect()
+        self.connect(timeout)
         # Create a log for this client's requests and responses.
         # The log entry will be empty unless Client.log=True.
         if not self.name in _log:
-            _log.create(self.name, size=1000, hashed=False)
+            _log.create(self.name, size=1000, hashed=False, budget=config.cache_bytes.get("client.log"), ttl=config.cache_ttl)
 
-    def connect(self):
+    def connect(self, timeout=None):
         """ Connects to the server at the given host:port.
-            A ServerConnectionError is raised if the server can not be reached.
+            A ServerConnectionError is raised if the server can not be reached,
+            a ClientTimeoutError if it doesn't send its welcome message within the given timeout.
         """
         try:
             self._count  = 0
+            self._buffer = "" # Received data not yet split into responses (see Client.send_many()).
             self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.getprotobyname('tcp'))
+            self._socket.settimeout(timeout)
             self._socket.connect((self.host, self.port))
             self._socket.recv(self.packet_size)
+            self._socket.settimeout(None)
+        except socket.timeout:
+            # A server that accepts connections but doesn't answer (e.g. a hanging process).
+            self.disconnect()
+            s = "couldn't connect to server at %s:%s in %s seconds" % (self.host, self.port, timeout)
+            raise ClientTimeoutError(s)
         except socket.error, code:
             s = "can't connect to server at %s:%s" % (self.host, self.port)
             raise ServerConnectionError(s, code)
@@ -109,36 +126,40 @@ class Client:
         """ Returns the server response.
         """
         # This is the place where MBSP will spend most of its time.
-        # Optimized for speed by using reversed(), and a list instead of += on a string.
+        # The server answers each request with a single line (see Client._readline()).
         # Since this can be called as a background process, it is a good idea to supply
         # a timeout to ensure the function doesn't hang.
-        t = time.time()
-        packets = [self._socket.recv(self.packet_size)]
-        # "I'm done\n" => check "\nenod m'I" to quickly find the \n.
-        while '\n' not in reversed(packets[-1]) or (packets[-1] == "\n" and len(packets) == 1):
-            if timeout is not None and time.time()-t > timeout: 
-                raise ClientTimeoutError
-            time.sleep(0.01)
-            packets.append(self._socket.recv(self.packet_size))
-        return "".join(packets)
-
-    def send(self, request, timeout=None):
+        return self._readline(timeout)
+
+    def _recv(self, timeout=None, t=0):
+        # Without a timeout on the socket, recv() waits forever for a server that doesn't answer.
+        if timeout is not None:
+            self._socket.settimeout(max(0.001, timeout - (time.time() - t)))
+        try:
+            return self._socket.recv(self.packet_size)
+        except socket.timeout:
+            raise ClientTimeoutError
+
+    def send(self, request, timeout=None, cache=True):
         """ Takes a lookup instance of which the tag must be determined.
             - request : a string, formatted with Client.format_request() before sent.
             - timeout : the time (in seconds) before giving up contacting the server, or None.
+            - cache   : with cache=False, the request is always sent to the server (e.g. a health check).
             Returns the server's answer as a string, formatted with Client.format_response().
             Lookup instances and the server's response can be inspected in client.log[client.name].
             Can raise ClientDisconnectedError, ClientTimeoutError or ServerConnectionError.
         """
         if request.strip() == "":
             return self.format_response("")
-        if self.log and request in _log[self.name]:
+        if cache and self.log and request in _log[self.name]:
             # If we have the request in cache we don't need to contact the server.
             return self.format_response(_log[self.name][request])
-        if self._count > self._reset:
-            # Reset the client every few tagging jobs.
-            self.reconnect()
         Q = self.format_request(request)
+        response = cache and _classified(self.name, Q) or None
+        if response is not None:
+            # If we have the request in the classification cache we don't need to contact the server.
+            return self.format_response(response)
+        t = time.time()
         try:
             # Send the request to the server and wait for response.
             self._count += 1
@@ -154,17 +175,143 @@ class Client:
             raise ServerConnectionError(s, code)
         except ClientTimeoutError:
             # Raised when Client._stream() times out.
+            # The response may still arrive later, so the connection can't be used for the next request.
+            self.disconnect()
             s = "couldn't get a response from server at %s:%s in %s seconds" % (self.host, str(self.port), str(timeout))
             raise ClientTimeoutError(s)
         if response == 'try again later...\n':
             # Raised when the number of allowed connections to a multithreaded server is exceeded.
             s = "restart the server at %s:%s" % (self.host, str(self.port))
             raise ServerBusyError
+        if config.metrics:
+            # Record the number of requests, bytes and the response time per server.
+            metrics.observe("server_latency_seconds", time.time() - t, server=self.name)
+            metrics.count("server_requests", 1, server=self.name)
+            metrics.count("server_bytes_sent", len(Q), server=self.name)
+            metrics.count("server_bytes_received", len(response), server=self.name)
         if self.log:
             # Cache the request and the response from the server.
             _log[self.name].append((request, response))
+        if cache:
+            _classify(self.name, Q, response)
         return self.format_response(response)
     tag = send
+
+    def send_many(self, requests, timeout=None, deadline=None, responses=None):
+        """ Sends the given list of requests back-to-back and returns a list of responses in the same order,
+            formatted with Client.format(). 
+            The server answers each request with a single line, in the order in which they were sent,
+            so we don't need to wait for a response before sending the next request.
+            This saves a round trip per request, e.g. for the dozens of relation instances in a sentence.
+            - timeout  : the time (in seconds) to wait for each response, or None.
+            - deadline : the time by which all responses must have arrived, or None.
+            - responses: a list to which the formatted responses are appended,
+                         including those that arrived before an error (see batch_singlethreaded()).
+            Can raise ClientDisconnectedError, ClientTimeoutError or ServerConnectionError.
+        """
+        R = [None] * len(requests)
+        Q = []
+        for i, request in enumerate(requests):
+            if request.strip() == "":
+                R[i] = ""
+            elif self.log and request in _log[self.name]:
+                R[i] = _log[self.name][request]
+            else:
+                q = self.format_request(request)
+                R[i] = _classified(self.name, q)
+                if R[i] is None:
+                    Q.append((i, request, q))
+        try:
+            if Q:
+                t = time.time()
+                w = timeout
+                try:
+                    self._count += len(Q)
+                    self._socket.sendall("".join([q for i, request, q in Q]))
+                    for i, request, q in Q:
+                        w = _timeout(timeout, deadline)
+                        r = self._readline(w)
+                        if r == 'try again later...\n':
+                            # Raised when the number of allowed connections to a multithreaded server is exceeded.
+                            raise ServerBusyError
+                        R[i] = r
+                        if config.metrics:
+                            # The responses arrive one after another: 
+                            # the latency of each is the time since the previous response (or since sending).
+                            metrics.observe("server_latency_seconds", time.time() - t, server=self.name)
+                            t = time.time()
+                            metrics.count("server_requests", 1, server=self.name)
+                            metrics.count("server_bytes_sent", len(q), server=self.name)
+                            metrics.count("server_bytes_received", len(R[i]), server=self.name)
+                        if self.log:
+                            _log[self.name].append((request, R[i]))
+                        _classify(self.name, q, R[i])
+                except AttributeError:
+                    s = "disconnected from server at %s:%s" % (self.host, str(self.port))
+                    raise ClientDisconnectedError(s)
+                except socket.error, code:
+                    # The responses to the remaining requests can't be matched to a request anymore.
+                    self.disconnect()
+                    s = "can't connect to server at %s:%s" % (self.host, str(self.port))
+                    raise ServerConnectionError(s, code)
+                except DeadlineError:
+                    self.disconnect()
+                    raise
+                except ClientTimeoutError:
+                    self.disconnect()
+                    s = "couldn't get a response from server at %s:%s in %s seconds" % (self.host, str(self.port), str(w))
+                    raise ClientTimeoutError(s)
+                except ClientError:
+                    self.disconnect()
+                    raise
+        finally:
+            if responses is not None:
+                # The responses that arrived before an error, up to the first request that wasn't answered.
+                n = 0
+                while n < len(R) and R[n] is not None:
+                    n += 1
+                responses.extend([self.format(r) for r in R[:n]])
+        if responses is not None:
+            return responses[len(responses)-len(R):]
+        return [self.format(r) for r in R]
+
+    def _readline(self, timeout=None):
+        # Returns the next (non-empty) line from the server, 
+        # keeping the data after the line in Client._buffer for the next call.
+        # Reads block until data arrives (or the timeout passes), 
+        # and a long response is joined from a list of packets instead of += on a string.
+        t = time.time()
+        try:
+            while True:
+                i = self._buffer.find("\n")
+                if i < 0:
+                    packets = [self._buffer]
+                    while True:
+                        packet = self._recv(timeout, t)
+                        if packet == "":
+                            # The server has closed the connection.
+                            raise socket.error(*CONNECTION_RESET_BY_PEER)
+                        packets.append(packet)
+                        if TCP_QUICKACK is not None:
+                            # A server that writes each response separately waits for our acknowledgement
+                            # before it sends the next one (Nagle's algorithm), while the operating system
+                            # delays the acknowledgement (up to 40ms) since we have nothing to send back.
+                            self._socket.setsockopt(socket.IPPROTO_TCP, TCP_QUICKACK, 1)
+                        if "\n" in packet:
+                            break
+                    self._buffer = "".join(packets)
+                    i = self._buffer.find("\n")
+                line, self._buffer = self._buffer[:i+1], self._buffer[i+1:]
+                if line.strip() != "":
+                    return line
+        finally:
+            if timeout is not None and self._socket is not None:
+                self._socket.settimeout(None)
+
+    def format(self, response):
+        """ Returns the given server response, formatted as the return value of Client.send().
+        """
+        return self.format_response(response)
             
     def reconnect(self):
         self.disconnect()
@@ -262,34 +409,37 @@ def timbl_format_response(v, verbosity=[]):
 
 class Timbl(Client):
     
-    def __init__(self, host=LOCALHOST, port=6060, name=None, log=False, verbosity=[]):
+    def __init__(self, host=LOCALHOST, port=6060, name=None, log=False, verbosity=[], timeout=None):
         """ A client suited for TiMBL requests.
             The different features in the instance must be separated by whitespace.
         """
-        Client.__init__(self, host, port, name, log)
+        Client.__init__(self, host, port, name, log, timeout=timeout)
         self.verbosity = verbosity
         self.format_request  = timbl_format_request
         self.format_response = lambda v: v
 
-    def send(self, request, timeout=None):
-        return timbl_format_response(Client.send(self, request, timeout), self.verbosity)
+    def send(self, request, timeout=None, cache=True):
+        return timbl_format_response(Client.send(self, request, timeout, cache), self.verbosity)
     tag = send
 
+    def format(self, response):
+        return timbl_format_response(self.format_response(response), self.verbosity)
+
 class TimblPP(Timbl):
     
-    def __init__(self, host=LOCALHOST, port=6060, name=None, log=False, verbosity=[DI,DB]):
+    def __init__(self, host=LOCALHOST, port=6060, name=None, log=False, verbosity=[DI,DB], timeout=None):
         """ A client suited for TiMBL PP-attachment 
             (see mbsp._find_pp_attachments()).
         """
-        Timbl.__init__(self, host, port, name, log, verbosity)
+        Timbl.__init__(self, host, port, name, log, verbosity, timeout)
 
 class Mbt(Client):
     
-    def __init__(self, host=LOCALHOST, port=6060, name=None, log=False):
+    def __init__(self, host=LOCALHOST, port=6060, name=None, log=False, timeout=None):
         """ A client with request and response formatters suited for MBT chunking.
             (see mbsp._chunk()).
         """
-        Client.__init__(self, host, port, name, log)
+        Client.__init__(self, host, port, name, log, timeout=timeout)
         self.format_request  = lambda v: v.strip()+'\n'
         self.format_response = lambda v: v[:-len("<utt>")-1].strip().replace("//","/")
 
@@ -341,6 +491,608 @@ class AsynchronousRequest:
 def asynchronous(function, *args, **kwargs):
     return AsynchronousRequest(function, *args, **kwargs)
 
+#--- DEADLINE ---------------------------------------------------------------------------------------
+# A deadline is the time (see time.time()) by which all requests in a batch must be answered.
+# It can be passed to batch(), or set for all batches in the current thread with set_deadline()
+# (mbsp.parse() does this for each parser stage, see mbsp._budget()).
+
+_local = threading.local()
+
+def set_deadline(t=None):
+    _local.deadline = t
+
+def get_deadline():
+    return getattr(_local, "deadline", None)
+
+def _timeout(timeout=None, deadline=None):
+    """ Returns the timeout for the next request: the given timeout,
+        or the time left until the deadline if that is shorter.
+        Raises a DeadlineError if the deadline has passed.
+    """
+    if deadline is None:
+        return timeout
+    t = deadline - time.time()
+    if t <= 0:
+        raise DeadlineError, "deadline exceeded"
+    return timeout is None and t or min(timeout, t)
+
+#--- CLASSIFICATION CACHE ----------------------------------------------------------------------------
+# The responses of each server are kept in a classification cache (unlike the log, also with config.log=False).
+# Lookup instances follow a Zipf distribution: a small number of instances (e.g. the/DT for the lemmatizer)
+# make up most of the requests, so most of them are answered without contacting the server.
+# The cache is keyed by the request as it is sent to the server (see Client.format_request()),
+# so requests that only differ in formatting (e.g. a trailing newline) share an entry.
+# The size of each cache is bounded by config.classification_cache (in bytes, per server).
+# Example usage:
+# >>> c = classifications("relation")
+# >>> print c.hits, c.misses, c.evictions, c.bytes
+# >>> c.save("relation.txt") # Reload with c.load() or config.classification_files.
+
+# The estimated memory (in bytes) of a cache entry besides the characters of the request and response:
+# two string objects and the cache link (see cache.ENTRY).
+CLASSIFICATION_OVERHEAD = 2 * 40 + cache.ENTRY
+
+def _classification_sizeof(k, v):
+    return len(k) + len(v) + CLASSIFICATION_OVERHEAD
+
+class Classifications(cache.Cache):
+
+    def __init__(self, name, budget=0):
+        """ A cache of server responses by request, with a memory budget in bytes.
+            When the budget is exceeded, the least recently used responses are removed.
+            Cache.hits and Cache.misses count the lookups with Classifications.get(),
+            Cache.evictions counts the responses removed to stay within the budget.
+        """
+        cache.Cache.__init__(self, size=sys.maxint, budget=budget, sizeof=_classification_sizeof)
+        self.name = name
+
+    def load(self, path):
+        """ Adds the responses in the file at the given path, with a request and its response on each line,
+            separated by a tab (the last tab on the line: lemmatizer requests contain a tab).
+            Returns the number of responses added.
+        """
+        n = 0
+        f = open(path)
+        for line in f:
+            line = line.rstrip("\r\n")
+            if "\t" in line:
+                k, v = line.rsplit("\t", 1)
+                self[k+"\n"] = v+"\n"
+                n += 1
+        f.close()
+        return n
+
+    def save(self, path):
+        """ Writes the cached responses to the file at the given path (see Classifications.load()).
+        """
+        f = open(path + ".tmp", "w")
+        for k, v in self.items():
+            f.write("%s\t%s\n" % (k.rstrip("\n"), v.rstrip("\n")))
+        f.close()
+        os.rename(path + ".tmp", path)
+
+    def __repr__(self):
+        return "Classifications(name=%s, entries=%s, bytes=%s, budget=%s)" % (
+            repr(self.name), len(self), self.bytes, self.budget)
+
+class ClassificationCaches(dict):
+
+    def clear(self):
+        for c in self.values():
+            c.clear()
+        dict.clear(self)
+
+classification_caches = ClassificationCaches()
+_classifications_lock = threading.Lock()
+
+def classifications(name):
+    """ Returns the Classifications for the server with the given name,
+        or None if the server is not in config.classification_cache.
+    """
+    c = classification_caches.get(name)
+    if c is None and config.classification_cache.get(name):
+        _classifications_lock.acquire()
+        try:
+            c = classification_caches.get(name)
+            if c is None:
+                c = Classifications(name, config.classification_cache[name])
+                if config.classification_files.get(name):
+                    c.load(config.classification_files[name])
+                classification_caches[name] = c
+        finally:
+            _classifications_lock.release()
+    return c
+
+def _classified(name, k):
+    # Returns the cached response for the given server name and formatted request, or None.
+    C = classifications(name)
+    v = C is not None and C.get(k) or None
+    if config.metrics and C is not None:
+        metrics.count(v is not None and "classification_hits" or "classification_misses", 1, server=name)
+    return v
+
+def _classify(name, k, v):
+    # Caches the response for the given server name and formatted request.
+    C = classifications(name)
+    if C is not None:
+        n = C.evictions
+        C[k] = v
+        if config.metrics and C.evictions > n:
+            metrics.count("classification_evictions", C.evictions - n, server=name)
+
+#--- CONNECTION POOL ---------------------------------------------------------------------------------
+# Each server has a pool of open connections (Client objects) that are reused between batches.
+# A thread takes a connection from the pool with Pool.checkout() and returns it with Pool.checkin(),
+# so that batch_multithreaded() doesn't need to open a new connection for each request.
+# Connections that have been idle for more than config.pool_idle seconds are pinged before reuse,
+# and connections that are broken (e.g. the server was restarted) are replaced by a new one.
+# Example usage:
+# >>> p = pool(define(Mbt, port=6061, name="chunk"))
+# >>> c = p.checkout()
+# >>> print c.send("Good morning")
+# >>> p.checkin(c)
+
+POOL_PING = "x ?"
+
+class Pool:
+
+    def __init__(self, Client, host=LOCALHOST, port=6060, name=None, log=False, min=None, max=None):
+        """ A thread-safe pool of connections to the server at the given host:port.
+            - min : the number of idle connections kept open (config.pool_min by default).
+            - max : the number of connections open at the same time (config.pool_max by default).
+            Pool.checkout() waits for a connection to be checked in when max connections are in use.
+        """
+        self.Client = Client
+        self.host   = host
+        self.port   = port
+        self.name   = name
+        self.log    = log
+        self.min    = min
+        self.max    = max
+        if min is None:
+            self.min = config.pool_min
+        if max is None:
+            self.max = config.pool_max
+        self.idle   = [] # List of (Client, time of last use)-tuples.
+        self.busy   = 0
+        self._lock  = threading.Condition(threading.Lock())
+
+    def checkout(self, timeout=None, wait=True, deadline=None):
+        """ Returns a connected Client from the pool, or a new Client if there are no idle connections.
+            Raises a ServerConnectionError if the server can not be reached,
+            or a ClientTimeoutError if no connection is checked in within the given timeout.
+            With wait=False, returns None at once if max connections are in use.
+            With a deadline (see time.time()), waiting for a connection, checking it and connecting
+            take at most the time that is left, after which a DeadlineError is raised.
+        """
+        t = time.time()
+        self._lock.acquire()
+        try:
+            while not self.idle and self.busy >= self.max:
+                if not wait:
+                    return None
+                if timeout is not None and time.time() - t >= timeout:
+                    raise ClientTimeoutError, "no free connection to server '%s' in %s seconds" % (self.name, timeout)
+                self._lock.wait(_timeout(timeout is not None and max(0.001, timeout - (time.time() - t)) or None, deadline))
+            self.busy += 1
+            c, used = self.idle and self.idle.pop() or (None, None)
+        finally:
+            self._lock.release()
+        # Validating or opening a connection takes time, so it is done outside the lock.
+        try:
+            try:
+                if c is not None and not self._valid(c, used, _timeout(None, deadline)):
+                    c.disconnect()
+                    c = None
+                if c is None:
+                    c = self.Client(self.host, self.port, self.name, self.log, timeout=_timeout(None, deadline))
+            except ClientTimeoutError:
+                # Raise a DeadlineError if the connection timed out because the deadline has passed.
+                _timeout(None, deadline)
+                raise
+        except:
+            self._release()
+            raise
+        return c
+
+    def checkin(self, client):
+        """ Returns the given Client to the pool.
+            Clients that were disconnected (e.g. after a ClientTimeoutError) are dropped.
+        """
+        if client is None:
+            return
+        if not client.connected:
+            self.discard(client); return
+        self._lock.acquire()
+        try:
+            self.busy -= 1
+            self.idle.append((client, time.time()))
+            # Close the connections that have been idle longest, beyond the minimum.
+            # A burst of requests can open up to Pool.max connections, but we don't keep them all.
+            while len(self.idle) > self.min and time.time() - self.idle[0][1] > config.pool_idle:
+                self.idle.pop(0)[0].disconnect()
+            self._lock.notify()
+        finally:
+            self._lock.release()
+
+    def discard(self, client):
+        """ Closes the given (broken) Client that was checked out, instead of returning it to the pool.
+        """
+        if client is None:
+            return
+        client.disconnect()
+        self._release()
+
+    def _release(self):
+        self._lock.acquire()
+        try:
+            self.busy -= 1
+            self._lock.notify()
+        finally:
+            self._lock.release()
+
+    def _valid(self, client, used, timeout=None):
+        # An open connection can still be broken, e.g. when the server was restarted in the meantime.
+        # Connections that have been used recently are trusted,
+        # others are checked with a lightweight request to which any answer will do,
+        # within config.pool_timeout or the given timeout (i.e. the time left until a deadline).
+        if not client.connected:
+            return False
+        if config.pool_recycle and client._count >= config.pool_recycle:
+            return False
+        if time.time() - used < config.pool_idle:
+            return True
+        try:
+            client._socket.send(client.format_request(POOL_PING))
+            client._stream(timeout is None and config.pool_timeout or min(timeout, config.pool_timeout))
+            return True
+        except (socket.error, ClientError):
+            return False
+
+    def clear(self):
+        """ Closes the idle connections.
+            Connections that are checked out are closed when they are checked in.
+        """
+        self._lock.acquire()
+        try:
+            for c, used in self.idle:
+                c.disconnect()
+            self.idle = []
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self.idle) + self.busy
+
+    def stats(self):
+        """ Returns a dictionary with the number of open connections (idle and busy),
+            and the number of bytes read ahead in the idle connections (see Client._readline()).
+        """
+        self._lock.acquire()
+        try:
+            return {
+                "entries" : len(self.idle) + self.busy,
+                   "idle" : len(self.idle),
+                   "busy" : self.busy,
+                  "bytes" : sum([len(c._buffer) for c, used in self.idle])
+            }
+        finally:
+            self._lock.release()
+
+    def __repr__(self):
+        return "<Pool name='%s', idle=%s, busy=%s>" % (self.name, len(self.idle), self.busy)
+
+class Pools(dict):
+    # (server name, host, port) => Pool.
+    def clear(self):
+        for p in self.values():
+            p.clear()
+        dict.clear(self)
+
+pools = Pools()
+_pools_lock = threading.Lock()
+
+def pool(client):
+    """ Returns the Pool for the given (Client, host, port, name, log)-tuple (see define()).
+        Each host:port has its own pool, so that the replicas of a server (see config.ports) don't share connections.
+    """
+    Client, host, port, name, log = client
+    p = pools.get((name, host, port))
+    if p is None or (p.Client, p.log) != (Client, log):
+        _pools_lock.acquire()
+        try:
+            p = pools.get((name, host, port))
+            if p is None or (p.Client, p.log) != (Client, log):
+                if p is not None:
+                    p.clear()
+                p = pools[(name, host, port)] = Pool(Client, host, port, name, log)
+        finally:
+            _pools_lock.release()
+    return p
+
+#--- THREAD POOL -------------------------------------------------------------------------------------
+# With config.threading=True, the requests in a batch are sent by a pool of worker threads per server,
+# which are started once and then wait for work (see batch_multithreaded()).
+# The requests are divided into tasks that are put in a shared queue.
+# Each worker takes a connection from the connection pool, sends the requests of the next task,
+# and writes the responses into the output list at the position of the task.
+# When the queue is empty, the worker returns its connection to the connection pool.
+# The number of workers per server is set in config.threads and config.server_threads.
+
+class _Batch:
+
+    def __init__(self, values, tasks):
+        """ Keeps track of the tasks of a batch handed to an Executor.
+            The workers write the responses into the given list of values.
+        """
+        self.values  = values
+        self.pending = tasks
+        self.failed  = [] # List of (task, error)-tuples.
+        self.error   = None # An error that can't be fixed by sending the requests again.
+        self.done    = threading.Event()
+        self._lock   = threading.Lock()
+
+    def answered(self, task):
+        """ Returns the number of requests in the given task that have a response.
+        """
+        send, batch, i, instances, timeout, deadline = task
+        n = 0
+        while n < len(instances) and self.values[i+n] is not None:
+            n += 1
+        return n
+
+    def finish(self, task, error=None):
+        self._lock.acquire()
+        try:
+            if error is not None:
+                self.failed.append((task, error))
+                if not isinstance(error, (ClientDisconnectedError, ServerConnectionError)):
+                    self.error = self.error or error
+            self.pending -= 1
+            if self.pending == 0:
+                self.done.set()
+        finally:
+            self._lock.release()
+
+class Executor:
+
+    def __init__(self, client, threads=None):
+        """ A pool of worker threads that send requests to the server of the given client tuple (see define()).
+            The number of threads is config.server_threads[name], or config.threads.
+        """
+        Client, host, port, name, log = client
+        self.client  = client
+        self.pool    = pool(client)
+        self.threads = threads
+        if threads is None:
+            self.threads = config.server_threads.get(name, config.threads)
+        # A worker that can't get a connection has nothing to do.
+        self.threads = max(1, min(self.threads, self.pool.max))
+        self.queue   = Queue.Queue()
+        self.workers = []
+        self._lock   = threading.Lock()
+
+    def start(self):
+        """ Starts the worker threads (this happens automatically with Executor.map()).
+        """
+        self._lock.acquire()
+        try:
+            while len(self.workers) < self.threads:
+                t = threading.Thread(target=self._work)
+                t.setDaemon(True)
+                t.start()
+                self.workers.append(t)
+        finally:
+            self._lock.release()
+
+    def stop(self):
+        """ Stops the worker threads once the queue is empty.
+        """
+        self._lock.acquire()
+        try:
+            for t in self.workers:
+                self.queue.put(None)
+            self.workers = []
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        c = None
+        while True:
+            task = self.queue.get()
+            if task is None:
+                self.pool.checkin(c); return
+            send, batch, i, instances, timeout, deadline = task
+            if batch.error is not None:
+                # Another task in the batch has failed, the batch will raise its error.
+                batch.finish(task); continue
+            v = []
+            try:
+                if c is None:
+                    c = self.pool.checkout(deadline=deadline)
+                send(c, instances, timeout, deadline, v)
+                error = None
+            except Exception, error:
+                self.pool.discard(c)
+                c = None
+            # After an error, the responses that have arrived are kept (see _Batch.answered()).
+            batch.values[i:i+len(v)] = v
+            if c is not None and self.queue.empty():
+                # Between batches, the connection goes back to the pool (where it is kept open).
+                self.pool.checkin(c)
+                c = None
+            batch.finish(task, error)
+
+    def map(self, instances, timeout=None, retries=1, deadline=None):
+        """ Returns the list of responses to the given requests.
+            Requests that fail with a ServerConnectionError (or ClientDisconnectedError)
+            are sent again, up to the given number of retries.
+            The responses to a failed task that arrived before the error are kept.
+        """
+        Client, host, port, name, log = self.client
+        self.start()
+        # The requests are divided over the workers, at most config.batch_window requests per task,
+        # so that the workers that are done early can take over more tasks.
+        n = len(instances)
+        k = max(1, min(config.batch_window, int(ceil(float(n) / self.threads))))
+        tasks = [(i, instances[i:i+k]) for i in range(0, n, k)]
+        send = _send
+        if profiler.profiling():
+            send = profiler.wrap("send", send)
+        v = [None] * n
+        failures = [0] * n # Number of failed attempts for each request (see batch_singlethreaded()).
+        grace = True
+        while tasks:
+            batch = _Batch(v, len(tasks))
+            for i, x in tasks:
+                self.queue.put((send, batch, i, x, timeout, deadline))
+            batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+            if not batch.failed:
+                break
+            if config.metrics:
+                metrics.count("batch_retries", len(batch.failed), server=name)
+            # Only the requests in the failed tasks that were not answered are sent again.
+            tasks = []
+            for task, e in batch.failed:
+                i, x = task[2], task[3]
+                m = batch.answered(task)
+                if m < len(x):
+                    tasks.append((i+m, x[m:]))
+            if grace and [e for task, e in batch.failed 
+                    if e.code is None or e.code[0] == CONNECTION_RESET_BY_PEER[0]]:
+                # See batch_singlethreaded().
+                grace = False
+                continue
+            for i, x in tasks:
+                if not _retry(failures, i, len(x), retries):
+                    s = "can't connect to server '%s' at %s:%s" % (name, host, port)
+                    raise ServerConnectionError(s)
+        return v
+
+    def __repr__(self):
+        return "<Executor name='%s', threads=%s>" % (self.client[3], self.threads)
+
+class Executors(dict):
+    # (server name, host, port) => Executor.
+    def clear(self):
+        for e in self.values():
+            e.stop()
+        dict.clear(self)
+
+executors = Executors()
+_executors_lock = threading.Lock()
+
+def executor(client):
+    """ Returns the Executor for the given (Client, host, port, name, log)-tuple (see define()).
+    """
+    Client, host, port, name, log = client
+    e = executors.get((name, host, port))
+    if e is None or e.client != client or e.pool is not pool(client):
+        _executors_lock.acquire()
+        try:
+            e = executors.get((name, host, port))
+            if e is None or e.client != client or e.pool is not pool(client):
+                if e is not None:
+                    e.stop()
+                e = executors[(name, host, port)] = Executor(client)
+        finally:
+            _executors_lock.release()
+    return e
+
+#--- REPLICAS ----------------------------------------------------------------------------------------
+# A server can be backed by several replicas, e.g. two MBT chunk servers at ports 6061 and 6065,
+# by using a list of ports (or hosts) in config.ports (or config.hosts).
+# The requests in a batch are then spread over the replicas (see batch_balanced()).
+# Each part of the batch is sent to the replica with the fewest outstanding requests,
+# so that a replica that is slow (or busy with requests from another thread) gets less work.
+# A replica that can't be reached is skipped for config.replica_retry seconds,
+# and its part of the batch is sent to the other replicas.
+
+def endpoints(host, port):
+    """ Returns a list of (host, port)-tuples for the given host and port, 
+        each of which can be a list of replicas (e.g. endpoints("localhost", [6061, 6065])).
+    """
+    H = isinstance(host, (list, tuple)) and list(host) or [host]
+    P = isinstance(port, (list, tuple)) and list(port) or [port]
+    if len(H) == 1:
+        H = H * len(P)
+    if len(P) == 1:
+        P = P * len(H)
+    if len(H) != len(P):
+        raise ValueError, "%s hosts for %s ports" % (len(H), len(P))
+    return zip(H, P)
+
+class Replicas:
+
+    def __init__(self, endpoints):
+        """ Keeps track of the number of outstanding requests to each (host, port)-tuple in the given list,
+            and of the replicas that are down.
+        """
+        self.endpoints   = list(endpoints)
+        self.outstanding = dict([(e, 0) for e in self.endpoints])
+        self.down        = {} # (host, port) => time of failure.
+        self._lock       = threading.Lock()
+
+    def available(self, exclude=[]):
+        """ Returns the list of replicas that are not down and not in the given list.
+        """
+        t = time.time() - config.replica_retry
+        return [e for e in self.endpoints if e not in exclude and self.down.get(e, 0) < t]
+
+    def acquire(self, n=1, exclude=[]):
+        """ Returns the available replica with the fewest outstanding requests, and adds n requests to it.
+            If all replicas are down, the one that failed longest ago is tried again.
+            Returns None if all replicas are in the given exclude list.
+        """
+        self._lock.acquire()
+        try:
+            E = self.available(exclude)
+            if not E:
+                E = [e for e in self.endpoints if e not in exclude]
+                E = E and [min(E, key=lambda e: self.down.get(e, 0))]
+            if not E:
+                return None
+            e = min(E, key=lambda e: self.outstanding[e])
+            self.outstanding[e] += n
+            return e
+        finally:
+            self._lock.release()
+
+    def release(self, e, n=1, error=None):
+        """ Subtracts n outstanding requests from the given replica.
+            With a ServerConnectionError, the replica is marked as down.
+        """
+        self._lock.acquire()
+        try:
+            self.outstanding[e] -= n
+            if isinstance(error, ServerConnectionError):
+                self.down[e] = time.time()
+            elif error is None:
+                self.down.pop(e, None)
+        finally:
+            self._lock.release()
+
+    def __repr__(self):
+        return "<Replicas %s>" % ", ".join(["%s:%s (%s)" % (h, p, self.outstanding[(h, p)]) for h, p in self.endpoints])
+
+_replicas = {}
+_replicas_lock = threading.Lock()
+
+def replicas(name, host, port):
+    """ Returns the Replicas for the server with the given name, host(s) and port(s).
+    """
+    k = (name, tuple(endpoints(host, port)))
+    if k not in _replicas:
+        _replicas_lock.acquire()
+        try:
+            if k not in _replicas:
+                _replicas[k] = Replicas(k[1])
+        finally:
+            _replicas_lock.release()
+    return _replicas[k]
+
 #--- BATCH ------------------------------------------------------------------------------------------
 
 def define(client, host=LOCALHOST, port=6060, name=None, log=False):
@@ -348,78 +1100,363 @@ def define(client, host=LOCALHOST, port=6060, name=None, log=False):
     """
     return (client, host, port, name, log)
 
-def batch(instances, client, timeout=None, retries=1):
+def batch(instances, client, timeout=None, retries=1, deadline=None):
     """ Sends a batch of requests to a server while keeping the creation of clients to a minimum.
         Multithreading can be used by enabling it in config.py (TimblServer 1.0.0+ is recommended).
         - instances : a list of requests, each will be sent with Client.send().
         - client    : a (Client, host, port, name, log)-tuple for when a client object needs to be created.
         - timeout   : the amount of time per request before giving up.
         - retries   : the number of retries after a ServerConnectionError before giving up.
+        - deadline  : the time by which all requests must be answered (by default, see set_deadline()).
+        Raises a ClientTimeoutError (or DeadlineError) when a request or the batch takes too long.
     """
+    if deadline is None:
+        deadline = get_deadline()
+    if prefetched() is not None:
+        # Inside an asynchronous parse, the responses are fetched with batch_async().
+        return _prefetched(instances, client, prefetched())
+    # The same instance often occurs more than once in a batch (e.g. relation instances for common phrases).
+    # Each unique instance is sent once, and the response is copied to each position.
+    unique, positions = _unique(instances)
+    if config.metrics:
+        metrics.count("batch_instances", len(instances), server=client[3])
+        metrics.count("batch_duplicates", len(instances) - len(unique), server=client[3])
+    if profiler.profiling():
+        # Inside a profiled parser stage, the batch is sampled separately (e.g. "chunk;...;batch:chunk").
+        v = profiler.call("batch:%s" % client[3], _batch, unique, client, timeout, retries, deadline)
+    else:
+        v = _batch(unique, client, timeout, retries, deadline)
+    if len(unique) == len(instances):
+        return v
+    return [v[i] for i in positions]
+
+def _unique(instances):
+    """ Returns a list of the unique instances (in the order in which they first occur),
+        and a list with the position in this list for each of the given instances.
+    """
+    index, unique, positions = {}, [], []
+    for x in instances:
+        i = index.get(x)
+        if i is None:
+            i = index[x] = len(unique)
+            unique.append(x)
+        positions.append(i)
+    return unique, positions
+
+def _batch(instances, client, timeout=None, retries=1, deadline=None):
+    Client, host, port, name, log = client
+    E = endpoints(host, port)
+    if len(E) > 1:
+        return batch_balanced(instances, client, timeout, retries, deadline)
+    client = (Client, E[0][0], E[0][1], name, log)
     if config.threading and len(instances) > 1:
-        return batch_multithreaded(instances, client, timeout, retries)
+        return batch_multithreaded(instances, client, timeout, retries, deadline)
     else:
-        return batch_singlethreaded(instances, client, timeout, retries)
+        return batch_singlethreaded(instances, client, timeout, retries, deadline)
 
-_clients = {}
-def batch_singlethreaded(instances, client, timeout=None, retries=1):
+def _send(client, instances, timeout=None, deadline=None, responses=None):
+    # Sends the requests on the given connection, config.batch_window at a time (see Client.send_many()).
+    # The responses are appended to the given list as they arrive,
+    # so that after an error the list has the responses to the requests that were answered.
+    v = responses
+    if v is None:
+        v = []
+    n = config.batch_window
+    if n <= 1:
+        for x in instances:
+            v.append(client.send(x, _timeout(timeout, deadline)))
+        return v
+    for i in range(0, len(instances), n):
+        client.send_many(instances[i:i+n], timeout, deadline, v)
+    return v
+
+def _retry(failures, i, n, retries):
+    # Counts a failed attempt for the given n requests from index i (the requests that were not answered),
+    # and returns True if the first of them can be sent again.
+    for j in range(i, i+n):
+        failures[j] += 1
+    return failures[i] <= retries
+
+def batch_singlethreaded(instances, client, timeout=None, retries=1, deadline=None):
+    # After a connection error, the responses that have arrived are kept,
+    # and only the requests that were not answered are sent again (on a new connection).
+    # Each request can be sent again the given number of retries.
     Client, host, port, name, log = client
+    v = []
+    failures = [0] * len(instances) # Number of failed attempts for each request.
     grace = True
-    i = 0
-    while i < 1 + retries:
+    while len(v) < len(instances):
+        p, c = pool(client), None
         try:
-            global _clients
-            if not _clients.get(name, None):
-                _clients[name] = Client(host, port, name, log)
-            return [_clients[name].send(x, timeout) for x in instances]
-        except ClientDisconnectedError, e:
-                _clients[name] = None
-        except ServerConnectionError, e:
-            if _clients.get(name, None):
-                _clients[name].disconnect()
-                _clients[name] = None
-            if e.code[0] == CONNECTION_RESET_BY_PEER[0] and grace: 
+            c = p.checkout(deadline=deadline)
+            _send(c, instances[len(v):], timeout, deadline, v)
+            p.checkin(c)
+        except (ClientDisconnectedError, ServerConnectionError), e:
+            p.discard(c)
+            if config.metrics:
+                metrics.count("batch_retries", 1, server=name)
+            if (e.code is None or e.code[0] == CONNECTION_RESET_BY_PEER[0]) and grace: 
                 # If the servers have stopped (or restarted), 
-                # any clients in the cache become invalid (e.g. outdated) and raise a CONNECTION_RESET_BY_PEER.
+                # any clients in the pool become invalid (e.g. outdated) and raise a CONNECTION_RESET_BY_PEER.
                 # Refreshing these doesn't really count as an error, so we get an extra try afterwards.
-                i -= 1; grace = False
-            i += 1
-    # Server is down, raise the ServerConnectionError.
-    s = "can't connect to server '%s' at %s:%s" % (name, host, port)
-    raise ServerConnectionError(s)
+                grace = False
+                continue
+            # The requests that were on their way when the connection failed (one window) count a failure.
+            if not _retry(failures, len(v), min(max(1, config.batch_window), len(instances) - len(v)), retries):
+                # Server is down, raise the ServerConnectionError.
+                s = "can't connect to server '%s' at %s:%s" % (name, host, port)
+                raise ServerConnectionError(s)
+        except:
+            p.discard(c)
+            raise
+    return v
+
+def batch_multithreaded(instances, client, timeout=None, retries=1, deadline=None):
+    # The requests are sent by the worker threads of the server (see Executor).
+    return executor(client).map(instances, timeout, retries, deadline)
 
-def batch_multithreaded(instances, client, timeout=None, retries=1):
+def batch_balanced(instances, client, timeout=None, retries=1, deadline=None):
+    # The requests are divided into parts of config.batch_window requests,
+    # each of which is assigned to the replica with the fewest outstanding requests (see Replicas).
+    # The requests for each replica are sent at the same time, from a separate thread.
+    # The requests for a replica that fails with a ServerConnectionError are sent to the other replicas.
     Client, host, port, name, log = client
-    grace = True
-    i, n, v = 0, 10, []
-    while i < len(instances) / float(n):
-        # Create a queue of 10 asynchronous Client.send() calls, started simultaneously.
-        # Wait until all of them have finished. Append the return values to the v list.
-        clients, jobs = [], []
-        for x in instances[i*n:i*n+n]:
-            clients.append(Client(host, port, name, log))
-            jobs.append(asynchronous(clients[-1].send, x, timeout))
-            time.sleep(0.01)
-        done = False
-        while not done:
-            done  = len([job for job in jobs if not job.done]) == 0
-            error = ([job.error for job in jobs if job.error] or [None])[0]
-            if error:
-                done = True
-                if isinstance(error, ServerConnectionError) and \
-                   error.code[0] == CONNECTION_RESET_BY_PEER[0] and grace:
-                    # See batch_singlethreaded() above.
-                    i -= 1; grace = False; error = None; jobs = None
-            time.sleep(0.01)
-        for client in clients:
-            client.disconnect()
-        if error:
+    R = replicas(name, host, port)
+    k = max(1, config.batch_window)
+    parts = [(i, instances[i:i+k]) for i in range(0, len(instances), k)]
+    v = [None] * len(instances)
+    failed = []
+    while parts:
+        shares = {}
+        for i, x in parts:
+            e = R.acquire(len(x), exclude=failed)
+            if e is None:
+                s = "can't connect to server '%s' at %s" % (name, ", ".join(["%s:%s" % e for e in failed]))
+                raise ServerConnectionError(s)
+            shares.setdefault(e, []).append((i, x))
+        send = _batch
+        if profiler.profiling():
+            send = profiler.wrap("replica", send)
+        jobs = []
+        for e, share in shares.items():
+            x = [y for i, part in share for y in part]
+            jobs.append((e, share, asynchronous(send, x, (Client, e[0], e[1], name, log), timeout, retries, deadline)))
+        parts, error = [], None
+        for e, share, job in jobs:
+            job.now()
+            R.release(e, sum([len(part) for i, part in share]), job.error)
+            if isinstance(job.error, ServerConnectionError):
+                failed.append(e)
+                parts.extend(share)
+            elif job.error is not None:
+                error = error or job.error
+            else:
+                j = 0
+                for i, part in share:
+                    v[i:i+len(part)] = job.value[j:j+len(part)]
+                    j += len(part)
+        if error is not None:
             raise error
-        if jobs is not None:
-            v.extend([job.value for job in jobs])
-        i += 1
     return v
 
+#--- ASYNCHRONOUS CLIENT ----------------------------------------------------------------------------
+# Non-blocking clients that are driven by asyncore.loop(), so that many requests can be waiting
+# for a response at the same time without a thread for each of them.
+# Requests are written back-to-back on a few persistent connections per server (config.async_connections),
+# and the server answers them in the same order.
+
+class Pending(Exception):
+    def __init__(self, client, instances):
+        # Raised by batch() inside an asynchronous parse (see mbsp.parse_async()),
+        # with the requests that have not been answered yet.
+        Exception.__init__(self, "%s requests pending" % len(instances))
+        self.client    = client
+        self.instances = instances
+
+def prefetch(answers=None):
+    """ Sets a dictionary of server name => dictionary of request => response for the current thread.
+        batch() then answers requests from the dictionary, and raises Pending for the requests that are missing.
+    """
+    _local.prefetched = answers
+
+def prefetched():
+    return getattr(_local, "prefetched", None)
+
+def _prefetched(instances, client, answers):
+    a = answers.get(client[3], {})
+    m = [] # Missing instances, in order.
+    seen = set()
+    for x in instances:
+        if x not in a and x not in seen:
+            seen.add(x)
+            m.append(x)
+    if m:
+        raise Pending(client, m)
+    return [a[x] for x in instances]
+
+def _formatter(Client):
+    # Returns a subclass of the given Client class that doesn't connect to the server.
+    # AsyncClient uses it for the request and response formatters of the given class.
+    class Formatter(Client):
+        def connect(self, timeout=None):
+            pass
+    return Formatter
+
+class AsyncClient(asyncore.dispatcher):
+
+    def __init__(self, Client=Client, host=LOCALHOST, port=6060, name=None, log=False):
+        """ A non-blocking client for a TiMBL/MBT server, driven by asyncore.loop().
+            Requests and responses have the same format as for the given Client class (e.g. Mbt).
+        """
+        asyncore.dispatcher.__init__(self)
+        self.formatter = _formatter(Client)(host, port, name, log)
+        self.host    = host
+        self.port    = port
+        self.name    = self.formatter.name
+        self.waiting = [] # (request, callback, time, timeout, cache)-tuple for each request sent.
+        self.closed  = False
+        self.error   = None
+        self._out    = [] # Formatted requests not yet written.
+        self._in     = "" # Received data not yet split into lines.
+        self._banner = True
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.connect((host, port))
+        except socket.error, code:
+            self._fail(ServerConnectionError("can't connect to server at %s:%s" % (host, port), code))
+
+    def request(self, request, callback, timeout=None, cache=True):
+        """ Sends the given request to the server.
+            Once the response has arrived (see asyncore.loop()), callback(response, None) is called,
+            with the response formatted as for Client.send(), or callback(None, error) with a ClientError.
+            With cache=False, the request is always sent to the server (e.g. a health check).
+        """
+        if request.strip() == "":
+            callback(self.formatter.format(""), None); return
+        if cache and self.formatter.log and request in _log[self.name]:
+            callback(self.formatter.format(_log[self.name][request]), None); return
+        q = self.formatter.format_request(request)
+        v = cache and _classified(self.name, q) or None
+        if v is not None:
+            callback(self.formatter.format(v), None); return
+        if self.closed:
+            callback(None, self.error or ClientDisconnectedError("disconnected from server at %s:%s" % (self.host, self.port)))
+            return
+        self._out.append(q)
+        self.waiting.append((request, callback, time.time(), timeout, cache))
+
+    def readable(self):
+        # Called before each asyncore.loop() iteration, which makes it a good place to check the timeout.
+        if self.waiting and self.waiting[0][3] is not None and time.time() - self.waiting[0][2] > self.waiting[0][3]:
+            s = "couldn't get a response from server at %s:%s in %s seconds" % (self.host, self.port, self.waiting[0][3])
+            self._fail(ClientTimeoutError(s))
+        return not self.closed
+
+    def writable(self):
+        return not self.closed and (not self.connected or len(self._out) > 0)
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+        data = "".join(self._out)
+        n = self.send(data)
+        self._out = n < len(data) and [data[n:]] or []
+
+    def handle_read(self):
+        self._in += self.recv(65536)
+        while "\n" in self._in:
+            v, self._in = self._in.split("\n", 1)
+            if self._banner:
+                # The first line is the server's welcome message.
+                self._banner = False
+                if v + "\n" == 'try again later...\n':
+                    self._fail(ServerBusyError("server at %s:%s is busy" % (self.host, self.port)))
+                continue
+            if v.strip() != "" and self.waiting:
+                self._respond(v + "\n")
+
+    def _respond(self, response):
+        request, callback, t, timeout, cache = self.waiting.pop(0)
+        if response == 'try again later...\n':
+            callback(None, ServerBusyError("restart the server at %s:%s" % (self.host, self.port))); return
+        if config.metrics:
+            metrics.observe("server_latency_seconds", time.time() - t, server=self.name)
+            metrics.count("server_requests", 1, server=self.name)
+            metrics.count("server_bytes_received", len(response), server=self.name)
+        if self.formatter.log:
+            _log[self.name].append((request, response))
+        if cache:
+            _classify(self.name, self.formatter.format_request(request), response)
+        callback(self.formatter.format(response), None)
+
+    def _fail(self, error):
+        # Closes the connection and passes the error to the callback of each request waiting for a response.
+        self.closed = True
+        self.error  = error
+        self.close()
+        waiting, self.waiting = self.waiting, []
+        for request, callback, t, timeout, cache in waiting:
+            callback(None, error)
+
+    def disconnect(self):
+        self._fail(ClientDisconnectedError("disconnected from server at %s:%s" % (self.host, self.port)))
+
+    def handle_close(self):
+        self.disconnect()
+
+    def handle_error(self):
+        e = sys.exc_info()[1]
+        if not isinstance(e, socket.error):
+            # An error in a callback is not a connection problem.
+            raise
+        self._fail(ServerConnectionError("can't connect to server at %s:%s" % (self.host, self.port), e.args))
+
+    def __repr__(self):
+        return "<AsyncClient host='%s', port='%s'>" % (self.host, str(self.port))
+
+_async = {}
+def async_client(client):
+    """ Returns an AsyncClient for the given (Client, host, port, name, log)-tuple.
+        A new connection is opened when all connections to the server have requests waiting,
+        up to config.async_connections, otherwise the connection with the fewest requests waiting is used.
+    """
+    Client, host, port, name, log = client
+    E = endpoints(host, port)
+    a = _async[name] = [c for c in _async.get(name, []) if not c.closed]
+    if len(a) < max(config.async_connections, len(E)) and not [c for c in a if not c.waiting]:
+        # With replicas (see config.ports), the new connection goes to the replica with the fewest connections.
+        host, port = min(E, key=lambda e: len([c for c in a if (c.host, c.port) == e]))
+        a.append(AsyncClient(Client, host, port, name, log))
+    return min(a, key=lambda c: len(c.waiting))
+
+def batch_async(instances, client, callback, timeout=None):
+    """ Sends a batch of requests to a server without waiting for the responses.
+        Once all responses have arrived (see asyncore.loop()), callback(responses, None) is called
+        with a list of responses in the same order as the instances, or callback(None, error).
+        - instances : a list of requests.
+        - client    : a (Client, host, port, name, log)-tuple, see define().
+        - callback  : a function that takes a list of responses and an error (or None).
+        - timeout   : the amount of time per request before giving up.
+    """
+    responses = [None] * len(instances)
+    n = [len(instances)] # Number of responses to wait for.
+    if n[0] == 0:
+        callback(responses, None); return
+    def _response(i):
+        def f(v, error):
+            if n[0] <= 0:
+                return
+            if error is not None:
+                n[0] = 0; callback(None, error); return
+            responses[i] = v
+            n[0] -= 1
+            if n[0] == 0:
+                callback(responses, None)
+        return f
+    for i, x in enumerate(instances):
+        async_client(client).request(x, _response(i), timeout)
+
 ######################################################################################################
 
 #from time import time
@@ -28,9 +28,14 @@ verbose = True
 servers = ['chunk', 'lemma', 'relation', 'preposition']
 ports = [6061, 6062, 6063, 6064] # Restart servers when changed.
 
+# A server can have replicas, by using a list of ports (e.g. ports = [[6061, 6065], 6062, 6063, 6064]).
+# Each replica is a separate server process, and the requests are spread over them (see client.batch()).
+# A replica that is down is skipped for replica_retry seconds.
+replica_retry = 30
+
 #-----------------------------------------------------------------------------------------------------
 # The hosts where the servers are running. 
-# The order is the same as the ports.
+# The order is the same as the ports. Replicas on different hosts can be given as a list.
 LOCALHOST = 'localhost'
 hosts = [LOCALHOST, LOCALHOST, LOCALHOST, LOCALHOST]
 
@@ -53,6 +58,95 @@ log = False
 # Enabling threading to contact a 6.3+ server can increase performance by 25% - 200%.
 threading = False
 
+# With threading=True, each server has a pool of worker threads that send the requests (see client.Executor).
+# The number of workers per server is set in server_threads (e.g. {'relation': 8}), or threads otherwise.
+threads = 4
+server_threads = {}
+
+# The number of requests written to a server connection before reading the responses (see client.batch()).
+# The server answers them in order, so a batch doesn't pay a round trip for each request (1 = one at a time).
+batch_window = 25
+
+# The number of connections per server used by parse_async() (see client.AsyncClient).
+# Requests are written back-to-back on each connection, so a few connections are enough.
+async_connections = 2
+
+# The connections to each server are kept open in a pool (see client.Pool).
+# At most pool_max connections per server are open at the same time (e.g. with threading=True),
+# and pool_min idle connections are kept open for the next batch.
+# A connection that has not been used for pool_idle seconds is pinged before it is reused
+# (waiting at most pool_timeout seconds for an answer), and replaced when the server doesn't answer.
+# With pool_recycle, a connection is replaced after the given number of requests (None = never).
+pool_min = 1
+pool_max = 10
+pool_idle = 30
+pool_timeout = 3
+pool_recycle = None
+
+#-----------------------------------------------------------------------------------------------------
+# Pipelined parsing: each stage of the parser (chunker, relation finder, lemmatizer, PP-attacher) 
+# runs in a separate thread, so that the servers work at the same time on different sentences.
+# Sentences are passed from stage to stage in windows of pipeline_window sentences,
+# with at most pipeline_queue windows waiting between two stages (this bounds memory usage).
+pipeline = False
+pipeline_window = 25
+pipeline_queue  = 4
+
+#-----------------------------------------------------------------------------------------------------
+# The number of tagged sentences kept in cache, regardless of the string they occur in.
+# Sentences that recur in many strings (e.g. "All rights reserved.") are then sent to the servers once.
+# The cache is keyed by the tokenized sentence and the parse() options (0 = disabled, e.g. 10000).
+# The parser event on_cache is fired for the sentences taken from the cache.
+sentence_cache = 0
+
+# The number of sentences kept in the stage cache, with the output of each parser stage (0 = disabled).
+# This way, parse() only needs to run the remaining stages on text that was chunk()-ed before.
+stage_cache = 0
+
+# Tagged sentences can also be stored in a database in the given folder (e.g. "/tmp/mbsp"),
+# so that they are reused after a restart. Entries are compressed, and removed when a model changes.
+persistent_cache = None
+
+# The responses of the relation finder, PP-attacher and lemmatizer are kept in a classification cache 
+# for each server, since the same lookup instances (e.g. the/DT) recur in many sentences.
+# Each cache uses at most the given number of bytes (servers that are not listed are not cached).
+# With classification_files, a cache is filled from the given file when it is created,
+# for example a file written with client.classifications('relation').save() after a large batch.
+classification_cache = {'relation': 16*1024*1024, 'preposition': 16*1024*1024, 'lemma': 4*1024*1024}
+classification_files = {}
+
+# The caches can also be limited by their estimated memory usage in bytes (see cache.sizeof()),
+# e.g. {'mbsp.sentence_cache': 64*1024*1024} keeps at most 64MB of tagged sentences.
+# Caches that are not listed are only limited by their number of entries:
+# mbsp.cache, mbsp.sentence_cache, mbsp.stage_cache, prepositions.cache, client.log.
+# With cache_ttl, entries in these caches expire after the given number of seconds (None = never).
+# MBSP.memory() returns the number of entries and the memory usage of each cache.
+cache_bytes = {}
+cache_ttl = None
+
+# Parsed strings and PP-attachments can be shared between the MBSP processes of a user on one host 
+# (e.g. parse_parallel() or several worker processes), through a cache daemon on the Unix socket 
+# at the given path (None = disabled, True = a private folder in the temporary folder, see shared.py).
+# The daemon is started by the first process that needs it (with autostart=True), 
+# and keeps at most shared_cache_bytes of entries.
+shared_cache = None
+shared_cache_bytes = 256*1024*1024
+
+#-----------------------------------------------------------------------------------------------------
+# Record the time spent in each parser stage and the requests sent to each server (see metrics.py).
+# With metrics_file, the metrics are written to the given file every metrics_interval seconds,
+# in the Prometheus text format.
+metrics = False
+metrics_file = None
+metrics_interval = 60
+
+# Sample the call stack of each parser stage and server batch every profile_interval seconds
+# (see profiler.py). This can also be enabled for a single call with parse(string, profile=True).
+# With profile_file, the collapsed stacks are written to the given file after each parse.
+profile = False
+profile_file = None
+profile_interval = 0.005
+
 #-----------------------------------------------------------------------------------------------------
 # The folder where MBSP resides.
 # By default this is the same path as config.py.
@@ -168,6 +262,7 @@ events.parser = adict.fromkeys([
     'on_parse_relations',       # When the string has been parsed for relation tags.
     'on_parse_pp_attachments ', # When the string has been parsed for PP-attachments.
     'on_lemmatize',             # When the string has been parsed for word lemmata.
+    'on_cache',                 # When sentences have been taken from the sentence cache instead.
 ], None)
 
 #-----------------------------------------------------------------------------------------------------
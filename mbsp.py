@@ -28,10 +28,13 @@
 # >>> print parse(u'Draw a red car.')
 # Draw/VB/I-VP/O/VP-1/draw a/DT/I-NP/O/NP-OBJ-1/a red/JJ/I-NP/O/NP-OBJ-1/red car/NN/I-NP/O/NP-OBJ-1/car ././O/O/O/.
 
-import os, sys, socket, time, re, subprocess, tempfile
+import os, sys, socket, time, re, subprocess, tempfile, codecs, threading, Queue, asyncore
 import config
 import client
 import server
+import metrics
+import profiler
+import shared
 import tokenizer
 import relationfinder
 import prepositions
@@ -40,8 +43,32 @@ from config import WORD, POS, CHUNK, PNP, REL, ANCHOR, LEMMA
 from config import SLASH
 
 # Keep the last results of the parser stored in cache for faster retrieval.
-from cache import Cache
+from cache import Cache, PersistentCache, fingerprint
 cache = Cache(size=25, hashed=True)
+# Keep tagged sentences stored in cache, to reuse sentences that occur in different strings.
+sentence_cache = Cache(size=config.sentence_cache, hashed=True)
+# Keep the tag columns of parsed sentences stored in cache, so that parse() can resume from chunk().
+stage_cache = Cache(size=config.stage_cache, hashed=True)
+
+def caches():
+    """ Returns a list of (name, Cache)-tuples with the parser caches.
+    """
+    return [
+        ("mbsp.cache", cache), 
+        ("mbsp.sentence_cache", sentence_cache), 
+        ("mbsp.stage_cache", stage_cache), 
+        ("prepositions.cache", prepositions.cache)
+    ]
+
+def _configure_caches():
+    # Applies the cache settings in config.py (which can be changed after the module is imported).
+    sentence_cache.size = config.sentence_cache
+    stage_cache.size = config.stage_cache
+    for name, c in caches():
+        c.budget = config.cache_bytes.get(name)
+        c.ttl = config.cache_ttl
+
+_configure_caches()
 
 PERL         = config.perl                       # Path to Perl (deprecated).
 PERL_SCRIPTS = os.path.join(config.MODULE, 'pl') # Path to the Perl scripts included in MBSP.
@@ -174,6 +201,79 @@ def _perl_format(string):
             sentences.append(sentence.strip())
     return sentences
 
+#--- TOKEN TABLE -------------------------------------------------------------------------------------
+# Between the parser stages, each sentence is a dictionary with a list of values for each tag, e.g.
+# {WORD: ["Draw", "a", "red", "car", "."], POS: ["VB", "DT", "JJ", "NN", "."], CHUNK: [...]}.
+# Each stage adds its own tag column to each sentence, 
+# the slash-formatted string is created only once at the end (see _render()).
+# Values are utf-8 byte strings with encoded entities (see encode_entities()).
+# The tables are kept in the stage cache, so that a sentence that was parsed before 
+# (e.g. with chunk()) only needs the remaining stages to be parsed again (e.g. with parse()).
+# An asynchronous parse keeps its own tables between steps (see AsynchronousParse).
+
+_KEY = "key" # The stage cache key of a sentence table (i.e. the tokenized sentence).
+
+_local = threading.local()
+
+def _stage_cache():
+    """ Returns the tables of the current asynchronous parse, the stage cache (with config.stage_cache), or None.
+    """
+    c = getattr(_local, "tables", None)
+    if c is None and config.stage_cache > 0:
+        c = stage_cache
+    return c
+
+def _table(string):
+    """ Returns a list of sentences with a WORD column from the given tokenized unicode string,
+        where sentences are separated by a new line and words by a space.
+        Sentences in the stage cache have the tag columns that were parsed before.
+    """
+    s = encode_entities(string).encode("utf-8")
+    c = _stage_cache()
+    sentences = []
+    for x in s.split("\n"):
+        x = " ".join(x.split())
+        if x != "":
+            t = c is not None and _cache_get(c, x) or None
+            if c is stage_cache and config.metrics:
+                metrics.count(t is not None and "cache_hits" or "cache_misses", 1, cache="mbsp.stage_cache")
+            t = t is not None and dict(t) or {WORD: x.split(), _KEY: x}
+            sentences.append(t)
+    return sentences
+
+def _resume(function, key):
+    """ Returns a stage function that only parses the sentences for which the given key is not set,
+        i.e., sentences that were not parsed before by the stage (with the same format).
+        The sentences are then stored in the stage cache.
+    """
+    def stage(sentences):
+        todo = [s for s in sentences if key not in s]
+        if len(todo) > 0:
+            function(todo)
+            c = _stage_cache()
+            for s in todo:
+                s[key] = True
+                if c is not None:
+                    _cache_set(c, s[_KEY], s)
+        return sentences
+    return stage
+
+def _table_tagged(string, format=[WORD]):
+    """ Returns a list of sentences from the given slash-formatted byte string, 
+        where the order of the tags in each token is defined by the format list.
+    """
+    sentences = []
+    for x in string.split("\n"):
+        tokens = [token.split("/") for token in x.split(" ")]
+        sentences.append(dict([(tag, [token[i] for token in tokens]) for i, tag in enumerate(format)]))
+    return sentences
+
+def _render(sentences, format=[WORD]):
+    """ Returns a slash-formatted byte string from the given list of sentences,
+        where each token contains the tags in the format list, in the given order.
+    """
+    return "\n".join([" ".join(["/".join(token) for token in zip(*[s[tag] for tag in format])]) for s in sentences])
+
 #--- PYTHON TOKENIZER --------------------------------------------------------------------------------
 
 def _tokenize(string):
@@ -181,136 +281,160 @@ def _tokenize(string):
         Tokens (i.e. individual words and punctuation marks) in a sentence are separated by a space.
     """
     # See tokenizer.py for more details.
+    # The tokenized string is kept in the stage cache.
+    if config.metrics:
+        t = time.time()
+        s = _tokenize_cached(string)
+        metrics.observe("stage_seconds", time.time() - t, stage="tokenize")
+        metrics.count("stage_sentences", s.count("\n") + 1, stage="tokenize")
+        metrics.count("stage_tokens", s.count(" ") + s.count("\n") + 1, stage="tokenize")
+        return s
+    return _tokenize_cached(string)
+
+def _tokenize_cached(string):
+    c = _stage_cache()
+    if c is not None:
+        s = _cache_get(c, (TOKENS, string))
+        if c is stage_cache and config.metrics:
+            metrics.count(s is not None and "cache_hits" or "cache_misses", 1, cache="mbsp.stage_cache")
+        if s is None:
+            s = '\n'.join(tokenizer.split(string))
+            _cache_set(c, (TOKENS, string), s)
+        return s
     return '\n'.join(tokenizer.split(string))
 
 #--- CHUNKER -----------------------------------------------------------------------------------------
 
-def _chunk(string):
-    """ Takes a tokenized and escaped string where sentences are separated by a new line.
-        Returns a string where words have been tagged with their part-of-speech and chunk tags.
+def _chunk(sentences):
+    """ Takes a list of sentences with a WORD column (see _table()), and adds the POS and CHUNK columns.
         Common part-of-speech tags include NN (noun), VB (verb), JJ (adjective), PP (preposition).
         Common chunk tags include NP (noun phrase), VP (verb phrase), ...
-        - input: ['Draw a red car .']
+        - input : Draw a red car .
         - output: Draw/VB/I-VP a/DT/I-NP red/JJ/I-NP car/NN/I-NP ././O
     """
-    sentences = filter(lambda x: len(x)>0, string.splitlines())
     host = HOSTS[CHUNK]
     port = PORTS[CHUNK]
     # Send the sentences to the TiMBL server.
     # The batch() function in the client module takes care of managing server clients,
     # we simply pass it all the tagging jobs and a definition of the client we need.
-    return '\n'.join(client.batch(sentences, client=(client.Mbt, host, port, CHUNK, config.log), retries=1))
+    tagged = client.batch([" ".join(s[WORD]) for s in sentences], 
+        client=(client.Mbt, host, port, CHUNK, config.log), retries=1)
+    for s, x in zip(sentences, tagged):
+        x = [token.rsplit("/", 2) for token in x.split()]
+        s[POS]   = [token[-2] for token in x]
+        s[CHUNK] = [token[-1] for token in x]
+    return sentences
 
 #--- PREPOSITION FINDER ------------------------------------------------------------------------------
 
-def _find_prepositions(string):
-    """ Adds PNP-tags to the chunked words.
-        The input is the string with slash-formatted tokens returned from _chunk().
+def _find_prepositions(sentences):
+    """ Adds the PNP column to the chunked sentences returned from _chunk().
         - input : Draw/VB/I-VP a/DT/I-NP red/JJ/I-NP car/NN/I-NP ././O
         - output: Draw/VB/I-VP/O a/DT/I-NP/O red/JJ/I-NP/O car/NN/I-NP/O ././O/O
     """
     # The older Perl implementation:
     #return pipe([PERL, os.path.join(PERL_SCRIPTS, 'pnpfinder.pl')], string)
-    s = string.splitlines()
-    # Functions to facilitate look-back and look-ahead:
-    pos       = lambda T,i: i < len(T) and T[i][-3] or ""     # Part-of-speech tag in current token.
-    ch        = lambda T,i: i < len(T) and T[i][-2] or ""     # Chunk tag in current token.
-    ch_before = lambda T,i: i > 0 and T[i-1][-2] or ""        # Chunk tag in previous token.
-    ch_after  = lambda T,i: i < len(T)-1 and T[i+1][-2] or "" # Chunk tag in next token.
-    for i in range(len(s)):
-        T = s[i].split(" ") # "T" stands for "a sentence as a split list of tokens".
-        T = [token.split("/")+["O"] for token in T]
+    for s in sentences:
+        P = s[POS]
+        C = s[CHUNK]
+        T = ["O"] * len(C) # The PNP tag for each token.
+        # Functions to facilitate look-back and look-ahead:
+        pos       = lambda i: i < len(P) and P[i] or ""     # Part-of-speech tag in current token.
+        ch        = lambda i: i < len(C) and C[i] or ""     # Chunk tag in current token.
+        ch_before = lambda i: i > 0 and C[i-1] or ""        # Chunk tag in previous token.
+        ch_after  = lambda i: i < len(C)-1 and C[i+1] or "" # Chunk tag in next token.
         j = 0
         # Traverse the tokens in the sentence.
         # The PNP-tagger is triggered when the chunk tag of a token is "PP".
         while j < len(T):
             # A PP marks the start of a new PNP chunk.
-            if ch(T,j).endswith("PP"):
+            if ch(j).endswith("PP"):
                 k = j + 1
-                while k < len(T) and ch(T,k).endswith("PP"):
+                while k < len(T) and ch(k).endswith("PP"):
                     # PP's directly following this PP are part of the PNP:
                     # due to, as with, based on, such as, ...
                     k += 1
-                while k < len(T) and pos(T,k) in ('IN','TO') and ch(T,k) == "SBAR":
+                while k < len(T) and pos(k) in ('IN','TO') and ch(k) == "SBAR":
                     # Essentially the same as the previous rule,
                     # but it catches something like: "on/IN/PP whether/IN/SBAR users/NNS/NP".
                     k += 1
-                while k < len(T) and ch(T,k).endswith("VP") and pos(T,k) == "VBG" and ch(T,k+1).endswith("NP"):
+                while k < len(T) and ch(k).endswith("VP") and pos(k) == "VBG" and ch(k+1).endswith("NP"):
                     # A gerund following the PP is allowed if it is followed by a NP, for example:
                     # "Wolf cubs are submissive to their parents , and remain so [AFTER REACHING sexual maturity] ."
                     k += 1
-                while k < len(T) and ch(T,k).endswith("NP"):
+                while k < len(T) and ch(k).endswith("NP"):
                     # NP's following a PP are part of the PNP, as long as it is not B-NP
                     # preceded by I-NP (the new noun phrase is not part of the preposition).
-                    if ch(T,k) == "B-NP" and ch_before(T,k) == "I-NP": break
+                    if ch(k) == "B-NP" and ch_before(k) == "I-NP": break
                     k += 1
                 k -= 1
                 # Tag the range, after ensuring that it ends with a NP (and thus is a P+NP).
-                if k > j and ch(T,k).endswith("NP"):
-                    T[j][-1] = "B-PNP"
-                    for k in range(j+1, k+1): T[k][-1] = "I-PNP"
+                if k > j and ch(k).endswith("NP"):
+                    T[j] = "B-PNP"
+                    for k in range(j+1, k+1): T[k] = "I-PNP"
                     j = k
             j += 1
-        s[i] = " ".join(["/".join(token) for token in T])
-    return "\n".join(s)
+        s[PNP] = T
+    return sentences
 
 #--- RELATION FINDER ---------------------------------------------------------------------------------
 
-def _find_relations(string):
-    """ Adds the relation tags to the chunked words.
-        The input is the slash-formatted string of tokens returned from _find_prepositions().
+def _find_relations(sentences):
+    """ Adds the REL column to the sentences returned from _find_prepositions().
         Sentence subjects get the -SBJ tag, sentence objects the -OBJ tag.
         Verbs and their arguments get the same id, for example NP-SBJ-1 and VP-1 belong together.
         - input : Draw/VB/I-VP/O a/DT/I-NP/O red/JJ/I-NP/O car/NN/I-NP/O ././O/O
         - output: Draw/VB/I-VP/O/VP-1 a/DT/I-NP/O/NP-OBJ-1 red/JJ/I-NP/O/NP-OBJ-1 car/NN/I-NP/O/NP-OBJ-1 ././O/O/O
     """
     # See relationfinder.py for more details.
-    sentences = filter(lambda x: len(x)>0, string.splitlines())
-    return '\n'.join([relationfinder.tag(sentence) for sentence in sentences])
+    # The lookup instances of all sentences are sent to the relation server in one batch.
+    R = relationfinder.tag_columns([(s[WORD], s[POS], s[CHUNK], s[PNP]) for s in sentences])
+    for s, relations in zip(sentences, R):
+        s[REL] = relations
+    return sentences
 
 #--- PP ATTACHER -------------------------------------------------------------------------------------
 
-def _find_pp_attachments(string, format=[WORD, POS, CHUNK, PNP, REL, LEMMA]):
-    """ Adds the anchor tags to the PNP-tagged sentence.
-        The input is the string of tokens returned from _find_prepositions() or _find_relations().
+def _find_pp_attachments(sentences, format=[WORD, POS, CHUNK, PNP, REL, LEMMA]):
+    """ Adds the ANCHOR column to the sentences returned from _find_prepositions() or _find_relations().
         PNP chunks for which an anchor is found are tagged with P.
         Anchors (usually a VP) are tagged with A.
         Anchors and their related PNP's get the same id, for example A1 and P1.
+        The format lists the tags that are used to find the anchors.
     """
     # See prepositions.py for more details.
-    s = string.splitlines()
-    for i in range(len(s)):
-        tokens = s[i].split(" ")
-        tokens = [token.split("/") for token in tokens]
-        attachments = prepositions.pp_attachments(s[i], format)
+    # The PP-attacher takes a list of tokens (each a list of unicode tags) for each sentence.
+    # The lookup instances of all sentences are sent to the preposition server in one batch.
+    f = [tag for tag in format if tag != ANCHOR]
+    T = [[[x.decode("utf-8") for x in token] for token in zip(*[s[tag] for tag in f])] for s in sentences]
+    attachments_all = prepositions.pp_attachments_many(T, f)
+    for s, attachments in zip(sentences, attachments_all):
+        C = s[CHUNK]
         # Create a list of anchor tags for each token in the sentence.
         # Anchors will get A1, A2 (or A1-A2), prepositions get P1, P2, ...
-        tags = ["O" for token in tokens]
+        tags = ["O" for ch in C]
         join = lambda s1, s2: s1=="O" and s2+str(id+1) or "%s-%s%s"%(s1,s2,str(id+1))
         for id, (A,P) in enumerate(attachments):
             tags[A] = join(tags[A], "A")
             tags[P] = join(tags[P], "P")
             # Roll back to tag all preceding verbs in the same VP as anchor too.
             for j in reversed(range(A)):
-                if tokens[j][2][1:] == tokens[A][2][1:]:
+                if C[j][1:] == C[A][1:]:
                     tags[j] = join(tags[j], "A")
                 else:
                     break
-                if tokens[j][2].startswith("B-"):
+                if C[j].startswith("B-"):
                     break
             # Roll forward to tag the NP's following the PP in the PNP too.
-            for j in range(P+1, len(tokens)):
-                if tokens[j][3].startswith("B-"):
+            for j in range(P+1, len(C)):
+                if s[PNP][j].startswith("B-"):
                     break
-                if tokens[j][3][1:] == tokens[P][3][1:]:
+                if s[PNP][j][1:] == s[PNP][P][1:]:
                     tags[j] = join(tags[j], "P")
                 else:
                     break
-        # Add the anchor tag to each token in the sentence.
-        for j in range(len(tokens)):
-            tokens[j].append(tags[j])
-        s[i] = " ".join(["/".join(token) for token in tokens])
-    return "\n".join(s) 
+        s[ANCHOR] = tags
+    return sentences
 
 #--- LEMMATIZER --------------------------------------------------------------------------------------
 
@@ -318,11 +442,9 @@ def _find_pp_attachments(string, format=[WORD, POS, CHUNK, PNP, REL, LEMMA]):
 # Entries have the following form: {'saw\tVBD\tsaw' : 'saw\tVBD\tsee'}
 _lemmatizer_exceptions = {}
 
-def _lemmatize_prepare(string):
-    """ Reformats the chunked string so it can be used by _lemmatize().
-        To make this function work correctly, every sentence must be on a new line, 
-        and the word must at the first position and the part-of-speech tag must be at 
-        the second position of the slash-formatted token.
+def _lemmatize_prepare(sentences):
+    """ Returns the input string for _lemmatize() from the WORD and POS columns of the given sentences.
+        Sentences are delimited with <utt>.
         - input: Draw/VB/I-VP/O/VP-1 a/DT/I-NP/O/NP-OBJ-1 red/JJ/I-NP/O/NP-OBJ-1 car/NN/I-NP/O/NP-OBJ-1 ././O/O/O
         - output:
           Draw	    VB
@@ -331,11 +453,12 @@ def _lemmatize_prepare(string):
           car       NN
           .	        .
     """
-    s = string.replace('\n', ' <utt>\n') # Lemmatizer assumes sentences are delimited with <utt>.
-    tabbed = ''
-    for word in s.split():
-        tabbed += '\t'.join(word.split('/')[0:2]) + '\n' # Draw/VB/I-VP/O/VP-1 => Draw  VB
-    return tabbed
+    tabbed = []
+    for i, s in enumerate(sentences):
+        if i > 0:
+            tabbed.append('<utt>\n') # Lemmatizer assumes sentences are delimited with <utt>.
+        tabbed.extend(['%s\t%s\n' % (w, pos) for w, pos in zip(s[WORD], s[POS])]) # Draw/VB => Draw  VB
+    return ''.join(tabbed)
     
 def _lemmatize(string):
     """ Returns the lemmata from the output of _lemmatize_prepare() using MBLEM.
@@ -361,22 +484,25 @@ def _lemmatize(string):
     os.close(f)
     # Contact the MBLEM lemmatizer.
     # MBLEM will read the temporary file and create a new file with its answer.
-    pipe([LEMMATIZER, fname,
-        str(HOSTS['lemma']),
-        str(PORTS['lemma']),
-        os.path.join(MODELS, 'em.lex'),
-        os.path.join(MODELS, 'em_mblem.transtable')
-    ])
+    # With replicas of the lemma server, MBLEM contacts the one with the fewest outstanding requests.
+    R = client.replicas(LEMMA, HOSTS['lemma'], PORTS['lemma'])
+    host, port = e = R.acquire()
+    try:
+        pipe([LEMMATIZER, fname,
+            str(host),
+            str(port),
+            os.path.join(MODELS, 'em.lex'),
+            os.path.join(MODELS, 'em_mblem.transtable')
+        ])
+    finally:
+        R.release(e)
     out = open(fname+'.tl').read()
     os.remove(fname)
     os.remove(fname+'.tl')
     return out
 
-def _lemmatize_merge(string, lemmata):
-    """ Combines the output of _find_relations() and _lemmatize() into one slash formatted string,
-        with every sentence on a newline.
-        - string:
-          Draw/VB/I-VP/O/VP-1 a/DT/I-NP/O/NP-OBJ-1 red/JJ/I-NP/O/NP-OBJ-1 car/NN/I-NP/O/NP-OBJ-1 ././O/O/O
+def _lemmatize_merge(sentences, lemmata):
+    """ Adds the LEMMA column to the given sentences from the output of _lemmatize().
         - lemmata:
           Draw  	VB	draw
           a	        DT	a
@@ -387,20 +513,44 @@ def _lemmatize_merge(string, lemmata):
           Make/VB/I-VP/O/VP-1/make a/DT/I-NP/O/NP-OBJ-1/a 
           red/JJ/I-NP/O/NP-OBJ-1/red car/NN/I-NP/O/NP-OBJ-1/car ././O/O/O/.
     """
-    string = string.split('\n')
     lemmata = lemmata.split('<utt>\n')
-    assert len(string) == len(lemmata)
-    sentences = []
-    for i, sentence in enumerate(string):
-        words = sentence.split()
+    assert len(sentences) == len(lemmata)
+    for i, s in enumerate(sentences):
         lemma = lemmata[i].strip().split('\n')
         lemma = [_lemmatizer_exceptions.get(x,x) for x in lemma]
-        assert len(words) == len(lemma) # Something is wrong in mbsp.py source code if this occurs.
-        s = []
-        for j, word in enumerate(words):
-            s.append('%s/%s' % (word, lemma[j].split('\t')[-1]))
-        sentences.append(' '.join(s))
-    return '\n'.join(sentences)       
+        assert len(s[WORD]) == len(lemma) # Something is wrong in mbsp.py source code if this occurs.
+        s[LEMMA] = [x.split('\t')[-1] for x in lemma]
+    return sentences
+
+def _find_lemmata(sentences):
+    """ Adds the LEMMA column to the sentences returned from _chunk(), using MBLEM.
+    """
+    # A few hundred frequent words (e.g. the/DT, is/VBZ) make up most of the text.
+    # Each unique word/part-of-speech pair is lemmatized once, and the lemma is copied to each occurrence.
+    tokens = [(w, pos) for s in sentences for w, pos in zip(s[WORD], s[POS])]
+    unique, positions = client._unique(tokens)
+    if config.metrics:
+        metrics.count("batch_instances", len(tokens), server=LEMMA)
+        metrics.count("batch_duplicates", len(tokens) - len(unique), server=LEMMA)
+    if not unique:
+        return _lemmatize_merge(sentences, _lemmatize(_lemmatize_prepare(sentences)))
+    # Lemmata in the classification cache are not sent to MBLEM (see client.Classifications),
+    # keyed by the MBLEM input line of the word (see _lemmatize_prepare()).
+    keys = ["%s\t%s\n" % (w, pos) for w, pos in unique]
+    lemmata = [client._classified(LEMMA, k) for k in keys]
+    misses = [j for j, v in enumerate(lemmata) if v is None]
+    if misses:
+        t = {WORD: [unique[j][0] for j in misses], POS: [unique[j][1] for j in misses]}
+        t = _lemmatize_merge([t], _lemmatize(_lemmatize_prepare([t])))[0]
+        for j, lemma in zip(misses, t[LEMMA]):
+            lemmata[j] = lemma + "\n"
+            client._classify(LEMMA, keys[j], lemmata[j])
+    lemmata = [v[:-1] for v in lemmata]
+    i = 0
+    for s in sentences:
+        s[LEMMA] = [lemmata[j] for j in positions[i:i+len(s[WORD])]]
+        i += len(s[WORD])
+    return sentences
 
 #--- PARSER ------------------------------------------------------------------------------------------
 
@@ -422,34 +572,30 @@ def _handle_event(name, string, format, language="en"):
         return b
     return string
 
-def parse(string, tokenize=True, tags=True, chunks=True, relations=True, anchors=True, lemmata=True, encoding=config.encoding):
-    """ Takes a string of sentences and returns a tagged Unicode string. 
-        Sentences in the output are separated by newline characters. 
-        The input must be a unicode object. If it is a string it will be decoded using config.encoding.
-        - tokenize     : if False no tokenization is carried out (the input must be tokenized already).
-        - tags         : if False doesn't add the part-of-speech tags  (e.g. NN) to the output.
-        - chunks       : if False doesn't add the chunk (e.g. NP) and PNP tags to the output.
-        - relations    : if False doesn't search for relations (-SBJ etc.)
-        - anchors      : if False doesn't search for PNP anchors.
-        - lemmata      : if False doesn't search for lemmata.
-        - encoding     : encoding used to decode the input.
-    """
+def _handle_table_event(name, sentences, format, language="en"):
+    # Parser events take a slash-formatted TokenString (see _handle_event()).
+    # The string is only created if there is a handler for the event.
+    handler = config.events.get("parser", {}).get(name, None)
+    if handler is not None:
+        s = _render(sentences, format).decode("utf-8")
+        s = _handle_event(name, s, format, language)
+        s = _table_tagged(unicode(s).encode("utf-8"), format)
+        # Copy the edited tags, the tags that are not in the format list are kept.
+        for s1, s2 in zip(sentences, s):
+            s1.update(s2)
+    return sentences
+
+def _decode(string, encoding=config.encoding):
     # We expect to start from unicode input. Decode the byte string if needed.
     # An exception is raised otherwise.
     if isinstance(string, str):
-        s = string.decode(encoding)
+        return string.decode(encoding)
     elif isinstance(string, unicode):
-        s = string
+        return string
     else:
         raise TypeError('input string must be a string or unicode')
-    # Disable options for which the servers are missing.
-    # The chunk server should always be running.
-    if 'lemma' not in HOSTS:
-        lemmata = False
-    if 'relation' not in HOSTS:
-        relations = False
-    if 'preposition' not in HOSTS:
-        anchors = False
+
+def _format(tags=True, chunks=True, relations=True, anchors=True, lemmata=True):
     # Construct the format of a token in the parsed output.
     # Knowing the format allows a Sentence (see tree.py) to figure out the order of the tags.
     # Trees are used to find preposition anchors, for example.
@@ -459,6 +605,383 @@ def parse(string, tokenize=True, tags=True, chunks=True, relations=True, anchors
     if relations : format.append(REL)
     if anchors   : format.append(ANCHOR)
     if lemmata   : format.append(LEMMA)
+    return format
+
+def _options(tags=True, chunks=True, relations=True, anchors=True, lemmata=True):
+    """ Returns a (format, tags, chunks, relations, anchors, lemmata)-tuple for the given parse() options.
+        Options for which the servers are missing are disabled.
+        The format is the list of tags in each token of the parsed output.
+    """
+    # Disable options for which the servers are missing.
+    # The chunk server should always be running.
+    if 'lemma' not in HOSTS:
+        lemmata = False
+    if 'relation' not in HOSTS:
+        relations = False
+    if 'preposition' not in HOSTS:
+        anchors = False
+    format = _format(tags, chunks, relations, anchors, lemmata)
+    return format, tags, chunks, relations, anchors, lemmata
+
+#--- PARSER STAGES -----------------------------------------------------------------------------------
+# The parser is a sequence of stages, each takes a list of sentences and adds a tag column to each.
+# The stages can run one after another on all the sentences, 
+# or at the same time on successive windows of sentences (see config.pipeline).
+
+def _decode_tagged(sentences, format=[WORD]):
+    """ Returns the tagged unicode string for the given sentences with the tags in the given format.
+        Tags that were parsed but weren't asked for are left out (e.g. part-of-speech tags with tags=False),
+        lemmata are placed at the back of the token (after the anchor tags).
+    """
+    s = _render(sentences, format)
+    s = s.strip()
+    s = decode_entities(s, slashes=False)
+    s = s.decode('utf-8')
+    return s
+
+def _stages(tags=True, chunks=True, relations=True, anchors=True, lemmata=True, profile=False, deadline=None):
+    """ Returns a list of (name, function)-tuples for the given parse() options.
+        Each function takes a list of sentences, adds a tag column to each sentence and returns the list.
+        The first stage takes the tokenized unicode string where sentences are separated by a new line,
+        the last stage returns the tagged unicode string.
+        Stages that were run before on a sentence (with the same format) are skipped for that sentence.
+        With profile=True (or config.profile), the call stack of each stage is sampled (see profiler.py).
+        With a deadline (see time.time()), each stage can use the time that is left (see _budget()).
+    """
+    def _event(name, function, format, key=None):
+        # The event is fired for the sentences that are parsed by the stage, 
+        # the stage output is then stored in the stage cache (see _resume()).
+        # The key is the list of tags the stage depends on (by default, the format).
+        f = lambda s: _handle_table_event(name, function(s), format=format)
+        return _resume(f, key=tuple(key or format))
+    R = relations and [REL] or []
+    stages = [("encode", _table)]
+    # Tag for part-of-speech tags and chunks.
+    if tags or chunks or relations or anchors or lemmata:
+        f = [WORD, POS, CHUNK]
+        stages.append((CHUNK, _event("on_parse_tags_and_chunks", _chunk, f)))
+    # Find PNP chunks.
+    if chunks or relations or anchors:
+        f = [WORD, POS, CHUNK, PNP]
+        stages.append((PNP, _event("on_parse_prepositions", _find_prepositions, f)))
+    # Find relations.
+    if relations:
+        f = [WORD, POS, CHUNK, PNP, REL]
+        stages.append((REL, _event("on_parse_relations", _find_relations, f)))
+    # Find lemmata.
+    if lemmata or anchors:
+        f = [WORD, POS, CHUNK, PNP] + R + [LEMMA]
+        stages.append((LEMMA, _event("on_lemmatize", _find_lemmata, f, key=[WORD, POS, LEMMA])))
+    # Find PP anchors.
+    if anchors:
+        f = [WORD, POS, CHUNK, PNP] + R + [LEMMA, ANCHOR]
+        stages.append((ANCHOR, _event("on_parse_pp_attachments", 
+            lambda s, f=f: _find_pp_attachments(s, format=f), f)))
+    format = _format(tags, chunks, relations, anchors, lemmata)
+    stages.append(("decode", lambda s: _decode_tagged(s, format)))
+    if config.metrics:
+        stages = [(name, _measured(name, f)) for name, f in stages]
+    if profile or config.profile:
+        stages = [(name, profiler.wrap(name, f)) for name, f in stages]
+    if deadline is not None:
+        stages = _budget(stages, deadline)
+    return stages
+
+def _budget(stages, deadline):
+    """ Returns the given list of (name, function)-tuples, where each function raises a DeadlineError
+        if the deadline has passed, and otherwise sets the deadline for the server requests in the stage.
+        Each stage can use all of the time that is left, so that a fast stage leaves it to the next.
+        The lemmatizer runs MBLEM in a separate process, which is not interrupted when it takes too long.
+    """
+    def _stage(name, function):
+        def stage(s):
+            if time.time() >= deadline:
+                raise client.DeadlineError, "deadline exceeded before the %s stage" % name
+            client.set_deadline(deadline)
+            try:
+                return function(s)
+            finally:
+                client.set_deadline(None)
+        return stage
+    return [(name, _stage(name, f)) for name, f in stages]
+
+def _measured(name, function):
+    """ Returns a stage function that records the time spent in the given stage function,
+        and the number of sentences and tokens (see metrics.py).
+    """
+    def stage(s):
+        t = time.time()
+        s = function(s)
+        metrics.observe("stage_seconds", time.time() - t, stage=name)
+        if isinstance(s, list):
+            metrics.count("stage_sentences", len(s), stage=name)
+            metrics.count("stage_tokens", sum([len(x[WORD]) for x in s]), stage=name)
+        return s
+    return stage
+
+def _parse_windows(windows, tags=True, chunks=True, relations=True, anchors=True, lemmata=True, profile=False):
+    """ Takes an iterable of tokenized unicode strings (e.g. windows of sentences separated by a new line),
+        and yields a tagged unicode string for each, in order.
+        With config.pipeline=True, the parser stages process successive windows at the same time.
+        Sentences in the sentence cache are not parsed again (the on_cache event is fired for them instead).
+    """
+    stages = _stages(tags, chunks, relations, anchors, lemmata, profile)
+    options = "".join([str(p) for p in (tags, chunks, relations, anchors, lemmata)])
+    format = _format(tags, chunks, relations, anchors, lemmata)
+    _configure_caches()
+    pending = [] # (sentences, tagged sentences)-tuple for each window, None for sentences not in cache.
+    def _lookup(windows):
+        # Yields the sentences in each window that are not in cache.
+        for s in windows:
+            s = [x for x in s.split("\n") if x.strip() != ""]
+            tagged = [_cached(x + options) for x in s]
+            hits = [i for i, x in enumerate(tagged) if x is not None]
+            if len(hits) > 0 and config.events.get("parser", {}).get("on_cache") is not None:
+                x = unicode(_handle_event("on_cache", "\n".join([tagged[i] for i in hits]), format))
+                for i, x in zip(hits, x.split("\n")):
+                    tagged[i] = x
+            pending.append((s, tagged))
+            s = [x for x, y in zip(s, tagged) if y is None]
+            if len(s) > 0:
+                yield "\n".join(s)
+    def _merge(s=None):
+        # Returns the next window, with the tagged sentences from cache and the given tagged string.
+        sentences, tagged = pending.pop(0)
+        s = s is not None and iter(s.split("\n")) or None
+        for i, x in enumerate(tagged):
+            if x is None:
+                tagged[i] = s.next()
+                _cache(sentences[i] + options, tagged[i])
+        if s is not None and _persistent_cache() is not None:
+            _persistent_cache().commit()
+        return "\n".join(tagged)
+    def _sequential(windows):
+        for s in windows:
+            for name, f in stages: 
+                s = f(s)
+            yield s
+    if config.pipeline and len(stages) > 2 and client.prefetched() is None:
+        parsed = _pipeline(_lookup(windows), [f for name, f in stages], size=config.pipeline_queue)
+    else:
+        parsed = _sequential(_lookup(windows))
+    for s in parsed:
+        # Windows that are entirely in cache come before the next parsed window.
+        while None not in pending[0][1]:
+            yield _merge()
+        yield _merge(s)
+    while pending:
+        yield _merge()
+
+#--- SENTENCE CACHE ----------------------------------------------------------------------------------
+# Tagged sentences are kept in the sentence cache (in memory),
+# and optionally in a persistent cache on disk (see config.persistent_cache).
+# The persistent cache is invalidated when a file in the models folder changes.
+
+_persistent = None
+
+# With config.pipeline=True, the caches are accessed from different threads.
+_lock = threading.RLock()
+
+def _cache_get(cache, key):
+    _lock.acquire()
+    try:
+        return cache.get(key)
+    finally:
+        _lock.release()
+
+def _cache_set(cache, key, value):
+    _lock.acquire()
+    try:
+        cache[key] = value
+    finally:
+        _lock.release()
+
+def _persistent_cache():
+    """ Returns the PersistentCache in the folder defined in config.persistent_cache, or None.
+    """
+    global _persistent
+    if not config.persistent_cache:
+        return None
+    path = os.path.join(config.persistent_cache, "mbsp.db")
+    if _persistent is None or _persistent.path != path:
+        _persistent = PersistentCache(path, fingerprint=fingerprint(MODELS))
+    return _persistent
+
+def _cached(key):
+    """ Returns the tagged sentence for the given key (sentence + options) from cache, or None.
+    """
+    if config.sentence_cache > 0:
+        s = _cache_get(sentence_cache, key)
+        if config.metrics:
+            metrics.count(s is not None and "cache_hits" or "cache_misses", 1, cache="mbsp.sentence_cache")
+        if s is not None:
+            return s
+    db = _persistent_cache()
+    if db is not None:
+        s = db.get(key)
+        if config.metrics:
+            metrics.count(s is not None and "cache_hits" or "cache_misses", 1, cache="mbsp.persistent_cache")
+        if s is not None and config.sentence_cache > 0:
+            _cache_set(sentence_cache, key, s)
+        return s
+    return None
+
+def _cache(key, s):
+    """ Stores the tagged sentence for the given key (sentence + options) in cache.
+    """
+    if config.sentence_cache > 0:
+        _cache_set(sentence_cache, key, s)
+    db = _persistent_cache()
+    if db is not None:
+        db[key] = s
+
+def _shared_get(key):
+    """ Returns the TokenString for the given key (string + options) from the shared cache, or None.
+        The shared cache is used by all MBSP processes on this host (see shared.py).
+    """
+    c = shared.shared()
+    v = c is not None and c.get("mbsp", key) or None
+    if v is not None:
+        v = cache[key] = TokenString(v[0], v[1], language=v[2])
+    return v
+
+def _shared_set(key, s):
+    """ Stores the given TokenString for the given key in the shared cache.
+    """
+    c = shared.shared()
+    if c is not None:
+        c.set("mbsp", key, (unicode(s), s.tags, s.language))
+
+def _windows(sentences, n=25):
+    """ Yields strings of n sentences separated by a new line, from the given iterable of sentences.
+    """
+    window = []
+    for s in sentences:
+        window.append(s)
+        if len(window) >= n:
+            yield "\n".join(window); window = []
+    if len(window) > 0:
+        yield "\n".join(window)
+
+def _parse(s, tags=True, chunks=True, relations=True, anchors=True, lemmata=True, profile=False):
+    """ Takes a tokenized unicode string where sentences are separated by a new line,
+        and returns a tagged unicode string with the same sentences, one on each line.
+        This is where the servers are contacted, all sentences are sent to each server together.
+    """
+    if config.pipeline and client.prefetched() is None:
+        # The pipeline threads can't answer server requests in an asynchronous parse (see parse_async()).
+        s = _windows([x for x in s.split("\n") if x.strip() != ""], config.pipeline_window)
+    else:
+        s = [s]
+    return "\n".join(_parse_windows(s, tags, chunks, relations, anchors, lemmata, profile))
+
+def _parse_deadline(s, deadline, partial=False, tags=True, chunks=True, relations=True, anchors=True, lemmata=True, profile=False):
+    """ Takes a tokenized unicode string where sentences are separated by a new line,
+        and returns a (tagged unicode string, format)-tuple, parsed before the given deadline (see time.time()).
+        The stages run one after another on all sentences (config.pipeline is not used).
+        When a stage takes too long, a ClientTimeoutError is raised, or with partial=True,
+        the tags completed so far are returned (e.g. chunks without relations and anchors).
+        The output of the completed stages is kept in the stage cache (if enabled), so a next call can resume from there.
+    """
+    format = _format(tags, chunks, relations, anchors, lemmata)
+    stages = _stages(tags, chunks, relations, anchors, lemmata, profile, deadline)
+    stage_cache.size = config.stage_cache
+    for i, (name, f) in enumerate(stages):
+        try:
+            s = f(s)
+        except client.ClientTimeoutError:
+            if not partial or i == 0:
+                raise
+            f = [tag for tag in format if len([x for x in s if tag not in x]) == 0]
+            return _decode_tagged(s, f), f
+    return s, format
+
+#--- PIPELINE ----------------------------------------------------------------------------------------
+
+class _Error:
+    # Wraps an exception raised in a pipeline stage, so it can be raised again in the calling thread.
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+_DONE = object() # Marks the end of the items in a pipeline queue.
+
+def _put(queue, item, stop):
+    # Waits until there is room in the queue, unless the pipeline is stopped.
+    while not stop.isSet():
+        try: queue.put(item, timeout=0.1); return True
+        except Queue.Full:
+            pass
+    return False
+
+def _get(queue, stop):
+    # Waits until there is an item in the queue, unless the pipeline is stopped.
+    while not stop.isSet():
+        try: return queue.get(timeout=0.1)
+        except Queue.Empty:
+            pass
+    return _DONE
+
+def _pipeline(items, stages, size=4):
+    """ Yields the return value of the given stage functions applied one after another to each item, in order.
+        Each stage runs in its own thread, so that stage 2 can process item n while stage 1 processes item n+1.
+        Items are passed from stage to stage through queues with the given maximum size:
+        a stage waits when the next stage has fallen behind, so memory usage is bounded.
+        The items iterable is consumed in a separate thread as well (e.g. a file being tokenized).
+    """
+    stop = threading.Event()
+    queues = [Queue.Queue(size) for i in range(len(stages)+1)]
+    def _feed():
+        try:
+            for x in items:
+                if not _put(queues[0], x, stop): return
+        except:
+            _put(queues[0], _Error(sys.exc_info()), stop); return
+        _put(queues[0], _DONE, stop)
+    def _work(i):
+        while True:
+            x = _get(queues[i], stop)
+            if x is not _DONE and not isinstance(x, _Error):
+                try: x = stages[i](x)
+                except:
+                    x = _Error(sys.exc_info())
+            if not _put(queues[i+1], x, stop) or x is _DONE or isinstance(x, _Error):
+                return
+    threads = [threading.Thread(target=_feed)]
+    threads.extend([threading.Thread(target=_work, args=(i,)) for i in range(len(stages))])
+    for t in threads:
+        t.setDaemon(True); t.start()
+    try:
+        while True:
+            x = _get(queues[-1], stop)
+            if x is _DONE:
+                break
+            if isinstance(x, _Error):
+                raise x.exc_info[0], x.exc_info[1], x.exc_info[2]
+            yield x
+    finally:
+        # Stop all threads, also when the caller stops iterating halfway.
+        stop.set()
+
+def parse(string, tokenize=True, tags=True, chunks=True, relations=True, anchors=True, lemmata=True, encoding=config.encoding, profile=False, deadline=None, partial=False):
+    """ Takes a string of sentences and returns a tagged Unicode string. 
+        Sentences in the output are separated by newline characters. 
+        The input must be a unicode object. If it is a string it will be decoded using config.encoding.
+        - tokenize     : if False no tokenization is carried out (the input must be tokenized already).
+        - tags         : if False doesn't add the part-of-speech tags  (e.g. NN) to the output.
+        - chunks       : if False doesn't add the chunk (e.g. NP) and PNP tags to the output.
+        - relations    : if False doesn't search for relations (-SBJ etc.)
+        - anchors      : if False doesn't search for PNP anchors.
+        - lemmata      : if False doesn't search for lemmata.
+        - encoding     : encoding used to decode the input.
+        - profile      : if True, samples the call stack of each parser stage (see profiler.py).
+        - deadline     : the time (in seconds) in which the string must be parsed, or None.
+        - partial      : if True, returns the tags parsed so far when the deadline expires,
+                         instead of raising a ClientTimeoutError.
+    """
+    if deadline is not None:
+        deadline = time.time() + deadline
+    s = _decode(string, encoding)
+    format, tags, chunks, relations, anchors, lemmata = _options(tags, chunks, relations, anchors, lemmata)
     # Normalize whitespace.
     s = ' '.join(s.strip().split())
     if s.strip() == "": 
@@ -466,16 +989,15 @@ def parse(string, tokenize=True, tags=True, chunks=True, relations=True, anchors
     # Try to load from cache before contacting the servers.
     # The cache key is the input string and all the function settings.
     # If we ever did a full parse of the string (i.e. all parameters = True) that can be reused as well.
+    _configure_caches()
     k1 = s + "".join((str(p) for p in (tokenize, tags, chunks, relations, anchors, lemmata, encoding)))
-    if k1 in cache:
-        return cache[k1]
+    v = cache.get(k1) or _shared_get(k1)
+    if v is not None:
+        return v
     k2 = s + "True"*6 + config.encoding
-    if k2 in cache:
-        s = cache[k2]
-        s = TokenString(s).split() # Remove the tags from the full parse we don't need this time.
-        for tag in list(s.tags):   # Copy TokenList.tags as it will change after TokenList.remove().
-            if not tag in format: s.tags.remove(tag)
-        return s.join()
+    v = cache.get(k2) or _shared_get(k2)
+    if v is not None:
+        return _reduce(v, format)
     # Tokenize if asked for.
     if tokenize:
         # Below are the calls needed to contact the Perl implementation of the tokenizer.
@@ -488,74 +1010,317 @@ def parse(string, tokenize=True, tags=True, chunks=True, relations=True, anchors
         #s = '\n'.join(s)
         #s = s.decode("utf-8")
         f = [WORD]
-        s = _tokenize(s)
+        if profile or config.profile:
+            s = profiler.call("tokenize", _tokenize, s)
+        else:
+            s = _tokenize(s)
         s = _handle_event("on_tokenize", s, format=f)
-    # Encode as a Python byte string.
-    # The MBT and TiMBL clients communicate with socket.send(), which is an octet (byte) stream.
-    s = encode_entities(s)
-    s = s.encode("utf-8")
-    # Tag for part-of-speech tags and chunks.
-    if tags or chunks or relations or anchors or lemmata:
-        f = [WORD, POS, CHUNK]
-        s = _chunk(s)
-        s = _handle_event("on_parse_tags_and_chunks", s, format=f)
-    # Find PNP chunks.
-    if chunks or relations or anchors:
-        f = [WORD, POS, CHUNK, PNP]
-        s = _find_prepositions(s)
-        s = _handle_event("on_parse_prepositions", s, format=f)
-    # Find relations.
-    if relations:
-        f = [WORD, POS, CHUNK, PNP, REL]
-        s = _find_relations(s)
-        s = _handle_event("on_parse_relations", s, format=f)
-    # Find lemmata.
-    if lemmata or anchors:
-        f = [WORD, POS, CHUNK, PNP] + (relations and [REL] or []) + [LEMMA]
-        s = _lemmatize_merge(s, _lemmatize(_lemmatize_prepare(s)))
-        s = _handle_event("on_lemmatize", s, format=f)
-    # Find PP anchors.
-    if anchors:
-        f = [WORD, POS, CHUNK, PNP] + (relations and [REL] or []) + [LEMMA, ANCHOR]
-        s = _find_pp_attachments(s, format=f)
-        s = _handle_event("on_parse_pp_attachments", s, format=f)
-    # Tag juggling.
-    # 1) The parsed string is more readable if the lemmata is at the back,
-    #    but we need the lemmata to find PNP anchors (works 5x faster than using the word),
-    #    so the order of these tags needs to be swapped.
-    # 2) Remove tags that were parsed but weren't asked for.
-    #    For relations and preposition we always need the chunk and PNP tags, 
-    #    for lemmata the part-of-speech tags, but we need to remove these if tags=False or chunks=False.
-    if len(format) > 1 and (not tags or not chunks or not lemmata or anchors):
-        s = [[t.split('/') for t in s.split(" ")] for s in s.split('\n')]
-        def __pop(s, i): 
-            for sentence in s: 
-                for token in sentence: 
-                    del token[i]
-        def __swap(s, i, j):
-            for sentence in s: 
-                for token in sentence: 
-                    token[i], token[j] = token[j], token[i]
-        if anchors and lemmata:
-            __swap(s, -2, -1) # Move lemmata tags to the back of the token.
-        if anchors and not lemmata:
-            __pop(s, -2) # Remove lemmata.
-        if not chunks and (relations or anchors):
-            __pop(s, 3)  # Remove PNP tags.
-        if not chunks:
-            __pop(s, 2)  # Remove chunk tags.
-        if not tags:
-            __pop(s, 1)  # Remove part-of-speech tags.
-        s = '\n'.join([" ".join(["/".join(t) for t in s]) for s in s])
     # Return a splitable unicode TokenString that stores all the tags that were parsed.
     # Store the tagged string in the cache.
-    s = s.strip()
-    s = decode_entities(s, slashes=False)
-    s = s.decode('utf-8')
-    s = TokenString(s, format, language="en")
-    cache[k1] = s
+    if deadline is not None:
+        s, f = _parse_deadline(s, deadline, partial, tags, chunks, relations, anchors, lemmata, profile)
+    else:
+        s, f = _parse(s, tags, chunks, relations, anchors, lemmata, profile), format
+    s = TokenString(s, f, language="en")
+    if f == format:
+        # A string that is partially parsed (see _parse_deadline()) is not cached.
+        cache[k1] = s
+        _shared_set(k1, s)
+    if (profile or config.profile) and config.profile_file:
+        profiler.dump(config.profile_file)
     return s
 
+def _reduce(s, format):
+    """ Removes the tags from the given TokenString that are not in the given format.
+    """
+    s = TokenString(s).split() # Remove the tags from the full parse we don't need this time.
+    for tag in list(s.tags):   # Copy TokenList.tags as it will change after TokenList.remove().
+        if not tag in format: s.tags.remove(tag)
+    return s.join()
+
+def parse_many(strings, tokenize=True, tags=True, chunks=True, relations=True, anchors=True, lemmata=True, encoding=config.encoding):
+    """ Takes an iterable of strings (e.g. documents) and returns a list of tagged TokenStrings,
+        one for each string, with the same options as parse().
+        The sentences of all the strings are sent to each server in one batch, 
+        which is a lot faster than calling parse() for many short strings.
+    """
+    format, tags, chunks, relations, anchors, lemmata = _options(tags, chunks, relations, anchors, lemmata)
+    _configure_caches()
+    parsed  = [] # Parsed TokenString for each string.
+    pending = [] # (index in parsed, cache key, tokenized string)-tuples for strings not in cache.
+    for s in strings:
+        s = _decode(s, encoding)
+        s = ' '.join(s.strip().split())
+        if s == "":
+            parsed.append(TokenString(u"")); continue
+        k1 = s + "".join((str(p) for p in (tokenize, tags, chunks, relations, anchors, lemmata, encoding)))
+        v = cache.get(k1) or _shared_get(k1)
+        if v is not None:
+            parsed.append(v); continue
+        k2 = s + "True"*6 + config.encoding
+        v = cache.get(k2) or _shared_get(k2)
+        if v is not None:
+            parsed.append(_reduce(v, format)); continue
+        if tokenize:
+            s = _tokenize(s)
+            s = _handle_event("on_tokenize", s, format=[WORD])
+        # Empty lines are dropped by the chunker and would shift sentences to the wrong string.
+        s = "\n".join([x for x in s.split("\n") if x.strip() != ""])
+        if s == "":
+            parsed.append(TokenString(u"", format, language="en")); continue
+        pending.append((len(parsed), k1, s))
+        parsed.append(None)
+    if len(pending) > 0:
+        # Parse the sentences of all the strings in one go.
+        # Split the output back per string, and store each string in the cache.
+        s = _parse("\n".join([x[2] for x in pending]), tags, chunks, relations, anchors, lemmata)
+        s = s.split("\n")
+        i = 0
+        for j, k1, x in pending:
+            n = x.count("\n") + 1
+            parsed[j] = TokenString("\n".join(s[i:i+n]), format, language="en")
+            cache[k1] = parsed[j]
+            _shared_set(k1, parsed[j])
+            i += n
+    return parsed
+
+#--- STREAMING PARSER --------------------------------------------------------------------------------
+
+def _read_sentences(file, tokenize=True, encoding=config.encoding, buffer=65536):
+    """ Yields the tokenized sentences in the given file-like object, reading buffer characters at a time.
+        With tokenize=False, each line in the file is expected to be a tokenized sentence.
+        A sentence that is longer than the buffer (or 64K characters) is split, so that memory usage stays bounded.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    quotes = {} # Number of each quote in the sentences so far (i.e. are we inside a quotation?)
+    tail = u""
+    eof  = False
+    while not eof:
+        block = file.read(buffer)
+        eof = len(block) == 0
+        if isinstance(block, str):
+            block = decoder.decode(block, final=eof)
+        s, tail = tail + block, u""
+        if not eof:
+            # The last sentence (or line) may continue in the next block (e.g. "Mr. | Smith").
+            # Its source text is kept and tokenized together with the next block.
+            if tokenize:
+                i = _last_sentence(s)
+            else:
+                i = s.rfind("\n") + 1
+            if len(s) - i > max(buffer, 65536):
+                # The sentence is too long (e.g. no punctuation): only keep the last (incomplete) word.
+                i = max(s.rfind(" "), s.rfind("\n"), s.rfind("\t")) + 1 or len(s)
+            s, tail = s[:i], s[i:]
+        if not tokenize:
+            for x in s.split("\n"):
+                x = " ".join(x.split())
+                if x != "": yield x
+            continue
+        if s.strip() == "":
+            continue
+        for x in tokenizer.split(s, quotes=quotes):
+            yield x
+
+def _last_sentence(string, words=1000, window=10):
+    """ Returns the position in the given untokenized string where the last sentence starts,
+        or 0 if there is no sentence break in the last given number of words.
+        The last line break that is a sentence break is preferred.
+    """
+    # A position is a sentence break if the word before it and the words after it
+    # tokenize the same way apart as together. A sentence break inside a word (e.g. "sat.The") is passed.
+    # The last word is never taken, it may continue in the next block.
+    W = [m.span() for m in re.finditer(r"\S+", string)][-words:]
+    def _break(j):
+        a = string[W[j-1][0]:W[j][0]]
+        b = string[W[j][0]:W[min(len(W), j+window)-1][1]]
+        return tokenizer.split(a + b) == tokenizer.split(a) + tokenizer.split(b)
+    J = range(len(W)-1, 0, -1)
+    for j in J:
+        if "\n" in string[W[j-1][1]:W[j][0]] and _break(j):
+            return W[j][0]
+    for j in J:
+        if not string[W[j-1][0]:W[j-1][1]].isalnum() and _break(j):
+            return W[j][0]
+    return 0
+
+def parse_stream(file, tokenize=True, tags=True, chunks=True, relations=True, anchors=True, lemmata=True, encoding=config.encoding, window=100, buffer=65536):
+    """ Takes a file-like object and yields a tagged TokenString for each sentence, in order,
+        with the same options as parse().
+        The file is read incrementally and sentences are sent to the servers in windows
+        of the given number of sentences, so memory usage does not depend on the size of the file.
+        With tokenize=False, each line in the file is expected to be a tokenized sentence.
+    """
+    format, tags, chunks, relations, anchors, lemmata = _options(tags, chunks, relations, anchors, lemmata)
+    def _tokenized(sentences):
+        for s in _windows(sentences, window):
+            if tokenize:
+                s = _handle_event("on_tokenize", s, format=[WORD])
+            s = "\n".join([x for x in s.split("\n") if x.strip() != ""])
+            if s != "":
+                yield s
+    # With config.pipeline=True, the file is read and tokenized while the servers parse previous windows.
+    sentences = _read_sentences(file, tokenize, encoding, buffer)
+    for s in _parse_windows(_tokenized(sentences), tags, chunks, relations, anchors, lemmata):
+        for s in s.split("\n"):
+            yield TokenString(s, format, language="en")
+
+#--- ASYNCHRONOUS PARSER -----------------------------------------------------------------------------
+# parse_async() parses a string without blocking, in the asyncore event loop (see client.AsyncClient).
+# The parser stages call client.batch(), which raises client.Pending for requests it has no answer for.
+# These are sent with client.batch_async(), and once the responses have arrived the parse is run again.
+# Each AsynchronousParse keeps the tokenized string and the sentence tables between steps,
+# so the tokenizer and the stages that were completed are skipped when the parse is run again,
+# and the stage that was waiting is answered from the responses so far.
+# The lemmatizer runs MBLEM in a separate process, which does block (but only once).
+
+class AsynchronousParse:
+
+    def __init__(self, string, callback=None, timeout=None, **kwargs):
+        """ Parses the given string with parse(string, **kwargs), while asyncore.loop() is running.
+            AsynchronousParse.done is False as long as it is busy.
+            AsynchronousParse.value contains the tagged TokenString once done.
+            AsynchronousParse.error contains the exception raised by the parser or a server client.
+            The optional callback function takes the AsynchronousParse when it is done.
+            The optional timeout is the amount of time per server request before giving up.
+        """
+        self._string   = string
+        self._kwargs   = kwargs
+        self._callback = callback
+        self._timeout  = timeout
+        self._answers  = {} # Server name => dictionary of request => response.
+        self._tables   = {} # Tokenized sentence => table with the tags parsed so far (see _table()).
+        self.value = None
+        self.error = None
+        self.done  = False
+        self._step()
+
+    def _step(self):
+        client.prefetch(self._answers)
+        _local.tables = self._tables
+        try:
+            try:
+                v = parse(self._string, **self._kwargs)
+            finally:
+                client.prefetch(None)
+                _local.tables = None
+        except client.Pending, e:
+            client.batch_async(e.instances, e.client, 
+                lambda responses, error, e=e: self._respond(e, responses, error), timeout=self._timeout)
+            return
+        except Exception, e:
+            self._done(None, e); return
+        self._done(v, None)
+
+    def _respond(self, pending, responses, error):
+        if error is not None:
+            self._done(None, error); return
+        self._answers.setdefault(pending.client[3], {}).update(zip(pending.instances, responses))
+        self._step()
+
+    def _done(self, value, error):
+        self.value = value
+        self.error = error
+        self.done  = True
+        self._answers = {}
+        self._tables  = {}
+        if self._callback is not None:
+            self._callback(self)
+
+    def now(self):
+        """ Runs asyncore.loop() until the parse is done and returns the tagged string.
+        """
+        while not self.done:
+            asyncore.loop(timeout=0.01, count=1)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+def parse_async(string, callback=None, tokenize=True, tags=True, chunks=True, relations=True, anchors=True, lemmata=True, encoding=config.encoding, timeout=None):
+    """ Returns an AsynchronousParse for the given string, which is parsed while asyncore.loop() is running.
+        Many strings can be parsed at the same time without threads: 
+        their requests share a few connections to each server (see config.async_connections).
+        Once done, AsynchronousParse.value is the same as the return value of parse().
+        For example:
+        >>> p = [parse_async(s) for s in strings]
+        >>> while [x for x in p if not x.done]:
+        >>>     asyncore.loop(timeout=0.01, count=1)
+    """
+    return AsynchronousParse(string, callback, timeout, tokenize=tokenize, tags=tags, chunks=chunks, 
+        relations=relations, anchors=anchors, lemmata=lemmata, encoding=encoding)
+
+#--- PARALLEL PARSER ---------------------------------------------------------------------------------
+# The Python side of the parser (tokenizer, PNP finder, relation and PP instances, trees) runs in one process.
+# parse_parallel() distributes the work over a pool of processes (one per CPU core by default),
+# each with its own server clients and cache. The pool is kept alive for the next call.
+
+try:
+    import multiprocessing
+except ImportError:
+    # Python 2.5 has no multiprocessing module.
+    multiprocessing = None
+
+_pool = None # (workers, multiprocessing.Pool)-tuple.
+
+def _parallel_init():
+    # A forked process inherits the parent's open server connections (but not its worker threads).
+    # Drop them, so that each process opens its own connections.
+    client.pools.clear()
+    client.executors.clear()
+    shared.disconnect()
+
+def _parallel_parse_many((strings, options)):
+    return [unicode(s) for s in parse_many(strings, *options)]
+
+def _parallel_parse_sentences((sentences, options)):
+    return _parse("\n".join(sentences), *options)
+
+def _parallel_pool(workers=None):
+    """ Returns a multiprocessing.Pool with the given number of processes.
+    """
+    global _pool
+    if multiprocessing is None:
+        raise ImportError, "parse_parallel() requires the multiprocessing module (Python 2.6+)"
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if _pool is None or _pool[0] != workers:
+        if _pool is not None:
+            _pool[1].terminate()
+        _pool = (workers, multiprocessing.Pool(workers, initializer=_parallel_init))
+    return _pool[1]
+
+def parse_parallel(texts, workers=None, chunksize=None, tokenize=True, tags=True, chunks=True, relations=True, anchors=True, lemmata=True, encoding=config.encoding):
+    """ Takes a list of strings (e.g. documents) and returns a list of tagged TokenStrings, in the same order,
+        with the same options as parse(). The strings are parsed in a pool of processes.
+        If a single string is given, its sentences are divided into shards that are parsed in parallel,
+        and a single TokenString is returned. With tokenize=False, each line is then a tokenized sentence.
+        - workers   : the number of processes (by default, one for each CPU core).
+        - chunksize : the number of strings (or sentences) sent to a process at a time.
+    """
+    pool = _parallel_pool(workers)
+    workers = _pool[0]
+    format, tags, chunks, relations, anchors, lemmata = _options(tags, chunks, relations, anchors, lemmata)
+    if isinstance(texts, basestring):
+        s = _decode(texts, encoding)
+        if tokenize:
+            s = ' '.join(s.strip().split())
+            s = _tokenize(s)
+            s = _handle_event("on_tokenize", s, format=[WORD])
+        s = [' '.join(x.split()) for x in s.split("\n")]
+        s = [x for x in s if x != ""]
+        n = chunksize or max(1, (len(s) + workers*4 - 1) // (workers*4))
+        s = [(s[i:i+n], (tags, chunks, relations, anchors, lemmata)) for i in range(0, len(s), n)]
+        s = pool.map(_parallel_parse_sentences, s)
+        return TokenString("\n".join(s), format, language="en")
+    texts = list(texts)
+    n = chunksize or max(1, (len(texts) + workers*4 - 1) // (workers*4))
+    options = (tokenize, tags, chunks, relations, anchors, lemmata, encoding)
+    texts = [(texts[i:i+n], options) for i in range(0, len(texts), n)]
+    parsed = []
+    for s in pool.map(_parallel_parse_many, texts):
+        parsed.extend([TokenString(x, format, language="en") for x in s])
+    return parsed
+
 #### TOKEN STRING #####################################################################################
 # Facilitates conversion between slash-formatted string and list of tokens.
 # The purpose of TokenString is to bundle the tagged string with a tag representation,
@@ -863,15 +1628,15 @@ def main():
     options, arguments = p.parse_args()
 
     # Either a text file (-f) or a text string (-s) must be supplied.
+    # Text files are parsed incrementally (see parse_stream()), unless XML output is requested.
     sentences = options.string
-    if options.file:
-        import codecs
+    stream = options.file and "xml" not in arguments
+    if options.file and not stream:
         sentences = codecs.open(options.file, "r", options.encoding).read()
 
     # The servers need to be started before anything can be parsed.
     # Otherwise, a ServerConnectionError will be raised.
     if "start" in arguments:
-        import server
         server.servers.start()
     
     # Just for decorational purposes:
@@ -881,7 +1646,7 @@ def main():
     # The given text can be parsed in two modes: 
     # - implicit: parse everything (tokenize, tag/chunk, find relations and anchors, lemmatize).
     # - explicit: define what to parse manually.
-    if sentences:
+    if sentences or stream:
         explicit = False
         for option in [
             options.tokenize, 
@@ -907,29 +1672,48 @@ def main():
         # If a ServerConnectionError occurs,
         # this likely means the servers need to be started first.
         # We can start them automatically if config.autostart=True.
-        try:
-            s = parse(sentences, **attributes)
-        except client.ServerConnectionError:
-            if config.autostart:
-                import server
-                server.servers.start()
+        if stream:
+            # Print each sentence as soon as it is parsed.
+            # A ServerConnectionError can only be recovered from if nothing was printed yet.
+            n, retry = 0, True
+            while True:
+                f = open(options.file, "rb")
+                try:
+                    try:
+                        for s in parse_stream(f, **attributes):
+                            print s; n += 1
+                        break
+                    except client.ServerConnectionError:
+                        if not config.autostart:
+                            raise server.ServerError("the servers have not been started")
+                        if not retry or n > 0:
+                            raise
+                        server.servers.start()
+                        retry = False
+                finally:
+                    f.close()
+        else:
+            try:
                 s = parse(sentences, **attributes)
-            else:
-                raise server.ServerError("the servers have not been started")
-        
-        # The output can be either slash-formatted string or XML.
-        # If it is XML, we need to deduct the token format from the options
-        # (e.g. does a token include relation tag, anchor tag, ...)
-        if "xml" in arguments:
-            from tree import Text
-            s = Text(s, s.tags).xml
-        
-        print s
+            except client.ServerConnectionError:
+                if config.autostart:
+                    server.servers.start()
+                    s = parse(sentences, **attributes)
+                else:
+                    raise server.ServerError("the servers have not been started")
+            
+            # The output can be either slash-formatted string or XML.
+            # If it is XML, we need to deduct the token format from the options
+            # (e.g. does a token include relation tag, anchor tag, ...)
+            if "xml" in arguments:
+                from tree import Text
+                s = Text(s, s.tags).xml
+            
+            print s
     
     # Kill the server processes.
     # This happens when explicitly requested by the user or when config.autostop=True.
     if "stop" in arguments or config.autostop:
-        import server
         server.servers.stop()
     
     # Version info.
@@ -0,0 +1,209 @@
+#### MEMORY-BASED SHALLOW PARSER ######################################################################
+
+# Copyright (c) 2003-2010 University of Antwerp, Belgium and Tilburg University, The Netherlands
+# Vincent Van Asch <vincent.vanasch@ua.ac.be>, Tom De Smedt <tom@organisms.be>
+# License: GNU General Public License, see LICENSE.txt
+
+### METRICS ##########################################################################################
+# Keeps counters and histograms of the work done by the parser and the server clients:
+# - the time spent in each parser stage (see mbsp._stages()), the number of sentences and tokens,
+# - the number of requests sent to each server, the bytes sent and received, the response time,
+# - the number of duplicate instances in each batch that were only sent once.
+# Metrics are only recorded when config.metrics=True, otherwise the overhead is a single if-statement.
+# With config.metrics_file, the metrics are written to the given file every few seconds,
+# in the Prometheus text format (http://prometheus.io/docs/instrumenting/exposition_formats/).
+# Example usage:
+# >>> config.metrics = True
+# >>> parse("The cat sat on the mat.")
+# >>> print registry.stats()["stage_seconds"]["chunk"]["sum"]
+# 0.012
+
+import os, time, threading
+import config
+
+# Upper bounds (in seconds) of the histogram buckets.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Description of each metric, used in the Prometheus # HELP line.
+HELP = {
+           "stage_seconds" : "Time spent in each parser stage.",
+         "stage_sentences" : "Number of sentences processed by each parser stage.",
+            "stage_tokens" : "Number of tokens processed by each parser stage.",
+         "server_requests" : "Number of requests sent to each server.",
+       "server_bytes_sent" : "Number of bytes sent to each server.",
+   "server_bytes_received" : "Number of bytes received from each server.",
+  "server_latency_seconds" : "Time between sending a request to each server (or receiving the previous response of a batch) and receiving the response.",
+         "batch_instances" : "Number of instances passed to client.batch() for each server.",
+        "batch_duplicates" : "Number of instances that were not sent because they occur earlier in the batch.",
+     "classification_hits" : "Number of requests answered from the classification cache of each server.",
+   "classification_misses" : "Number of requests not in the classification cache of each server.",
+"classification_evictions" : "Number of responses removed from the classification cache of each server.",
+           "batch_retries" : "Number of times the unanswered requests of a batch were sent again after a connection error.",
+              "cache_hits" : "Number of sentences found in each parser cache.",
+            "cache_misses" : "Number of sentences not in each parser cache."
+}
+
+#--- HISTOGRAM ---------------------------------------------------------------------------------------
+
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS):
+        """ Counts the observed values (e.g. response times) in buckets with the given upper bounds.
+        """
+        self.buckets = tuple(buckets)
+        self.counts  = [0] * (len(self.buckets) + 1) # The last bucket is +Inf.
+        self.count   = 0
+        self.sum     = 0.0
+
+    def observe(self, value):
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def copy(self):
+        h = Histogram(self.buckets)
+        h.counts, h.count, h.sum = list(self.counts), self.count, self.sum
+        return h
+
+    def __repr__(self):
+        return "Histogram(count=%s, sum=%.4f)" % (self.count, self.sum)
+
+#--- REGISTRY ----------------------------------------------------------------------------------------
+
+class Registry:
+
+    def __init__(self):
+        """ A collection of counters and histograms by name and label (e.g. stage="chunk").
+            Metrics can be recorded from different threads.
+        """
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Sets all counters and histograms to zero.
+        """
+        self._lock.acquire()
+        try:
+            self._counters   = {} # (name, label key, label value) => int
+            self._histograms = {} # (name, label key, label value) => Histogram
+            self._dumped     = time.time()
+        finally:
+            self._lock.release()
+
+    def count(self, name, value=1, **label):
+        """ Increases the counter with the given name and label by the given value,
+            e.g. Registry.count("server_requests", 1, server="chunk").
+        """
+        k = (name,) + label.items()[0]
+        self._lock.acquire()
+        try:
+            self._counters[k] = self._counters.get(k, 0) + value
+        finally:
+            self._lock.release()
+        self._dump()
+
+    def observe(self, name, value, **label):
+        """ Adds the given value to the histogram with the given name and label,
+            e.g. Registry.observe("server_latency_seconds", 0.01, server="chunk").
+        """
+        k = (name,) + label.items()[0]
+        self._lock.acquire()
+        try:
+            if k not in self._histograms:
+                self._histograms[k] = Histogram()
+            self._histograms[k].observe(value)
+        finally:
+            self._lock.release()
+        self._dump()
+
+    def stats(self):
+        """ Returns a dictionary of metric name => dictionary of label => value.
+            For histograms, the value is a dictionary with count, sum and buckets (upper bound => count).
+            The dictionary also has a batch_dedup_ratio for each server:
+            the fraction of instances that didn't need to be sent because of duplicates in the batch.
+        """
+        self._lock.acquire()
+        try:
+            counters   = self._counters.items()
+            histograms = [(k, h.copy()) for k, h in self._histograms.items()]
+        finally:
+            self._lock.release()
+        s = {}
+        for (name, key, label), v in counters:
+            s.setdefault(name, {})[label] = v
+        for (name, key, label), h in histograms:
+            s.setdefault(name, {})[label] = {
+                  "count" : h.count,
+                    "sum" : h.sum,
+                "buckets" : dict(zip(h.buckets + (float("inf"),), h.counts))
+            }
+        for label, n in s.get("batch_instances", {}).items():
+            s.setdefault("batch_dedup_ratio", {})[label] = \
+                n > 0 and float(s.get("batch_duplicates", {}).get(label, 0)) / n or 0.0
+        for label, n in s.get("classification_hits", {}).items():
+            m = n + s.get("classification_misses", {}).get(label, 0)
+            s.setdefault("classification_hit_ratio", {})[label] = float(n) / m
+        return s
+
+    def prometheus(self, prefix="mbsp_"):
+        """ Returns a string with all the metrics in the Prometheus text format.
+            Counters are exported with a _total suffix, histograms with _bucket, _sum and _count.
+        """
+        self._lock.acquire()
+        try:
+            counters   = sorted(self._counters.items())
+            histograms = sorted([(k, h.copy()) for k, h in self._histograms.items()])
+        finally:
+            self._lock.release()
+        lines, typed = [], set()
+        def _header(name, type, suffix=""):
+            if name not in typed:
+                lines.append("# HELP %s%s%s %s" % (prefix, name, suffix, HELP.get(name, name)))
+                lines.append("# TYPE %s%s%s %s" % (prefix, name, suffix, type))
+                typed.add(name)
+        for (name, key, label), v in counters:
+            _header(name, "counter", "_total")
+            lines.append('%s%s_total{%s="%s"} %s' % (prefix, name, key, label, v))
+        for (name, key, label), h in histograms:
+            _header(name, "histogram")
+            n = 0
+            for b, v in zip(h.buckets + ("+Inf",), h.counts):
+                n += v # Prometheus buckets are cumulative.
+                lines.append('%s%s_bucket{%s="%s",le="%s"} %s' % (prefix, name, key, label, b, n))
+            lines.append('%s%s_sum{%s="%s"} %s' % (prefix, name, key, label, repr(h.sum)))
+            lines.append('%s%s_count{%s="%s"} %s' % (prefix, name, key, label, h.count))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """ Writes the metrics to the file at the given path, in the Prometheus text format.
+            The file is replaced at once, so a reader never sees a half-written file.
+        """
+        f = open(path + ".tmp", "w")
+        f.write(self.prometheus())
+        f.close()
+        os.rename(path + ".tmp", path)
+
+    def _dump(self):
+        # Writes the metrics to config.metrics_file every config.metrics_interval seconds.
+        if config.metrics_file and time.time() - self._dumped > config.metrics_interval:
+            self._dumped = time.time()
+            self.dump(config.metrics_file)
+
+registry = Registry()
+
+def count(name, value=1, **label):
+    registry.count(name, value, **label)
+
+def observe(name, value, **label):
+    registry.observe(name, value, **label)
+
+def stats():
+    return registry.stats()
+
+def reset():
+    registry.reset()
@@ -18,9 +18,11 @@ import rules     # Updates specific output from TiMBL.
     
 try:
     from MBSP.cache import Cache
+    from MBSP import shared
 except ImportError:
     # We will end up here if mbsp.py is called directly from the command line.
     from cache import Cache
+    import shared
     
 # Keep the last results of the parser stored in cache for faster retrieval.    
 cache = Cache(size=100, hashed=True)
@@ -33,13 +35,32 @@ def pp_attachments(parsed_string, *args, **kwargs):
         => [(2,3)] 
         => "above" is attached to "fly".
         The given string is the output from MBSP.parse(), with at least POS, CHUNK, PNP tags.
+        It can also be a list of tokens, where each token is a list of tags (see tree.Sentence).
     """
-    k = repr(parsed_string)
-    if k in cache:
-        return cache[k]
-    attachments, sources = classify.get_pp_attachments(parsed_string, *args, **kwargs)
-    attachments = list(attachments)
-    cache[k] = attachments
+    return pp_attachments_many([parsed_string], *args, **kwargs)[0]
+
+def pp_attachments_many(parsed_strings, *args, **kwargs):
+    """ Returns a list of (anchor, PP)-tuples for each of the given parsed strings.
+        Strings that are not in cache are sent to the TiMBL server together in a single batch.
+    """
+    attachments = [None] * len(parsed_strings)
+    pending = []
+    for i, s in enumerate(parsed_strings):
+        k = repr(s)
+        attachments[i] = cache.get(k)
+        if attachments[i] is None and shared.shared() is not None:
+            # Strings parsed in another process are in the shared cache (see shared.py).
+            attachments[i] = shared.shared().get("prepositions", k)
+            if attachments[i] is not None:
+                cache[k] = attachments[i]
+        if attachments[i] is None:
+            pending.append((i, k, s))
+    if pending:
+        x = classify.get_pp_attachments_many([s for i, k, s in pending], *args, **kwargs)
+        for (i, k, s), (a, sources) in zip(pending, x):
+            attachments[i] = cache[k] = list(a)
+            if shared.shared() is not None:
+                shared.shared().set("prepositions", k, attachments[i])
     return attachments
 
-attachments = anchors = pp_attachments
\ No newline at end of file
+attachments = anchors = pp_attachments
@@ -149,24 +149,20 @@ def _tuplify(instances):
         if not instance.predicted.startswith('n-'):
             return instance.instance.anchor, instance.instance.pp
 
-def get_pp_attachments(s, format=[WORD, POS, CHUNK, PNP, LEMMA], timeout=None):
-    """ Takes a parsed string and returns a tuple of tuples ((anchor index, PP index), ...) 
-        and a tuple with info about where the anchor came from (TiMBL/lowest_entropy/baseline).
-        - Lowest entropy is used when different anchor candidates have the same score.
-        - Baseline is used when no candidates where found with TiMBL.
-        The given sentence can also be a Sentence object (see tree.py).
+def _lookup(s, format=[WORD, POS, CHUNK, PNP, LEMMA]):
+    """ Returns a (Sentence, instances)-tuple for the given parsed string (or list of tokens),
+        where instances is a list of lookup instances for the preposition server.
     """
     # Create a parse tree from the parsed string.
     # We need POS, CHUNK and PNP tags, but it works up to 5x faster with LEMMA given.
-    if isinstance(s, (str, unicode)):
+    if isinstance(s, (str, unicode, list, tuple)):
         s = Sentence(s, token=format)
-    # Generate instances from the parse tree.
-    # Send the instances to the TiMBL server.
-    # The batch() function in the client module takes care of managing server clients,
-    # we simply pass it all the tagging jobs and a definition of the client we need.
-    instances = PP_instances(s)
-    instances2= [x.encode(config.encoding)+' ?' for x in instances]
-    tags = batch(instances2, client=(TimblPP, HOST, PORT, config.PREPOSITION, config.log), retries=1)    
+    return s, PP_instances(s)
+
+def _attach(s, instances, tags):
+    """ Returns the (anchor index, PP index)-tuples and their sources for the given Sentence,
+        from the lookup instances and the server's response to each instance.
+    """
     # Tag and group the instances by PP.
     grouped = {}
     for i, x in enumerate(instances):
@@ -191,3 +187,33 @@ def get_pp_attachments(s, format=[WORD, POS, CHUNK, PNP, LEMMA], timeout=None):
     attachments = rules.apply(attachments, s)
     attachments = tuple([x[0] for x in attachments]), tuple([x[1] for x in attachments])
     return attachments
+
+def get_pp_attachments(s, format=[WORD, POS, CHUNK, PNP, LEMMA], timeout=None):
+    """ Takes a parsed string and returns a tuple of tuples ((anchor index, PP index), ...) 
+        and a tuple with info about where the anchor came from (TiMBL/lowest_entropy/baseline).
+        - Lowest entropy is used when different anchor candidates have the same score.
+        - Baseline is used when no candidates where found with TiMBL.
+        The given sentence can also be a Sentence object (see tree.py).
+    """
+    return get_pp_attachments_many([s], format, timeout)[0]
+
+def get_pp_attachments_many(sentences, format=[WORD, POS, CHUNK, PNP, LEMMA], timeout=None):
+    """ Takes a list of parsed strings (or Sentence objects) and returns a list of 
+        (attachments, sources)-tuples, one for each sentence (see get_pp_attachments()).
+        The lookup instances of all the sentences are sent to the TiMBL server in a single batch.
+    """
+    # Generate instances from the parse tree.
+    # Send the instances to the TiMBL server.
+    # The batch() function in the client module takes care of managing server clients,
+    # we simply pass it all the tagging jobs and a definition of the client we need.
+    L = [_lookup(s, format) for s in sentences]
+    instances = []
+    for s, x in L:
+        instances.extend([x.encode(config.encoding)+' ?' for x in x])
+    tags = batch(instances, client=(TimblPP, HOST, PORT, config.PREPOSITION, config.log), timeout=timeout, retries=1)
+    # Split the response back per sentence.
+    attachments, i = [], 0
+    for s, x in L:
+        attachments.append(_attach(s, x, tags[i:i+len(x)]))
+        i += len(x)
+    return attachments
@@ -0,0 +1,213 @@
+#### MEMORY-BASED SHALLOW PARSER ######################################################################
+
+# Copyright (c) 2003-2010 University of Antwerp, Belgium and Tilburg University, The Netherlands
+# Vincent Van Asch <vincent.vanasch@ua.ac.be>, Tom De Smedt <tom@organisms.be>
+# License: GNU General Public License, see LICENSE.txt
+
+### PROFILER #########################################################################################
+# A sampling profiler for the parser stages (see mbsp._stages()) and the server batches (see client.batch()).
+# While a stage is running, the call stack of the thread that runs it is sampled every few milliseconds.
+# Each sample is counted under the stage name and the functions on the stack below it, e.g.:
+# chunk;mbsp.py:_chunk;batch:chunk;client.py:batch_singlethreaded;client.py:send;client.py:_stream 41
+# This is the "collapsed stack" format used by flame graph tools (e.g. flamegraph.pl, speedscope),
+# so it shows at a glance whether the time goes to the tokenizer regular expressions,
+# to string handling in the PP-attacher or to waiting for a server.
+# Unlike cProfile, sampling works across threads (e.g. with config.pipeline=True)
+# and the overhead does not depend on the number of function calls.
+# Example usage:
+# >>> parse("The cat sat on the mat.", profile=True)
+# >>> print profiler.collapsed()
+
+import os, sys, time, thread, threading
+import config
+
+# Frames of the profiler itself are left out of the collapsed stacks.
+_FILE = os.path.splitext(os.path.abspath(__file__))[0]
+
+_labels = {}
+def _label(frame):
+    # The name of the function in a collapsed stack: file:function (without spaces or semicolons),
+    # or None for a function in this module.
+    code = frame.f_code
+    if code not in _labels:
+        f = code.co_filename
+        if os.path.splitext(os.path.abspath(f))[0] == _FILE:
+            _labels[code] = None
+        else:
+            _labels[code] = "%s:%s" % (os.path.basename(f), code.co_name)
+    return _labels[code]
+
+#--- PROFILER ----------------------------------------------------------------------------------------
+
+class Profiler:
+
+    def __init__(self):
+        """ Counts samples of the call stacks of the threads that are running a profiled function.
+            Profiler.stacks is a dictionary of collapsed stack => number of samples.
+        """
+        self.stacks   = {}
+        self.samples  = 0
+        self._threads = {} # thread id => list of (name, frame)-tuples.
+        self._lock    = threading.Lock()
+        self._sampler = None
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.stacks  = {}
+            self.samples = 0
+        finally:
+            self._lock.release()
+
+    def profiling(self):
+        """ Returns True if the current thread is running a profiled function.
+        """
+        return thread.get_ident() in self._threads
+
+    def _push(self, entries):
+        self._lock.acquire()
+        try:
+            self._threads.setdefault(thread.get_ident(), []).extend(entries)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample)
+                self._sampler.setDaemon(True)
+                self._sampler.start()
+        finally:
+            self._lock.release()
+
+    def _pop(self, n=1):
+        self._lock.acquire()
+        try:
+            k = thread.get_ident()
+            del self._threads[k][-n:]
+            if not self._threads[k]:
+                del self._threads[k]
+        finally:
+            self._lock.release()
+
+    def call(self, name, function, *args, **kwargs):
+        """ Returns function(*args, **kwargs), sampling its call stack under the given name.
+            Calls can be nested, e.g. client.batch() inside a parser stage.
+        """
+        self._push([(name, sys._getframe())])
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self._pop()
+
+    def wrap(self, name, function):
+        """ Returns a function that calls the given function with Profiler.call().
+            If the current thread is being profiled, the names it is profiled under are kept,
+            so that work handed to another thread (e.g. a client request) ends up in the same stack.
+        """
+        prefix = [(x, None) for x, frame in self._threads.get(thread.get_ident(), [])]
+        def profiled(*args, **kwargs):
+            self._push(prefix + [(name, sys._getframe())])
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._pop(len(prefix) + 1)
+        return profiled
+
+    def _sample(self):
+        # Runs in the background while there are threads to profile.
+        while True:
+            self._lock.acquire()
+            try:
+                if not self._threads:
+                    self._sampler = None
+                    return
+                threads = [(k, list(entries)) for k, entries in self._threads.items()]
+            finally:
+                self._lock.release()
+            frames = sys._current_frames()
+            for k, entries in threads:
+                s = self._stack(frames.get(k), entries)
+                if s is not None:
+                    self._lock.acquire()
+                    try:
+                        self.stacks[s] = self.stacks.get(s, 0) + 1
+                        self.samples += 1
+                    finally:
+                        self._lock.release()
+            del frames
+            time.sleep(config.profile_interval)
+
+    def _stack(self, frame, entries):
+        # Returns the collapsed stack for the given frame, from the outermost profiled function down.
+        # The frames of Profiler.call() are replaced by the name they were called with.
+        names = dict([(id(f), name) for name, f in entries if f is not None])
+        if not names:
+            return None
+        top = [f for name, f in entries if f is not None][0]
+        s = []
+        while frame is not None:
+            if id(frame) in names:
+                s.append(names[id(frame)])
+                if frame is top:
+                    break
+            elif _label(frame) is not None:
+                s.append(_label(frame))
+            frame = frame.f_back
+        else:
+            # The profiled function returned in the meantime.
+            return None
+        s.extend(reversed([name for name, f in entries if f is None]))
+        s.reverse()
+        return ";".join(s)
+
+    def collapsed(self):
+        """ Returns a string with a collapsed stack and its number of samples on each line,
+            which can be passed to flamegraph.pl to create a flame graph.
+        """
+        self._lock.acquire()
+        try:
+            stacks = sorted(self.stacks.items())
+        finally:
+            self._lock.release()
+        return "\n".join(["%s %s" % (s, n) for s, n in stacks])
+
+    def stats(self):
+        """ Returns a dictionary of stage name => estimated time (in seconds) spent in the stage.
+        """
+        self._lock.acquire()
+        try:
+            stacks = self.stacks.items()
+        finally:
+            self._lock.release()
+        s = {}
+        for k, n in stacks:
+            k = k.split(";")[0]
+            s[k] = s.get(k, 0) + n * config.profile_interval
+        return s
+
+    def dump(self, path):
+        """ Writes the collapsed stacks to the file at the given path.
+        """
+        f = open(path + ".tmp", "w")
+        f.write(self.collapsed() + "\n")
+        f.close()
+        os.rename(path + ".tmp", path)
+
+profiler = Profiler()
+
+def profiling():
+    return profiler.profiling()
+
+def call(name, function, *args, **kwargs):
+    return profiler.call(name, function, *args, **kwargs)
+
+def wrap(name, function):
+    return profiler.wrap(name, function)
+
+def collapsed():
+    return profiler.collapsed()
+
+def stats():
+    return profiler.stats()
+
+def dump(path):
+    profiler.dump(path)
+
+def reset():
+    profiler.reset()
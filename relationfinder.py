@@ -295,14 +295,11 @@ def _instances(index, distance, verbs, verb_map, comma_map, heads, head_index, s
 
 #--- TAG ---------------------------------------------------------------------------------------------
 
-def tag(tagged_string):
-    """ Takes a PNP-tagged sentence and returns a tagged sentence with the added relation tags.
-        Tokens in the input string must contain WORD, POS, CHUNK and PNP tags.
-        Example relation tags: NP-SBJ-1, VP-1, NP-OBJ-1, NP-SBJ-2, ADJP-CLR, ... (see tags.py)
-        Note 1: on rare occasions words can be tagged with multiple relations (e.g. NP-OBJ-1*NP-OBJ-3).
-        Note 2: the separator for multiple relation can be "*" OR ";".
+def _lookup(s):
+    """ Returns the lookup instances for the relation server from a list of tokens from _split().
+        Returns a (instances, verb indices, instance indices, chunks, VP_chunks)-tuple,
+        the last four are needed to place the server's response in the sentence with _place().
     """
-    s = _split(tagged_string)
     verbs, commas, chunks, heads, indices, instance_candidates, VP_chunks = _step1(s)
     distance, comma_map, verb_map = _step2(verbs, commas, chunks, len(s))
     tags = []
@@ -314,9 +311,12 @@ def tag(tagged_string):
         tags.extend(instances)
         V.extend(verb_indices)
         I.extend([i] * len(instances))
-    # The client.batch() function in the client module takes care of managing server clients,
-    # we simply pass it all the tagging jobs and a definition of the client we need.
-    tags = client.batch(tags, client=(client.Timbl, HOST, PORT, config.RELATION, config.log), retries=1)    
+    return (tags, V, I, chunks, VP_chunks)
+
+def _place(s, tags, V, I, chunks, VP_chunks):
+    """ Places the relation tags from the server's response in the list of tokens from _split().
+        Returns the list of relation tags, one for each token.
+    """
     # Getting tags for complete chunks:
     chunk_dict = {}
     for i, tag in enumerate(tags):
@@ -343,6 +343,50 @@ def tag(tagged_string):
             relations.append('VP-%d' % (VP_chunks[i]))
         else:
             relations.append('O')
-    for i in range(len(s)):
-        s[i][4] = relations[i]
-    return _join(s)
+    return relations
+
+def tag(tagged_string):
+    """ Takes a PNP-tagged sentence and returns a tagged sentence with the added relation tags.
+        Tokens in the input string must contain WORD, POS, CHUNK and PNP tags.
+        Example relation tags: NP-SBJ-1, VP-1, NP-OBJ-1, NP-SBJ-2, ADJP-CLR, ... (see tags.py)
+        Note 1: on rare occasions words can be tagged with multiple relations (e.g. NP-OBJ-1*NP-OBJ-3).
+        Note 2: the separator for multiple relation can be "*" OR ";".
+    """
+    return tag_many([tagged_string])[0]
+
+def tag_many(tagged_strings):
+    """ Takes a list of PNP-tagged sentences and returns a list of sentences with the added relation tags.
+        The lookup instances of all the sentences are sent to the relation server in a single batch,
+        so the cost of contacting the server is paid once instead of once per sentence.
+    """
+    S = [_split(s) for s in tagged_strings]
+    for s, relations in zip(S, _relations(S)):
+        for i in range(len(s)):
+            s[i][4] = relations[i]
+    return [_join(s) for s in S]
+
+def tag_columns(sentences):
+    """ Takes a list of (words, parts-of-speech, chunks, PNP)-tuples, one for each sentence,
+        where each item is a list of tags, one for each token.
+        Returns a list of relation tags for each sentence (see tag_many()).
+    """
+    S = [[[w, pos, ch, pnp, i] for i, (w, pos, ch, pnp) in enumerate(zip(*s))] for s in sentences]
+    return _relations(S)
+
+def _relations(S):
+    """ Returns a list of relation tags for each of the given lists of tokens from _split().
+    """
+    L = [_lookup(s) for s in S]
+    tags = []
+    for instances, V, I, chunks, VP_chunks in L:
+        tags.extend(instances)
+    # The client.batch() function in the client module takes care of managing server clients,
+    # we simply pass it all the tagging jobs and a definition of the client we need.
+    tags = client.batch(tags, client=(client.Timbl, HOST, PORT, config.RELATION, config.log), retries=1)
+    # Split the response back per sentence.
+    relations, i = [], 0
+    for s, (instances, V, I, chunks, VP_chunks) in zip(S, L):
+        n = len(instances)
+        relations.append(_place(s, tags[i:i+n], V, I, chunks, VP_chunks))
+        i += n
+    return relations
@@ -245,7 +245,8 @@ class Server:
         ping = None
         try:
             ping = self.client()
-            a = ping.tag(Q, timeout=PING_TIMEOUT)
+            # The ping is always sent to the server, not answered from the classification cache.
+            a = ping.tag(Q, timeout=PING_TIMEOUT, cache=False)
             if A is not None and A.strip() != a.strip():
                 s = "unexpected answer from server '%s':\n'%s' instead of\n'%s'""" % (self.name, a, A)
                 raise ServerResponseError(s)
@@ -257,6 +258,25 @@ class Server:
             del ping; return False
         del ping
         return True
+
+    def started_async(self, callback):
+        """ Checks whether the server is up and running without blocking (see Server.started).
+            Once the server has answered (see asyncore.loop()), callback(started, error) is called
+            with started=True or False, and a ServerResponseError if the answer differs from Server.ping.
+        """
+        Q, A = self.ping is not None and self.ping or (PING_REQUEST, None)
+        ping = client.AsyncClient(client.Client, self.host, self.port, self.name)
+        def _answer(a, error):
+            ping.disconnect()
+            if error is not None:
+                # Client can't connect to server, server must be down or loading.
+                callback(False, None)
+            elif A is not None and A.strip() != a.strip():
+                s = "unexpected answer from server '%s':\n'%s' instead of\n'%s'""" % (self.name, a, A)
+                callback(False, ServerResponseError(s))
+            else:
+                callback(True, None)
+        ping.request(Q, _answer, timeout=PING_TIMEOUT, cache=False)
     
     def client(self):
         """ Returns a Client instance, used to send Server.ping requests.
@@ -434,12 +454,23 @@ MODELS = dict(
 
 active_servers = Servers(start=config.autostart, stop=config.autostop)
 
-for name, port in zip(config.servers, 
-                      config.ports[:len(config.servers)]): 
+# A server can have replicas at different ports (see config.ports and client.batch()).
+# The replicas are started as separate servers, e.g. chunk, chunk-2, chunk-3.
+_replicas = []
+for name, ports in zip(config.servers, 
+                       config.ports[:len(config.servers)]):
+    if not isinstance(ports, (list, tuple)):
+        ports = [ports]
+    for port in ports:
+        n = len([r for r in _replicas if r[0] == name])
+        if port not in [r[2] for r in _replicas if r[0] == name]:
+            _replicas.append((name, n > 0 and "%s-%s" % (name, n+1) or name, port))
+
+for name, replica, port in _replicas:
 
     if name == 'chunk':
         active_servers.append(Server(
-            name = 'chunk', 
+            name = replica, 
             port = port,
          process = MBT,
             ping = (
@@ -451,7 +482,7 @@ for name, port in zip(config.servers,
             
     if name == 'lemma':
         active_servers.append(Server(
-            name = 'lemma', 
+            name = replica, 
             port = port,
          process = TIMBL,
             ping = (
@@ -466,7 +497,7 @@ for name, port in zip(config.servers,
             
     if name == 'relation':
         active_servers.append(Server(
-            name = 'relation', 
+            name = replica, 
             port = port,
          process = TIMBL,
             ping = (
@@ -485,7 +516,7 @@ for name, port in zip(config.servers,
     
     if name == 'preposition':
         active_servers.append(Server(
-            name = 'preposition', 
+            name = replica, 
             port = port,
          process = TIMBL,
             ping = (
@@ -0,0 +1,348 @@
+#### MEMORY-BASED SHALLOW PARSER ######################################################################
+
+# Copyright (c) 2003-2010 University of Antwerp, Belgium and Tilburg University, The Netherlands
+# Vincent Van Asch <vincent.vanasch@ua.ac.be>, Tom De Smedt <tom@organisms.be>
+# License: GNU General Public License, see LICENSE.txt
+
+### SHARED CACHE #####################################################################################
+# A cache shared by the MBSP processes on one host (e.g. the workers of parse_parallel(),
+# or several worker processes behind a job queue), so that a string is parsed once for all of them.
+# The cache is kept by a daemon process that listens on a Unix socket (config.shared_cache).
+# Each process keeps its own cache in front of it (mbsp.cache, prepositions.cache):
+# only the entries that are not in the local cache are looked up in the daemon (a round trip of ~50us).
+# The daemon is started by the first process that needs it (with config.autostart=True),
+# and keeps at most config.shared_cache_bytes of entries, removing the least recently used.
+# If the daemon can't be reached, the shared cache simply misses, and is retried after a few seconds.
+# Only processes of the same user share the cache: the socket can't be used by other users,
+# and a socket that belongs to another user is never connected to (or removed).
+# Example usage:
+# >>> c = shared()
+# >>> c.set("mbsp", "The cat sat on the mat.", (u"The/DT/I-NP ...", ["word", "part-of-speech"]))
+# >>> print c.get("mbsp", "The cat sat on the mat.")
+# From the command line:
+# > python shared.py /tmp/mbsp-1000/cache.sock 268435456
+
+import os, sys, socket, struct, marshal, threading, subprocess, tempfile, time
+import config
+import cache
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl module (and no Unix sockets, the shared cache is then not available).
+    fcntl = None
+
+try:
+    import SocketServer
+except ImportError:
+    SocketServer = None
+
+# Each message starts with an operation, the length of the key and the length of the value:
+# - G key         => the value (empty if the key is not in cache).
+# - S key value   => no answer.
+# - I             => the marshaled cache statistics.
+# - Q             => stops the daemon.
+HEADER = ">cII"
+HEADER_SIZE = struct.calcsize(HEADER)
+LENGTH = ">I"
+LENGTH_SIZE = struct.calcsize(LENGTH)
+
+GET, SET, INFO, QUIT = "G", "S", "I", "Q"
+
+TIMEOUT = 1.0 # Seconds to wait for the daemon to answer.
+RETRY   = 5.0 # Seconds to wait before trying to reach the daemon again.
+
+class SharedCacheError(Exception):
+    pass
+
+def default_path():
+    """ Returns the path of the socket with config.shared_cache=True,
+        in a folder for the current user in the temporary folder (e.g. /tmp/mbsp-1000/cache.sock).
+    """
+    return os.path.join(tempfile.gettempdir(), "mbsp-%s" % os.getuid(), "cache.sock")
+
+def _owned(path):
+    # Returns True if the file at the given path belongs to the current user,
+    # and other users have no permissions for it (i.e. it was not planted by another user).
+    try:
+        s = os.stat(path)
+    except OSError:
+        return False
+    return s.st_uid == os.getuid() and s.st_mode & 0077 == 0
+
+def _read(connection, n):
+    # Returns n bytes from the given socket, or raises an EOFError when it is closed.
+    a = []
+    while n > 0:
+        s = connection.recv(n)
+        if not s:
+            raise EOFError
+        a.append(s); n -= len(s)
+    return "".join(a)
+
+#--- DAEMON ------------------------------------------------------------------------------------------
+
+def _sizeof(k, v):
+    return len(k) + len(v) + cache.ENTRY
+
+if SocketServer is not None and hasattr(socket, "AF_UNIX"):
+
+    class _Handler(SocketServer.BaseRequestHandler):
+
+        def handle(self):
+            # Answers the messages from one MBSP process until it disconnects.
+            c = self.server.cache
+            s = self.request
+            try:
+                while True:
+                    op, n, m = struct.unpack(HEADER, _read(s, HEADER_SIZE))
+                    k = n and _read(s, n) or ""
+                    v = m and _read(s, m) or ""
+                    if op == GET:
+                        v = c.get(k) or ""
+                        s.sendall(struct.pack(LENGTH, len(v)) + v)
+                    elif op == SET:
+                        c[k] = v
+                    elif op == INFO:
+                        v = marshal.dumps(c.stats())
+                        s.sendall(struct.pack(LENGTH, len(v)) + v)
+                    elif op == QUIT:
+                        threading.Thread(target=self.server.shutdown).start()
+                        return
+            except (EOFError, socket.error, struct.error):
+                pass
+
+    class SharedCacheServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+        daemon_threads = True
+
+        def __init__(self, path, budget=None):
+            """ A cache of strings that answers the processes connecting to the Unix socket at the given path,
+                with a thread for each process. The cache holds at most the given number of bytes.
+            """
+            self.path  = path
+            self.cache = cache.Cache(size=sys.maxint, budget=budget, sizeof=_sizeof)
+            SocketServer.UnixStreamServer.__init__(self, path, _Handler)
+
+        def server_close(self):
+            SocketServer.UnixStreamServer.server_close(self)
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+else:
+    SharedCacheServer = None
+
+def serve(path, budget=None):
+    """ Runs the shared cache daemon on the Unix socket at the given path, until it is stopped.
+        If another daemon is already running at the path, returns False.
+        A socket file left behind by a daemon that is no longer running is removed.
+        The socket can only be used by the current user (mode 0600).
+        Raises a SharedCacheError if the file at the path belongs to another user.
+    """
+    if SharedCacheServer is None:
+        raise SharedCacheError, "the shared cache requires Unix sockets"
+    if path == default_path():
+        try:
+            os.mkdir(os.path.dirname(path), 0700)
+        except OSError:
+            pass # Created by another process.
+        if not _owned(os.path.dirname(path)):
+            raise SharedCacheError, "the folder '%s' is not private to this user" % os.path.dirname(path)
+    # Only one process at a time checks whether a daemon is running and binds the socket.
+    # Files created from here on (the lock and the socket) are private to this user.
+    umask = os.umask(0077)
+    try:
+        lock = os.fdopen(os.open(path + ".lock", os.O_WRONLY | os.O_CREAT, 0600), "w")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(path):
+                if not _owned(path):
+                    raise SharedCacheError, "the socket '%s' is not private to this user" % path
+                if _connect(path) is not None:
+                    return False
+                os.remove(path)
+            server = SharedCacheServer(path, budget)
+            os.chmod(path, 0600)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+    finally:
+        os.umask(umask)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    return True
+
+def start(path, budget=None, timeout=5.0):
+    """ Starts the shared cache daemon at the given path in a new process.
+        Returns True when it accepts connections.
+    """
+    if os.path.exists(path) and not _owned(path):
+        return False
+    o = open(os.devnull, "w")
+    try:
+        subprocess.Popen([sys.executable, os.path.splitext(os.path.abspath(__file__))[0] + ".py", path, str(budget or 0)],
+            close_fds=True, stdout=o, stderr=o)
+    finally:
+        o.close()
+    t = time.time()
+    while time.time() - t < timeout:
+        s = _connect(path)
+        if s is not None:
+            s.close(); return True
+        time.sleep(0.05)
+    return False
+
+def stop(path):
+    """ Stops the shared cache daemon at the given path.
+    """
+    s = _connect(path)
+    if s is not None:
+        s.sendall(struct.pack(HEADER, QUIT, 0, 0))
+        s.close()
+
+#--- CLIENT ------------------------------------------------------------------------------------------
+
+def _connect(path, timeout=TIMEOUT):
+    # Returns a socket connected to the daemon at the given path, or None.
+    # A socket that belongs to another user is not trusted: it could send anything to marshal.loads().
+    if not _owned(path):
+        return None
+    try:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(timeout)
+        s.connect(path)
+        return s
+    except (socket.error, AttributeError):
+        return None
+
+class SharedCache:
+
+    def __init__(self, path, budget=None, autostart=False):
+        """ A connection to the shared cache daemon at the given path.
+            Values can be unicode strings, numbers, and lists, tuples and dictionaries of those
+            (they are passed to the daemon with marshal).
+            SharedCache.hits and SharedCache.misses count the lookups with SharedCache.get().
+            With autostart=True, the daemon is started (holding at most budget bytes) if it is not running.
+        """
+        self.path      = path
+        self.budget    = budget
+        self.autostart = autostart
+        self.hits      = 0
+        self.misses    = 0
+        self.errors    = 0 # Number of times the daemon could not be reached.
+        self._socket   = None
+        self._retry    = 0 # The time after which to try to reach the daemon again.
+        self._lock     = threading.Lock()
+
+    def _key(self, namespace, k):
+        if isinstance(k, unicode):
+            k = k.encode("utf-8")
+        return "%s:%s" % (namespace, cache.encrypt(k).hexdigest())
+
+    def _send(self, message, answer=True):
+        # Sends the given message to the daemon and returns the answer (or None), connecting if necessary.
+        # Errors are not raised: the shared cache is skipped for a few seconds instead.
+        if self._socket is None:
+            if time.time() < self._retry:
+                return None
+            self._socket = _connect(self.path)
+            if self._socket is None and self.autostart and start(self.path, self.budget):
+                self._socket = _connect(self.path)
+            if self._socket is None:
+                self.errors += 1
+                self._retry = time.time() + RETRY
+                return None
+        try:
+            self._socket.sendall(message)
+            if answer:
+                n = struct.unpack(LENGTH, _read(self._socket, LENGTH_SIZE))[0]
+                return n and _read(self._socket, n) or ""
+        except (socket.error, EOFError):
+            self.disconnect()
+            self.errors += 1
+            self._retry = time.time() + RETRY
+        return None
+
+    def get(self, namespace, k, default=None):
+        """ Returns the value for the given key in the given namespace (e.g. "mbsp"), or the default value.
+        """
+        k = self._key(namespace, k)
+        self._lock.acquire()
+        try:
+            v = self._send(struct.pack(HEADER, GET, len(k), 0) + k)
+        finally:
+            self._lock.release()
+        if v:
+            try:
+                v = marshal.loads(v)
+                self.hits += 1
+                return v
+            except (ValueError, EOFError, TypeError):
+                # A corrupt value is a miss (it is replaced with the next SharedCache.set()).
+                pass
+        self.misses += 1
+        return default
+
+    def set(self, namespace, k, v):
+        """ Stores the given value for the given key in the given namespace.
+        """
+        k = self._key(namespace, k)
+        v = marshal.dumps(v)
+        self._lock.acquire()
+        try:
+            self._send(struct.pack(HEADER, SET, len(k), len(v)) + k + v, answer=False)
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """ Returns a dictionary with the number of hits and misses in this process,
+            and the number of entries, bytes, hits, misses and evictions in the daemon (if it can be reached).
+        """
+        self._lock.acquire()
+        try:
+            v = self._send(struct.pack(HEADER, INFO, 0, 0))
+        finally:
+            self._lock.release()
+        try:
+            s = v and marshal.loads(v) or {}
+        except (ValueError, EOFError, TypeError):
+            s = {}
+        s["local_hits"] = self.hits
+        s["local_misses"] = self.misses
+        s["errors"] = self.errors
+        return s
+
+    def disconnect(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except socket.error:
+                pass
+        self._socket = None
+
+_shared = None
+
+def shared():
+    """ Returns the SharedCache for the daemon at config.shared_cache, or None if it is disabled.
+        With config.shared_cache=True, the daemon is at default_path().
+    """
+    global _shared
+    if not config.shared_cache or SharedCacheServer is None:
+        return None
+    path = config.shared_cache is True and default_path() or config.shared_cache
+    if _shared is None or _shared.path != path:
+        _shared = SharedCache(path, config.shared_cache_bytes, config.autostart)
+    return _shared
+
+def disconnect():
+    """ Closes the connection to the daemon (e.g. in a forked process, which needs its own connection).
+    """
+    if _shared is not None:
+        _shared.disconnect()
+
+if __name__ == "__main__":
+    serve(len(sys.argv) > 1 and sys.argv[1] or default_path(), len(sys.argv) > 2 and int(sys.argv[2]) or None)
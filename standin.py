@@ -0,0 +1,374 @@
+#### MEMORY-BASED SHALLOW PARSER ######################################################################
+
+# Copyright (c) 2003-2010 University of Antwerp, Belgium and Tilburg University, The Netherlands
+# Vincent Van Asch <vincent.vanasch@ua.ac.be>, Tom De Smedt <tom@organisms.be>
+# License: GNU General Public License, see LICENSE.txt
+
+### STAND-IN SERVER ##################################################################################
+# A pure-Python server that speaks the same line protocol as the TiMBL and MBT servers (see client.py).
+# It can be used to benchmark and load test the clients, batches and the parser pipeline
+# without the compiled Timbl/Mbt executables and their (large) model files.
+# The answers are either recorded (e.g. from client.log) or produced by simple rules,
+# so they are plausible but not accurate: the stand-in is no replacement for the real servers.
+# Each stand-in can answer with a configurable latency and jitter,
+# and it can reply "try again later..." or drop the connection to test error handling.
+# Example usage:
+# >>> s = StandIn("chunk", port=6061, type=MBT, latency=0.005, jitter=0.002)
+# >>> s.start()
+# >>> print client.Mbt(port=6061).send("Make a red oval .")
+# 'Make/VB/I-VP a/DT/I-NP red/JJ/I-NP oval/NN/I-NP ././O'
+# >>> s.stop()
+# From the command line, stand-ins for all the servers in config.py are started with:
+# > python standin.py --latency 0.005
+
+import re, time, random, threading, SocketServer
+import config
+import client
+
+from config import LOCALHOST
+
+MBT, TIMBL = "mbt", "timbl"
+
+# The first line sent to each new connection, the client reads and ignores it.
+BANNER = {
+      MBT : "Welcome to the Mbt server.\n",
+    TIMBL : "Welcome to the Timbl server.\n"
+}
+
+# The response of a multithreaded TiMBL server when the number of allowed connections is exceeded.
+BUSY = "try again later...\n"
+
+#--- RULES -------------------------------------------------------------------------------------------
+# Rule-based answers for each of the MBSP servers.
+# Each rule takes a request (a list of words for MBT, a list of features for TiMBL)
+# and returns the answer (a list of (part-of-speech, chunk)-tuples for MBT, a category for TiMBL).
+
+LEXICON = {
+      "a": "DT",  "an": "DT", "the": "DT", "this": "DT", "that": "DT", "these": "DT", "those": "DT",
+      "i": "PRP", "you": "PRP", "he": "PRP", "she": "PRP", "it": "PRP", "we": "PRP", "they": "PRP",
+    "my": "PRP$", "your": "PRP$", "his": "PRP$", "her": "PRP$", "its": "PRP$", "our": "PRP$", "their": "PRP$",
+     "is": "VBZ", "are": "VBP", "was": "VBD", "were": "VBD", "be": "VB", "been": "VBN", "has": "VBZ",
+   "have": "VBP", "had": "VBD", "do": "VBP", "does": "VBZ", "did": "VBD", "make": "VB", "eat": "VBP",
+    "can": "MD", "could": "MD", "will": "MD", "would": "MD", "should": "MD", "must": "MD", "may": "MD",
+     "in": "IN", "on": "IN", "at": "IN", "with": "IN", "of": "IN", "for": "IN", "from": "IN", "by": "IN",
+  "about": "IN", "into": "IN", "over": "IN", "under": "IN", "as": "IN", "to": "TO",
+    "and": "CC", "or": "CC", "but": "CC", "not": "RB", "very": "RB", "also": "RB", "there": "EX",
+    "red": "JJ", "big": "JJ", "small": "JJ", "good": "JJ", "new": "JJ", "old": "JJ", "black": "JJ",
+}
+
+def _pos(word, previous=None):
+    w = word.lower()
+    if w in LEXICON:
+        return LEXICON[w]
+    if re.match(r"^[^\w&]+$", word, re.U):
+        return word in (".", "!", "?") and "." or word in (",", ";", ":") and word or ":"
+    if re.match(r"^[\d.,]+$", word):
+        return "CD"
+    if word[:1].isupper() and previous is not None:
+        return "NNP"
+    if w.endswith("ly"):
+        return "RB"
+    if w.endswith("ing"):
+        return "VBG"
+    if w.endswith("ed") and len(w) > 4:
+        return "VBD"
+    if w.endswith(("ous", "ful", "ive", "able", "ible", "ical")):
+        return "JJ"
+    if w.endswith("s") and not w.endswith("ss"):
+        return "NNS"
+    if previous in ("PRP", "NNS", "MD", "TO"):
+        return "VB"
+    return "NN"
+
+def _chunk(pos):
+    if pos.startswith(("NN", "DT", "JJ", "PRP", "CD", "EX")):
+        return "NP"
+    if pos.startswith(("VB", "MD")):
+        return "VP"
+    if pos in ("IN", "TO"):
+        return "PP"
+    if pos == "RB":
+        return "ADVP"
+    return None
+
+def tag(words):
+    """ Returns a list of (part-of-speech, chunk)-tuples for the given list of words,
+        using a small lexicon and suffix rules. Chunk tags use the I-/B- notation of MBT.
+    """
+    tags, p, c = [], None, None
+    for w in words:
+        pos = _pos(w, p)
+        ch  = _chunk(pos)
+        if ch is None:
+            tags.append((pos, "O"))
+        elif ch == c and (pos in ("DT", "PRP$") or ch == "PP"):
+            # A determiner after a noun starts a new noun phrase.
+            tags.append((pos, "B-" + ch))
+        else:
+            tags.append((pos, "I-" + ch))
+        p, c = pos, ch
+    return tags
+
+def relation(features):
+    """ Returns the relation category for a relation finder instance (see relationfinder._instances()):
+        a noun phrase before the verb is the subject, a noun phrase after the verb the object.
+    """
+    try:
+        d, ch = int(features[0]), features[14]
+    except (ValueError, IndexError):
+        return "-"
+    if ch != "NP" or d == 0:
+        return "-"
+    return d < 0 and "NP-SBJ" or "NP-OBJ"
+
+def attachment(features):
+    """ Returns the category for a PP-attacher instance (see prepositions.classify._PP_instance()):
+        the PP is attached to the nearest chunk.
+    """
+    try:
+        d, pos = int(features[2]), features[5]
+    except (ValueError, IndexError):
+        return "n-NP"
+    c = pos.startswith("VB") and "VP" or "NP"
+    return abs(d) <= 1 and c or "n-" + c
+
+def lemma(features):
+    """ Returns the MBLEM transformation class for a lemmatizer instance: the word is its own lemma.
+    """
+    return "0"
+
+RULES = {
+        config.CHUNK : tag,
+     config.RELATION : relation,
+  config.PREPOSITION : attachment,
+        config.LEMMA : lemma
+}
+
+#--- PROTOCOL ----------------------------------------------------------------------------------------
+
+def _key(request):
+    # Requests are compared without the TiMBL "c" prefix and "?" suffix,
+    # so that client.log entries (which store the unformatted requests) can be replayed.
+    v = request.strip()
+    if v.startswith("c "): v = v[2:]
+    if v.endswith(" ?"): v = v[:-2]
+    return v.strip()
+
+def timbl_response(category, verbosity=[]):
+    """ Returns a TiMBL response line for the given category, e.g.
+        CATEGORY {VP} DISTRIBUTION { VP 2.00000, n-VP 1.00000 } DISTANCE {0.000000}
+        The distribution and distance are only included if "db" and "di" are in the given verbosity.
+    """
+    v = "CATEGORY {%s}" % category
+    if "db" in verbosity:
+        other = category.startswith("n-") and category[2:] or "n-" + category
+        v += " DISTRIBUTION { %s 2.00000, %s 1.00000 }" % (category, other)
+    if "di" in verbosity:
+        v += " DISTANCE {0.000000}"
+    return v + "\n"
+
+def mbt_response(words, tags):
+    """ Returns an MBT response line for the given list of words and (part-of-speech, chunk)-tuples.
+    """
+    return " ".join(["%s/%s/%s" % (w, pos, ch) for w, (pos, ch) in zip(words, tags)]) + " <utt>\n"
+
+#--- STAND-IN SERVER ---------------------------------------------------------------------------------
+
+class _Handler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        s = self.server.standin
+        if not s._connect():
+            # More connections than allowed: TiMBL answers "try again later..." and hangs up.
+            self.wfile.write(BUSY); return
+        try:
+            self.wfile.write(BANNER[s.type])
+            while True:
+                request = self.rfile.readline()
+                if not request or request.strip() == "exit":
+                    break
+                if request.strip() == "":
+                    continue
+                response = s.respond(request)
+                if response is None:
+                    break # Simulated disconnect.
+                self.wfile.write(response)
+                self.wfile.flush()
+        finally:
+            s._disconnect()
+
+class _Server(SocketServer.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def handle_error(self, request, address):
+        # Clients that hang up in the middle of a response are common in a load test.
+        pass
+
+class StandIn:
+
+    def __init__(self, name, host=LOCALHOST, port=6060, type=TIMBL, rule=None, recorded={}, verbosity=[],
+                 latency=0.0, jitter=0.0, busy=0.0, disconnect=0.0, connections=None, seed=None):
+        """ A pure-Python stand-in for a TiMBL or MBT server, running in a background thread.
+            - name        : the server name, e.g. "chunk", used to select the default rule.
+            - host        : localhost by default.
+            - port        : the port at the host through which tcp communication is established.
+            - type        : either TIMBL or MBT, the protocol to speak.
+            - rule        : a function that returns the answer to a request (see RULES).
+            - recorded    : a dictionary of request => response line, answered instead of the rule.
+            - verbosity   : a list of TiMBL verbosity options included in the response, e.g. [DI, DB].
+            - latency     : the average time (in seconds) before each response.
+            - jitter      : the maximum random deviation (in seconds) from the latency.
+            - busy        : the probability of answering "try again later..." to a request.
+            - disconnect  : the probability of closing the connection instead of answering a request.
+            - connections : the maximum number of concurrent connections, or None.
+            - seed        : the random seed for jitter and errors, so that a load test can be repeated.
+        """
+        self.name        = name
+        self.host        = host
+        self.port        = port
+        self.type        = type
+        self.rule        = rule or RULES.get(name, type == MBT and tag or (lambda features: "-"))
+        self.recorded    = dict([(_key(k), v) for k, v in recorded.items()])
+        self.verbosity   = verbosity
+        self.latency     = latency
+        self.jitter      = jitter
+        self.busy        = busy
+        self.disconnect  = disconnect
+        self.connections = connections
+        self.requests    = 0 # The number of requests received.
+        self.active      = 0 # The number of open connections.
+        self._random     = random.Random(seed)
+        self._lock       = threading.Lock()
+        self._server     = None
+        self._thread     = None
+
+    def record(self, log):
+        """ Adds the requests and responses from the given client log (e.g. client.log[CHUNK])
+            to the recorded answers. Requests are logged when config.log=True.
+        """
+        for request, response in log.items():
+            self.recorded[_key(request)] = response
+
+    def load(self, path):
+        """ Adds the recorded answers from the given file, with a request and response on each line,
+            separated by a tab.
+        """
+        for x in open(path):
+            if "\t" in x:
+                request, response = x.rstrip("\r\n").split("\t", 1)
+                self.recorded[_key(request)] = response + "\n"
+
+    def answer(self, request):
+        """ Returns the response line for the given request (recorded or rule-based).
+        """
+        k = _key(request)
+        if k in self.recorded:
+            return self.recorded[k]
+        if self.type == MBT:
+            words = k.split()
+            return mbt_response(words, self.rule(words))
+        return timbl_response(self.rule(k.split()), self.verbosity)
+
+    def respond(self, request):
+        """ Returns the response for the given request after waiting for the latency,
+            or "try again later..." or None (= disconnect) with the given probability.
+        """
+        self._lock.acquire()
+        try:
+            self.requests += 1
+            r = self._random.random()
+            d = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        finally:
+            self._lock.release()
+        if d > 0:
+            time.sleep(d)
+        if r < self.disconnect:
+            return None
+        if r < self.disconnect + self.busy:
+            return BUSY
+        return self.answer(request)
+
+    def _connect(self):
+        self._lock.acquire()
+        try:
+            if self.connections is not None and self.active >= self.connections:
+                return False
+            self.active += 1
+            return True
+        finally:
+            self._lock.release()
+
+    def _disconnect(self):
+        self._lock.acquire()
+        try:
+            self.active -= 1
+        finally:
+            self._lock.release()
+
+    def start(self):
+        """ Starts listening at host:port in a background thread.
+            Raises a socket.error if the port is in use (e.g. by a real server).
+        """
+        if self._server is None:
+            self._server = _Server((self.host, self.port), _Handler)
+            self._server.standin = self
+            self._thread = threading.Thread(target=self._server.serve_forever)
+            self._thread.setDaemon(True)
+            self._thread.start()
+
+    def stop(self):
+        """ Stops listening. Open connections are closed when the client disconnects.
+        """
+        if self._server is not None:
+            if hasattr(self._server, "shutdown"):
+                self._server.shutdown() # Python 2.6+
+            self._server.server_close()
+            self._server = None
+            self._thread = None
+
+    @property
+    def started(self):
+        return self._server is not None
+
+    def __repr__(self):
+        return "<StandIn name='%s', type='%s', port=%s>" % (self.name, self.type, self.port)
+
+def standins(**kwargs):
+    """ Returns a list of stand-ins for the servers in config.py (not yet started).
+        The optional parameters (e.g. latency) are passed to each StandIn.
+    """
+    a = []
+    for name, hosts, ports in zip(config.servers, config.hosts, config.ports):
+        # A server with replicas (see config.ports) gets a stand-in for each replica.
+        for host, port in client.endpoints(hosts, ports):
+            if (host, port) in [(s.host, s.port) for s in a]:
+                continue
+            a.append(StandIn(name, host, port,
+                     type = name == config.CHUNK and MBT or TIMBL,
+                verbosity = name == config.PREPOSITION and ["di", "db"] or [], **kwargs))
+    return a
+
+#-----------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+    p = OptionParser(usage="python standin.py [options]")
+    p.add_option("-l", "--latency", type="float", default=0.0, help="response time in seconds")
+    p.add_option("-j", "--jitter", type="float", default=0.0, help="response time deviation in seconds")
+    p.add_option("-b", "--busy", type="float", default=0.0, help="probability of 'try again later...'")
+    p.add_option("-d", "--disconnect", type="float", default=0.0, help="probability of a disconnect")
+    p.add_option("-c", "--connections", type="int", default=None, help="maximum concurrent connections")
+    p.add_option("-s", "--seed", type="int", default=None, help="random seed")
+    o, arguments = p.parse_args()
+    S = standins(latency=o.latency, jitter=o.jitter, busy=o.busy, disconnect=o.disconnect,
+                 connections=o.connections, seed=o.seed)
+    for s in S:
+        s.start()
+        print s
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for s in S:
+            s.stop()
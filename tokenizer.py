@@ -643,12 +643,15 @@ quotes = ["\"", "'", "''", "'''", "\"\"\""]
 ASSERT = "assert"
 SENTENCE_BREAK  = "SENTENCE___BREAK"
 
-def add_sentence_breaks(words=[], marker=SENTENCE_BREAK):
+def add_sentence_breaks(words=[], marker=SENTENCE_BREAK, quote_count=None):
     """ Returns the list of words with injected SENTENCE_BREAK markers.
         ["Hello", ".", "Having", "fun", "?"] =>
         ["Hello", ".", SENTENCE_BREAK, "Having", "fun", "?", SENTENCE_BREAK]
+        The optional quote_count dictionary holds the number of each quote in the preceding text,
+        and is updated with the quotes in the words.
     """
-    quote_count = {}
+    if quote_count is None:
+        quote_count = {}
     p, i, n = [], 0, len(words)
     stop = False
     for i in range(n):
@@ -762,12 +765,14 @@ unicode_replacements = {
 # Word ranges to ignore when splitting.
 ignore = [abbreviations, numeric, URI, entities, biomedical]
 
-def split(string, tags=False, citations=False, replace=unicode_replacements, ignore=ignore):
+def split(string, tags=False, citations=False, replace=unicode_replacements, ignore=ignore, quotes=None):
     """ Splits the string into a list of sentences.
         Punctuation is split from words as individual tokens.
         With tags=False, removes SGML-tags (i.e. anything resembling "<...>") first.
         With citations=True, cited sentences in quotes are kept together.
         The replace dictionary contains (unicode) strings to normalize.
+        The quotes dictionary holds the number of each quote in the preceding text, when a text
+        is split in parts (e.g. mbsp.parse_stream()), and is updated - see add_sentence_breaks().
     """
     # Make sure we have a unicode string.
     if isinstance(string, str):
@@ -793,7 +798,7 @@ def split(string, tags=False, citations=False, replace=unicode_replacements, ign
             p.extend(split_word(word, ignore=ignore, previous=i>0 and words[i-1] or None))
     # Add sentence breaks after periods and other punctuation that indicate the end of the sentence.
     # Parse sentence breaks and create a list of individual sentence strings.
-    p = add_sentence_breaks(p)
+    p = add_sentence_breaks(p, quote_count=quotes)
     p = citations and ignore_cited_breaks(p) or p
     p = split_sentences(p)
     p = [" ".join(sentence) for sentence in p]
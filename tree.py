@@ -537,7 +537,13 @@ class Sentence:
         self._previous   = None # Helper variable: the last token parsed in parse_token().
         self.relations   = { "SBJ":{}, "OBJ":{}, "VP":{} }
         
-        for chars in string.split(" "):
+        # The input can also be a list of tokens, where each token is a list of tags,
+        # e.g. [[u"The", u"DT"], [u"cat", u"NN"]] (see mbsp._find_pp_attachments()).
+        if isinstance(string, (list, tuple)):
+            tokens = string
+        else:
+            tokens = string.split(" ")
+        for chars in tokens:
             if len(chars) > 0:
                 # Split the slash-formatted token into the separate tags according to the given order.
                 # Append Word and Chunk objects according to the token's tags.
@@ -653,6 +659,7 @@ class Sentence:
             a/DT/B-NP/I-PNP/NP/P1/a 
             fork/NN/I-NP/I-PNP/NP/P1/fork 
             ././O/O/O/O/.
+            The token can also be given as a list of tags, e.g. [u"airplane", u"NN"].
             Returns a (word, lemma, type, chunk, role, relation, preposition, anchor, iob, custom)-tuple,
             i.e. you can do Sentence.append(*Sentence.parse_token("airplane/NN"))
             The custom value is a dictionary of (tag, value)-items of unrecognized tags in the token.
@@ -671,7 +678,8 @@ class Sentence:
         # Split the slash-formatted token into the separate tags according to the given order.
         # Convert &slash; characters (usually in words and lemmata).
         # Assume None for missing tags (except the word itself, which defaults to an empty string).
-        token = token.split("/")
+        if isinstance(token, basestring):
+            token = token.split("/")
         for i in range(min(len(token), len(tags))):
             if token[i] != OUTSIDE \
              or tags[i] in (WORD, LEMMA): # In "O is part of the alphabet" => "O" != OUTSIDE.